@@ -1,20 +1,162 @@
-"""Main AstroPlan Application"""
-
-import argparse
-from time import perf_counter
-
-from src import constants, settings, utils
-from src.main import main
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        prog="AstroPlan", epilog="Based on original work by James Lamb (https://www.youtube.com/@Aero19612)"
-    )
-    parser.add_argument("-i", "--ini", default=constants.default_ini_file)
-    args = parser.parse_args()
-    print("Starting...")
-    print(f"Using ini file: {args.ini}")
-
-    global_start_time = perf_counter()
-    main(user=settings.read_settings(args.ini))
-    utils.print_elapsed_time("Completed", global_start_time)
+"""Main AstroPlan Application"""
+
+import argparse
+import dataclasses
+from time import perf_counter
+
+from src import constants, instrumentation, progress, server, settings, utils
+from src.main import (
+    list_tonight,
+    plot_dsos,
+    plot_global,
+    regenerate_outputs,
+    run_sites,
+    sweep_filters,
+)
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="AstroPlan", epilog="Based on original work by James Lamb (https://www.youtube.com/@Aero19612)"
+    )
+    parser.add_argument(
+        "-i",
+        "--ini",
+        nargs="+",
+        default=[constants.default_ini_file],
+        help="one or more ini files: several observing sites are run together",
+    )
+    parser.add_argument(
+        "-s",
+        "--sites",
+        metavar="SITES_FILE",
+        help="run every site of this table (CSV file), with all other settings from the (first) ini file",
+    )
+    parser.add_argument(
+        "-p",
+        "--plot",
+        nargs="+",
+        metavar="DSO",
+        help="only plot these DSOs (e.g. M_31 NGC_7000), from the results of the last run, without simulating",
+    )
+    parser.add_argument(
+        "-g",
+        "--global-plots",
+        action="store_true",
+        help="only make the global plots, from the result store of the last run, without simulating",
+    )
+    parser.add_argument(
+        "-r",
+        "--regenerate",
+        action="store_true",
+        help="only write the DSO list and make the DSO and global plots again, from the result store of the last run, "
+        "without simulating",
+    )
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="only list the included DSOs for every combination of the filter values of the [Sweep] section, "
+        "from the last run, without simulating",
+    )
+    parser.add_argument(
+        "-t",
+        "--tonight",
+        nargs="?",
+        type=positive_int,
+        const=1,
+        metavar="NIGHTS",
+        help="only list the best DSOs of tonight (or of the next NIGHTS nights), without plots or result files",
+    )
+    parser.add_argument(
+        "--serve",
+        nargs="?",
+        type=int,
+        const=constants.server_port,
+        metavar="PORT",
+        help=f"only answer planning queries (best DSOs of a month, or of tonight) for any observer, over HTTP on "
+        f"localhost (default port: {constants.server_port}), until interrupted",
+    )
+    parser.add_argument(
+        "--no-plots",
+        action="store_true",
+        help="only write the data files (DSO list, local catalog and result store): no plots, as with Enabled = no in "
+        "the [Plots] section",
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", help="no progress line while the simulations and DSO plots run"
+    )
+    parser.add_argument(
+        "--log",
+        metavar="LOG_FILE",
+        help="write the name of every object simulated or plotted by the pool workers to this file",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="TRACE_FILE",
+        help="time the stages of the run and count its work, in this process and in the pool workers, then print a "
+        "summary and save it as a Chrome trace (JSON) to this file",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=constants.profile_file,
+        metavar="PROFILE_FILE",
+        help=f"also profile the pool jobs with cProfile, and save their merged statistics to this file "
+        f"(default: {constants.profile_file})",
+    )
+    args = parser.parse_args()
+    print("Starting...")
+    print(f"Using ini file: {', '.join(args.ini)}")
+
+    global_start_time = perf_counter()
+    progress.configure(quiet=args.quiet, log_file=args.log)
+    if args.trace or args.profile:
+        instrumentation.enable(profile=bool(args.profile))
+    prepare_results = not (
+        args.plot or args.global_plots or args.regenerate or args.sweep or args.tonight is not None or args.serve
+    )
+    if args.sites:
+        print(f"Using sites file: {args.sites}")
+        sites = settings.read_sites(args.sites, args.ini[0], prepare_results=False)
+    else:
+        sites = [settings.read_settings(ini, prepare_results=False) for ini in args.ini]
+
+    if args.no_plots:
+        sites = [dataclasses.replace(user, make_plots=False) for user in sites]
+    if prepare_results:
+        # Once the settings are final: whether plots are made decides what clearing the results folders keeps
+        for user in sites:
+            settings.prepare_results_folder(user)
+
+    with instrumentation.stage("run"):
+        if args.serve:
+            server.serve(sites[0], port=args.serve)
+        elif prepare_results:
+            run_sites(sites)
+        else:
+            for user in sites:
+                if args.tonight is not None:
+                    list_tonight(user, nights=args.tonight)
+                if args.plot:
+                    plot_dsos(args.plot, user=user)
+                if args.global_plots:
+                    plot_global(user=user)
+                if args.regenerate:
+                    regenerate_outputs(user=user)
+                if args.sweep:
+                    sweep_filters(user=user)
+    utils.print_elapsed_time("Completed", global_start_time)
+
+    if instrumentation.is_enabled():
+        instrumentation.print_report()
+        if args.trace:
+            instrumentation.save_trace(args.trace)
+        if args.profile:
+            instrumentation.save_profile(args.profile)
@@ -0,0 +1,67 @@
+"""Benchmark: time per DSO of the analytic engine vs. the vectorized (sampled) engine, and how closely they agree
+
+Run from the repository root: python -m benchmarks.engines [--ini astroplan.ini] [--count N]
+"""
+
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from src import catalog, ephemeris, horizon, settings, simulator
+from src.models import SimJobArgs
+
+
+def time_engine(calc_time_series, ra, dec, effective_horizon, night_ephemeris, user):
+    start_time = perf_counter()
+    time_series = calc_time_series(ra, dec, effective_horizon, night_ephemeris, user)
+    return time_series, (perf_counter() - start_time) / len(ra)
+
+
+def compare_results(sampled, analytic, effective_horizon, night_ephemeris, user):
+    # Included DSOs on which the engines disagree, and difference of the best dates of the others (days)
+    def make_result(time_series):
+        return simulator.make_result(
+            SimJobArgs(0, "", False, 0.0, 0.0, 0.0, effective_horizon, night_ephemeris, user), time_series
+        )
+
+    num_mismatches, date_differences = 0, []
+    for sampled_result, analytic_result in zip(map(make_result, sampled), map(make_result, analytic)):
+        if sampled_result.is_included != analytic_result.is_included:
+            num_mismatches += 1
+        elif sampled_result.is_included:
+            date_differences.append(abs(int((sampled_result.max_date - analytic_result.max_date).astype(int))))
+    return num_mismatches, np.array(date_differences)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="engines")
+    parser.add_argument("--ini", default="astroplan.ini", help="observer, horizon, filters and catalog settings")
+    parser.add_argument("--count", type=int, default=500, help="number of (random) catalog DSOs")
+    args = parser.parse_args()
+
+    user = settings.read_settings(args.ini, prepare_results=False)
+    rows = catalog.load(user).rows
+    rows = rows[np.random.default_rng(0).choice(len(rows), min(args.count, len(rows)), replace=False)]
+    ra, dec = np.radians(rows["ra"]), np.radians(rows["dec"])
+    effective_horizon = horizon.load_data(user)
+    night_ephemeris = ephemeris.build(user)
+
+    engine_args = (ra, dec, effective_horizon, night_ephemeris, user)
+    sampled, sampled_time = time_engine(simulator.calc_time_series, *engine_args)
+    analytic, analytic_time = time_engine(simulator.calc_analytic_time_series, *engine_args)
+    differences = np.abs(analytic - sampled)[..., 1:].reshape(-1, 4)
+    num_mismatches, date_differences = compare_results(sampled, analytic, effective_horizon, night_ephemeris, user)
+
+    print(f"Simulation engines ({len(ra)} DSOs, {len(night_ephemeris.night_dates)} nights):")
+    print(f"\t- Vectorized: {sampled_time * 1000:.2f} ms per DSO")
+    print(f"\t- Analytic:   {analytic_time * 1000:.2f} ms per DSO ({sampled_time / analytic_time:.1f}x)")
+    print("Analytic vs. vectorized, per night (max / 99.9th percentile):")
+    for k, name in enumerate(("Min altitude (deg)", "Max altitude (deg)", "Hours visible", "Score")):
+        print(f"\t- {name:<19} {differences[:, k].max():.3f} / {np.percentile(differences[:, k], 99.9):.3f}")
+    print(f"\t- Included DSOs that differ: {num_mismatches}")
+    if len(date_differences):
+        print(
+            f"\t- Best date (days): {np.mean(date_differences == 0):.0%} same, "
+            f"{np.mean(date_differences <= 3):.0%} within 3 days"
+        )
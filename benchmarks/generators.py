@@ -0,0 +1,92 @@
+"""Deterministic synthetic inputs for the benchmarks: Stellarium-format catalogs, horizon files and settings files,
+so that performance can be measured offline, without the real Stellarium catalog"""
+
+from pathlib import Path
+
+import numpy as np
+
+from src import constants
+
+# Types drawn for synthetic DSOs: most are simulated, some are filtered out by type
+catalog_types = ["G", "Gx", "AGx", "NB", "PN", "DN", "RN", "HII", "SNR", "EN", "OC", "GC", "*"]
+
+
+def write_catalog(path: Path, count: int, seed: int = 0):
+    # Catalog of count DSOs, spread uniformly over the sky, each listed in one of the desired catalogs (or none)
+    rng = np.random.default_rng(seed)
+    ra = rng.uniform(0.0, 360.0, count)
+    dec = np.degrees(np.arcsin(rng.uniform(-1.0, 1.0, count)))
+    major_axis = rng.exponential(15.0, count)
+    minor_axis = major_axis * rng.uniform(0.2, 1.0, count)
+    types = rng.choice(catalog_types, count)
+    catalog_columns = list(constants.catalogs.values())
+    listed_in = rng.choice(len(catalog_columns) + 1, count, p=[0.05, 0.05, 0.5, 0.3, 0.1])  # Last: not listed
+
+    with open(path, "w") as f:
+        f.write("## Synthetic Stellarium DSO catalog (benchmarks)\n")
+        f.write("# ID\tRA\tDec\t...\n")
+        for k in range(count):
+            fields = ["0"] * constants.stellarium_field_count
+            fields[0] = str(k + 1)
+            fields[1] = f"{ra[k]:.5f}"
+            fields[2] = f"{dec[k]:.5f}"
+            fields[5] = types[k]
+            fields[7] = f"{major_axis[k]:.2f}"
+            fields[8] = f"{minor_axis[k]:.2f}"
+            for column in catalog_columns:
+                fields[column] = ""
+            if listed_in[k] < len(catalog_columns):
+                fields[catalog_columns[listed_in[k]]] = str(k + 1)
+            f.write("\t".join(fields) + "\n")
+
+
+def write_horizon(path: Path, resolution: float, seed: int = 0):
+    # Horizon with a point every resolution degrees of azimuth: a few hills between 5 and 40 deg, plus some clutter
+    rng = np.random.default_rng(seed)
+    azimuth = np.arange(0.0, 360.0, resolution)
+    altitude = np.full_like(azimuth, 20.0)
+    for harmonic in range(1, 6):
+        altitude += rng.uniform(0.0, 8.0 / harmonic) * np.sin(
+            np.radians(harmonic * azimuth) + rng.uniform(0, 2 * np.pi)
+        )
+    altitude = np.clip(altitude + rng.normal(0.0, 0.5, len(azimuth)), 5.0, 40.0)
+    np.savetxt(path, np.column_stack((azimuth, altitude)), fmt="%.3f")
+
+
+def write_settings(path: Path, catalog_file: Path, horizon_file: Path, results_path: Path, **options):
+    # Settings file for a run on synthetic inputs. options override the [Simulation] and [Parallelism] settings
+    # (engine, pool_size, days)
+    path.write_text(f"""[Observer]
+Latitude = 33.4
+Longitude = -111.8
+HorizonFile = {horizon_file}
+HorizonResolution = 0.01
+
+[Filters]
+MinObservationHours = 5.0
+MinObservationPeakAltitude = 45.0
+MinObservationAltitude = 20.0
+MinDSOSize = 10.0
+
+[Catalog]
+CatalogFile = {catalog_file}
+MinCatalogIndex = 1
+MaxCatalogIndex =
+
+[Simulation]
+Engine = {options.get("engine", "vectorized")}
+StartDate = 2025-01-01
+Days = {options.get("days", 365)}
+
+[Cache]
+Folder =
+
+[Parallelism]
+MaxParallelJobs = {options.get("pool_size", 4)}
+BlockSize =
+MemoryBudgetMB = 1024
+
+[Output]
+Results = {results_path}
+ClearResultsBeforeRunning = yes
+""")
@@ -0,0 +1,95 @@
+"""Benchmark: time per DSO plot, building a new figure for every DSO vs. rendering into a figure template
+
+Run from the repository root: python -m benchmarks.plot_dso [--count N]
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.ticker import MultipleLocator
+
+from src import constants, plots
+from src.models import DSOPlotArgs
+
+
+def make_plot_jobs(count: int) -> list[DSOPlotArgs]:
+    # Plausible looking time series: rendering time does not depend on the physics
+    rng = np.random.default_rng(0)
+    night_dates = np.arange(np.datetime64("2025-01-01"), np.datetime64("2026-01-01"))
+    day = np.arange(len(night_dates))
+    jobs = []
+    for k in range(count):
+        season = np.sin(2 * np.pi * day / len(day) + rng.uniform(0, 2 * np.pi))
+        time_series = np.zeros(shape=(len(day), 5))
+        time_series[:, 0] = night_dates.astype(np.int64)
+        time_series[:, 1] = np.clip(20 + 15 * season, 0, 90)
+        time_series[:, 2] = np.clip(60 + 20 * season, 0, 90)
+        time_series[:, 3] = np.clip(6 + 4 * season, 0, 14)
+        time_series[:, 4] = time_series[:, 3] / 10.25 * time_series[:, 2] / 90
+        jobs.append(DSOPlotArgs(f"DSO_{k}", night_dates[k % len(day)], time_series))
+    return jobs
+
+
+def plot_dso_new_figure(args: DSOPlotArgs, out_file):
+    # DSO plot as it used to be made: a new pyplot figure for every DSO
+    time_series = args.time_series
+    plt.figure(figsize=(8, 8), facecolor=(1.0, 0.8, 0.2))
+    ax2 = plt.subplot2grid((3, 1), (1, 0), rowspan=2)
+    ax2.set_autoscale_on(False)
+    plt.xlabel("Date", fontsize=12)
+    plt.ylim([0, 14])
+    plt.yticks(np.arange(0, 16, 2))
+    ax2.yaxis.set_minor_locator(MultipleLocator(0.5))
+    plt.ylabel("Hours Visible", fontsize=12)
+    plt.grid(visible=True, which="major", axis="both", linestyle=":", linewidth=1)
+    ax1 = plt.subplot2grid((3, 1), (0, 0), sharex=ax2)
+    ax1.set_autoscale_on(False)
+    plt.ylim([0, 90])
+    plt.yticks(np.arange(0, 100, 10))
+    plt.ylabel("Altitude (deg)", fontsize=12)
+    plots.set_date_axis(ax1, int(time_series[0, 0]), len(time_series))
+    ax2.plot(time_series[:, 0], time_series[:, 3], "b", linewidth=2, label="Hours")
+    ax1.yaxis.set_minor_locator(MultipleLocator(5))
+    plt.grid(visible=True, which="major", axis="both", linestyle=":", linewidth=1)
+    plt.plot(time_series[:, 0], time_series[:, 2], "r", linewidth=1, label="Max Alt")
+    plt.plot(time_series[:, 0], time_series[:, 1], "g", linewidth=1, label="Min Alt")
+    plt.legend(loc="best", shadow=True, ncol=1, frameon=True)
+    max_score = round(max(time_series[:, 4]), 2)
+    plt.title(f"{args.catalog_name}: Score = {max_score} on {args.max_score_date}", fontsize=16)
+    plt.savefig(out_file, format="png")
+    plt.close()
+
+
+def time_new_figure(jobs, out_path: Path) -> float:
+    start_time = perf_counter()
+    for job in jobs:
+        plot_dso_new_figure(job, out_path / f"{job.catalog_name}.png")
+    return (perf_counter() - start_time) / len(jobs)
+
+
+def time_template(jobs, out_path: Path) -> float:
+    # Includes building the template, as each worker does once
+    start_time = perf_counter()
+    template = plots.make_dso_plot_template(int(jobs[0].time_series[0, 0]), len(jobs[0].time_series))
+    for job in jobs:
+        plots.render_dso_plot(template, job, out_path / f"{job.catalog_name}.png")
+    return (perf_counter() - start_time) / len(jobs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="plot_dso")
+    parser.add_argument("--count", type=int, default=50, help="number of DSO plots per run")
+    args = parser.parse_args()
+
+    plot_jobs = make_plot_jobs(args.count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        new_figure_time = time_new_figure(plot_jobs, Path(tmp_dir))
+        template_time = time_template(plot_jobs, Path(tmp_dir))
+
+    print(f"DSO plots ({args.count} per run, {constants.plot_backend} backend):")
+    print(f"\t- New figure per DSO: {new_figure_time * 1000:.1f} ms per plot")
+    print(f"\t- Figure template:    {template_time * 1000:.1f} ms per plot ({new_figure_time / template_time:.1f}x)")
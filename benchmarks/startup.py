@@ -0,0 +1,71 @@
+"""Benchmark: start-up time, as the time to import the entry modules (of a run, of the in-process API, of the planning
+server, and of the plots), each in a fresh interpreter. Reports python -X importtime's total, the packages that take
+most of it, and whether matplotlib was imported
+
+Run from the repository root: python -m benchmarks.startup [--repeats N] [--top N]
+"""
+
+import argparse
+import subprocess
+import sys
+from collections import defaultdict
+from time import perf_counter
+
+import numpy as np
+
+modules = ("src.main", "src.api", "src.server", "src.plots")
+
+
+def measure_import(module: str) -> tuple[float, dict[str, float]]:
+    # Import time of module (s), from python -X importtime, and the time spent in each package it imports, by
+    # top-level package name (sum of the own times of its modules, so that a package's dependencies are not counted)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True
+    )
+    import_time = 0.0
+    package_times = defaultdict(float)
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line.removeprefix("import time:").split("|")
+        if name.strip() == module:
+            import_time = int(cumulative) * 1e-6
+        package_times[name.strip().split(".")[0]] += int(own) * 1e-6
+    return import_time, dict(package_times)
+
+
+def measure_wall_time(code: str, repeats: int) -> float:
+    # Median time to start an interpreter and run code (s)
+    times = []
+    for _ in range(repeats):
+        start_time = perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        times.append(perf_counter() - start_time)
+    return float(np.median(times))
+
+
+def imports_matplotlib(module: str) -> bool:
+    code = f"import sys, {module}; print('matplotlib' in sys.modules)"
+    return (
+        subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.strip()
+        == "True"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="startup")
+    parser.add_argument("--repeats", type=int, default=5, help="number of timings of each start-up")
+    parser.add_argument("--top", type=int, default=5, help="number of heaviest packages listed per module")
+    args = parser.parse_args()
+
+    base_time = measure_wall_time("pass", args.repeats)
+    print(f"Start-up (median of {args.repeats}), over {base_time * 1e3:.0f} ms for the interpreter alone:")
+    for module in modules:
+        import_time, package_times = measure_import(module)
+        wall_time = measure_wall_time(f"import {module}", args.repeats) - base_time
+        print(
+            f"\t- {module:<12} {wall_time * 1e3:6.0f} ms ({import_time * 1e3:.0f} ms of imports), "
+            f"matplotlib {'imported' if imports_matplotlib(module) else 'not imported'}"
+        )
+        for name, seconds in sorted(package_times.items(), key=lambda item: item[1], reverse=True)[: args.top]:
+            print(f"\t\t{name:<24} {seconds * 1e3:6.0f} ms")
@@ -0,0 +1,260 @@
+"""Benchmark suite: times the hot paths (simulation of one DSO, sun and coordinate math, DSO and global plots) and a
+whole run, on synthetic inputs (see generators.py), so that it runs offline and gives the same work on every commit.
+Results are saved as JSON, to compare commits with each other
+
+Run from the repository root:
+    python -m benchmarks.suite run [--out FILE] [--count N] [--repeats N]
+    python -m benchmarks.suite compare BASE.json NEW.json [--threshold 0.1]
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import io
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks import generators
+from src import (
+    constants,
+    ephemeris,
+    horizon,
+    main,
+    plots,
+    results,
+    settings,
+    shared,
+    simulator,
+    utils,
+)
+from src.models import DSOPlotArgs, PoolContext, RunContext, SimJobArgs
+
+
+def measure(run, repeats: int) -> dict:
+    # Median and best time per operation. run() does the work once, and returns the number of operations it did
+    times = []
+    for _ in range(repeats):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = perf_counter()
+            count = run()
+            times.append((perf_counter() - start_time) / count)
+    return {"median": float(np.median(times)), "min": float(np.min(times)), "repeats": repeats, "count": count}
+
+
+def bench_run_dso(user, engine: str, count: int):
+    user = dataclasses.replace(user, simulation_engine=engine)
+    effective_horizon = horizon.load_data(user)
+    night_ephemeris = ephemeris.build(user)
+    rng = np.random.default_rng(0)
+    ra = rng.uniform(0.0, 2 * np.pi, count)
+    dec = np.arcsin(rng.uniform(-0.5, 1.0, count))  # Mostly objects that rise at the observer's latitude
+    jobs = [
+        SimJobArgs(k, f"DSO_{k}", False, ra[k], dec[k], 20.0, effective_horizon, night_ephemeris, user)
+        for k in range(count)
+    ]
+
+    def run():
+        for job in jobs:
+            simulator.run_dso(job)
+        return count
+
+    return run
+
+
+def bench_calc_sunset(user, days: int):
+    # One sunset per day, searched from noon
+    def run():
+        for day in range(days):
+            t = 24.0 * day - constants.jan_1_to_equinox_hours
+            sun_altitude = utils.calc_sun_altitude(t, user.observer_longitude_radians, user.r_23, constants.r_01)
+            utils.calc_sunset(
+                t,
+                constants.simulation_delta_t_hours,
+                sun_altitude,
+                user.observer_longitude_radians,
+                user.r_23,
+                constants.r_01,
+            )
+        return days
+
+    return run
+
+
+def bench_convert_ra_dec_to_alt_az(user, count: int):
+    rng = np.random.default_rng(0)
+    points = np.column_stack(
+        (rng.uniform(0.0, 24.0 * 365, count), rng.uniform(0.0, 2 * np.pi, count), rng.uniform(-1.5, 1.5, count))
+    ).tolist()
+
+    def run():
+        for t, ra, dec in points:
+            utils.convert_ra_dec_to_alt_az(t, user.observer_longitude_radians, ra, dec, user.r_23)
+        return count
+
+    return run
+
+
+def bench_calc_sun_altitude(user, count: int):
+    times = np.random.default_rng(0).uniform(0.0, 24.0 * 365, count).tolist()
+
+    def run():
+        for t in times:
+            utils.calc_sun_altitude(t, user.observer_longitude_radians, user.r_23, constants.r_01)
+        return count
+
+    return run
+
+
+def bench_plot_dso(user, count: int):
+    # Plots of the DSOs included by the end-to-end run (which must run first), as a pool worker makes them
+    shared.init_worker(PoolContext((RunContext(user),)))
+    time_series = list(results.load_time_series(user).items())[:count]
+    jobs = [
+        DSOPlotArgs(catalog_name, simulator.calc_first_max_info(series)[0], series)
+        for catalog_name, series in time_series
+    ]
+
+    def run():
+        for job in jobs:
+            plots.plot_dso(job)
+        return len(jobs)
+
+    return run
+
+
+def bench_generate_global_plots(user):
+    result_columns = results.make_columns(results.load_results(user))
+
+    def run():
+        plots.generate_global_plots(result_columns, user)
+        return 1
+
+    return run
+
+
+def bench_main(ini_file: Path):
+    def run():
+        main.main(settings.read_settings(str(ini_file)))
+        return 1
+
+    return run
+
+
+def run_suite(count: int, days: int, repeats: int, pool_size: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        generators.write_catalog(tmp_path / "catalog.txt", count)
+        generators.write_horizon(tmp_path / "horizon.txt", 1.0)
+        ini_file = tmp_path / "bench.ini"
+        generators.write_settings(
+            ini_file,
+            tmp_path / "catalog.txt",
+            tmp_path / "horizon.txt",
+            tmp_path / "results",
+            days=days,
+            pool_size=pool_size,
+        )
+        user = settings.read_settings(str(ini_file), prepare_results=False)
+
+        benchmarks = {
+            "main.main": (bench_main(ini_file), "run"),
+            "simulator.run_dso[vectorized]": (bench_run_dso(user, "vectorized", 50), "DSO"),
+            "simulator.run_dso[analytic]": (bench_run_dso(user, "analytic", 50), "DSO"),
+            "utils.calc_sunset": (bench_calc_sunset(user, 365), "call"),
+            "utils.convert_ra_dec_to_alt_az": (bench_convert_ra_dec_to_alt_az(user, 20000), "call"),
+            "utils.calc_sun_altitude": (bench_calc_sun_altitude(user, 20000), "call"),
+        }
+        timings = {}
+        for name, (run, unit) in benchmarks.items():
+            timings[name] = measure(run, repeats) | {"unit": unit}
+            print(f"\t- {name:<32} {format_time(timings[name]['median'])} per {unit}")
+        # The plots use the outputs of the last end-to-end run
+        for name, run, unit in (
+            ("plots.plot_dso", bench_plot_dso(user, 20), "plot"),
+            ("plots.generate_global_plots", bench_generate_global_plots(user), "run"),
+        ):
+            timings[name] = measure(run, repeats) | {"unit": unit}
+            print(f"\t- {name:<32} {format_time(timings[name]['median'])} per {unit}")
+
+    return {
+        "commit": git_commit(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "parameters": {"count": count, "days": days, "repeats": repeats, "pool_size": pool_size},
+        "benchmarks": timings,
+    }
+
+
+def compare(base: dict, new: dict, threshold: float) -> bool:
+    # Prints the change of each benchmark's median time. Returns whether any got slower by more than threshold
+    print(f"Benchmarks: {base['commit']} -> {new['commit']}")
+    if base["parameters"] != new["parameters"]:
+        print(f"\tWarning: different parameters: {base['parameters']} vs. {new['parameters']}")
+    has_regression = False
+    for name, timing in new["benchmarks"].items():
+        if name not in base["benchmarks"]:
+            print(f"\t- {name:<32} {format_time(timing['median'])} (new)")
+            continue
+        ratio = timing["median"] / base["benchmarks"][name]["median"]
+        is_regression = ratio > 1.0 + threshold
+        has_regression |= is_regression
+        print(
+            f"\t- {name:<32} {format_time(base['benchmarks'][name]['median'])} -> {format_time(timing['median'])} "
+            f"({ratio:.2f}x){' REGRESSION' if is_regression else ''}"
+        )
+    return has_regression
+
+
+def format_time(seconds: float) -> str:
+    if seconds >= 1.0:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} us"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--out", help="JSON file to save the results to (default: benchmarks/results/COMMIT.json)")
+    run_parser.add_argument("--count", type=int, default=1000, help="number of synthetic catalog DSOs")
+    run_parser.add_argument("--days", type=int, default=365, help="number of nights simulated")
+    run_parser.add_argument("--repeats", type=int, default=3, help="number of timings of each benchmark")
+    run_parser.add_argument("--jobs", type=int, default=4, help="pool size of the end-to-end run")
+    compare_parser = commands.add_parser("compare", help="compare the results of two runs")
+    compare_parser.add_argument("base", help="JSON results of the base commit")
+    compare_parser.add_argument("new", help="JSON results of the new commit")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="slowdown reported as a regression")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        print(f"Benchmarks ({args.count} DSOs, {args.days} nights, median of {args.repeats} runs):")
+        suite_results = run_suite(args.count, args.days, args.repeats, args.jobs)
+        out_file = Path(args.out or f"benchmarks/results/{suite_results['commit']}.json")
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        out_file.write_text(json.dumps(suite_results, indent=2))
+        print(f"Saved to {out_file}")
+    else:
+        base_results = json.loads(Path(args.base).read_text())
+        new_results = json.loads(Path(args.new).read_text())
+        sys.exit(1 if compare(base_results, new_results, args.threshold) else 0)
@@ -0,0 +1,167 @@
+"""Analytic engine: the visibility of a DSO, night by night, in closed form in hour angle instead of time stepping"""
+
+import math
+from math import pi
+
+import numpy as np
+
+from src import constants, horizon, utils
+from src.models import EffectiveHorizon, NightEphemeris, UserSettings
+
+
+def calc_night_values(
+    ra, dec, effective_horizon: EffectiveHorizon, night_ephemeris: NightEphemeris, user: UserSettings
+):
+    # Per-night min/max altitude, hours visible and score of a block of objects: shape (len(ra), nights, 4), as
+    # simulator.calc_night_values. An object is above the effective horizon over the same arcs of hour angle every
+    # day (see calc_visible_arcs): each night is the overlap of these arcs with the night's range of hour angles
+    arc_starts, arc_ends = calc_visible_arcs(dec, effective_horizon, user)
+
+    # Hour angles of the object at dusk and dawn, and the turns (multiples of 2 pi) of the arcs the night can overlap
+    hour_angle_dusk = (
+        constants.earth_rotation_rate * night_ephemeris.dusk + user.observer_longitude_radians - ra[:, None]
+    )
+    hour_angle_dawn = (
+        constants.earth_rotation_rate * night_ephemeris.dawn + user.observer_longitude_radians - ra[:, None]
+    )
+    turns = 2.0 * pi * np.round((hour_angle_dusk + hour_angle_dawn) / (4.0 * pi))
+    turns = turns[..., None, None] + 2.0 * pi * np.array([-1.0, 0.0, 1.0])  # (objects, nights, 1, 3)
+
+    # Overlap of each arc (axis 2), on each turn (axis 3), with each night
+    start = np.maximum(arc_starts[:, None, :, None] + turns, hour_angle_dusk[..., None, None])
+    end = np.minimum(arc_ends[:, None, :, None] + turns, hour_angle_dawn[..., None, None])
+    is_overlap = end > start
+    hours_visible = np.sum(np.where(is_overlap, end - start, 0.0), axis=(2, 3)) / constants.earth_rotation_rate
+
+    # Altitude only decreases with the distance of the hour angle to the transit (0 on each turn): it is highest at the
+    # transit, or at the end of the overlap closest to it, and lowest at the end farthest from it
+    start_distance, end_distance = np.abs(start - turns), np.abs(end - turns)
+    is_transit = (start <= turns) & (turns <= end)
+    nearest = np.where(is_transit, 0.0, np.minimum(start_distance, end_distance))
+    farthest = np.maximum(start_distance, end_distance)
+    nearest = np.min(np.where(is_overlap, nearest, pi), axis=(2, 3))
+    farthest = np.max(np.where(is_overlap, farthest, 0.0), axis=(2, 3))
+    is_visible = np.any(is_overlap, axis=(2, 3))
+    lat, dec = user.observer_latitude_radians, dec[:, None]
+    max_altitude = np.where(is_visible, calc_altitude(nearest, dec, lat), 0.0)
+    min_altitude = np.where(is_visible, calc_altitude(farthest, dec, lat), 100.0)
+    min_altitude[min_altitude > 95.0] = 0.0
+
+    score = hours_visible / 10.25 * max_altitude / 90.0
+    return np.stack((min_altitude, max_altitude, hours_visible, score), axis=-1)
+
+
+def calc_visible_arcs(dec, effective_horizon: EffectiveHorizon, user: UserSettings):
+    # Arcs of hour angle, within [-pi, pi] (0 at the transit), where each object is above the effective horizon:
+    # shape (len(dec), arcs), empty arcs have start == end. Above a flat horizon at MinObservationAltitude, the arc
+    # is in closed form. Where the object is in front of horizon cells higher than that, the arc is sampled every
+    # analytic_step_hours to find where the object is hidden, once for all nights
+    lat = user.observer_latitude_radians
+    half_arc = calc_half_arc(user.min_obs_altitude, dec, lat)
+
+    # Objects that are never in front of a raised horizon cell while above MinObservationAltitude (or never above it)
+    # do not need sampling: their arc is the flat horizon's
+    raised_starts, raised_ends = calc_raised_arcs(dec, half_arc, effective_horizon, user)
+    is_flat = ~np.any(raised_ends > raised_starts, axis=1)
+    arc_starts = np.where(is_flat, -half_arc, 0.0)[:, None]
+    arc_ends = np.where(is_flat, half_arc, 0.0)[:, None]
+    sampled = np.flatnonzero(~is_flat)
+    if len(sampled) == 0:
+        return arc_starts, arc_ends
+
+    # Samples at the middle of num_steps equal steps of each arc: runs of visible samples are the visible arcs. Only
+    # the samples of the raised sub-arcs, and one more on each side, are computed: the others are visible, either in
+    # front of cells at MinObservationAltitude (which the object is above anywhere inside its arc), or above every cell
+    num_steps = math.ceil(2.0 * pi / (constants.earth_rotation_rate * constants.analytic_step_hours))
+    step = 2.0 * half_arc[sampled] / num_steps
+    offsets = half_arc[sampled, None]
+    is_raised_arc = raised_ends[sampled] > raised_starts[sampled]
+    first_step = np.clip(np.ceil((raised_starts[sampled] + offsets) / step[:, None] - 0.5) - 1, 0, num_steps)
+    last_step = np.clip(np.floor((raised_ends[sampled] + offsets) / step[:, None] - 0.5) + 1, -1, num_steps - 1)
+    is_computed = np.zeros((len(sampled), num_steps + 1), dtype=np.int32)
+    rows = np.broadcast_to(np.arange(len(sampled))[:, None], is_raised_arc.shape)[is_raised_arc]
+    np.add.at(is_computed, (rows, first_step[is_raised_arc].astype(int)), 1)
+    np.add.at(is_computed, (rows, last_step[is_raised_arc].astype(int) + 1), -1)
+    is_computed = np.cumsum(is_computed[:, :-1], axis=1) > 0
+    sample_object, sample_step = np.nonzero(is_computed)
+    hour_angle = -half_arc[sampled][sample_object] + (sample_step + 0.5) * step[sample_object]
+    altitude, azimuth = calc_alt_az(
+        hour_angle, np.sin(dec[sampled])[sample_object], np.cos(dec[sampled])[sample_object], lat
+    )
+    is_visible = np.ones((len(sampled), num_steps), dtype=bool)
+    is_visible[sample_object, sample_step] = altitude > horizon.lookup(effective_horizon, azimuth)
+    is_visible = np.pad(is_visible, ((0, 0), (1, 1)))
+    run_object, run_first = np.nonzero(is_visible[:, 1:-1] & ~is_visible[:, :-2])
+    _, run_last = np.nonzero(is_visible[:, 1:-1] & ~is_visible[:, 2:])
+    run_rank = np.arange(len(run_object)) - np.searchsorted(run_object, run_object)
+
+    num_arcs = max(1, run_rank.max(initial=0) + 1)
+    arc_starts = np.pad(arc_starts, ((0, 0), (0, num_arcs - 1)))
+    arc_ends = np.pad(arc_ends, ((0, 0), (0, num_arcs - 1)))
+    arc_starts[sampled[run_object], run_rank] = -half_arc[sampled][run_object] + run_first * step[run_object]
+    arc_ends[sampled[run_object], run_rank] = -half_arc[sampled][run_object] + (run_last + 1) * step[run_object]
+    return arc_starts, arc_ends
+
+
+def calc_raised_arcs(dec, half_arc, effective_horizon: EffectiveHorizon, user: UserSettings):
+    # Sub-arcs of the arc of each object above MinObservationAltitude, [-half_arc, half_arc], where the object may be
+    # hidden: in front of horizon cells higher than MinObservationAltitude, and no higher than the highest of them.
+    # Shape (len(dec), sub-arcs), start == end for the others. The object only goes from a cell at
+    # MinObservationAltitude to a raised one where its azimuth is that of an edge between them: the arc is cut at these
+    # hour angles, and where the object is at the highest cell's altitude, in closed form. Each piece is then either
+    # raised or not, and either above the highest cell or not
+    is_raised = effective_horizon.altitudes > user.min_obs_altitude
+    if not is_raised.any():
+        return np.zeros((len(dec), 1)), np.zeros((len(dec), 1))
+    high_arc = calc_half_arc(effective_horizon.altitudes.max(), dec, user.observer_latitude_radians)[:, None]
+    edges = np.flatnonzero(is_raised != np.roll(is_raised, 1))  # Edge k is between cells k - 1 and k
+    edge_azimuth = np.radians((edges - 0.5) * effective_horizon.resolution)
+
+    # The azimuth of the object is an edge's (or opposite to it) where p sin(h) + q cos(h) = r, as in
+    # utils.convert_hour_angle_to_alt_az: p sin(h) + q cos(h) = sqrt(p^2 + q^2) cos(h - atan2(p, q))
+    lat, dec = user.observer_latitude_radians, dec[:, None]
+    p = np.cos(edge_azimuth) * np.cos(dec)
+    q = -np.sin(edge_azimuth) * np.cos(dec) * np.sin(lat)
+    r = -np.sin(edge_azimuth) * np.sin(dec) * np.cos(lat)
+    amplitude = np.hypot(p, q)
+    has_crossing = (amplitude > 0.0) & (np.abs(r) <= amplitude)
+    offset = np.arccos(np.clip(r / np.where(has_crossing, amplitude, 1.0), -1.0, 1.0))
+    phase = np.arctan2(p, q)
+    crossings = np.mod(np.concatenate((phase - offset, phase + offset), axis=1) + pi, 2.0 * pi) - pi
+    is_inside = np.tile(has_crossing, 2) & (np.abs(crossings) < half_arc[:, None])
+    crossings = np.where(is_inside, crossings, half_arc[:, None])
+
+    cuts = np.sort(
+        np.concatenate((-half_arc[:, None], -high_arc, crossings, high_arc, half_arc[:, None]), axis=1), axis=1
+    )
+    starts, ends = cuts[:, :-1], cuts[:, 1:]
+    middles = (starts + ends) / 2.0
+    _, azimuth = utils.convert_hour_angle_to_alt_az(middles, dec, lat)
+    is_raised_arc = (horizon.lookup(effective_horizon, azimuth) > user.min_obs_altitude) & (ends > starts)
+    is_raised_arc &= np.abs(middles) > high_arc
+    return np.where(is_raised_arc, starts, 0.0), np.where(is_raised_arc, ends, 0.0)
+
+
+def calc_half_arc(altitude, dec, lat):
+    # Hour angle (radians) from the transit to where objects of declination dec are at altitude (deg): 0 when they are
+    # never above it, pi when they are always above it
+    cos_half_arc = (np.sin(np.radians(altitude)) - np.sin(lat) * np.sin(dec)) / (np.cos(lat) * np.cos(dec))
+    return np.arccos(np.clip(cos_half_arc, -1.0, 1.0))
+
+
+def calc_alt_az(hour_angle, sin_dec, cos_dec, lat):
+    # As utils.convert_hour_angle_to_alt_az, from the sine and cosine of the declination, computed once per object
+    cos_hour_angle = np.cos(hour_angle)
+    north = sin_dec * math.cos(lat) - cos_dec * math.sin(lat) * cos_hour_angle
+    west = cos_dec * np.sin(hour_angle)
+    up = sin_dec * math.sin(lat) + cos_dec * math.cos(lat) * cos_hour_angle
+    azimuth = np.mod(-np.arctan2(west, north) * 180.0 / pi, 360.0)
+    altitude = np.arcsin(np.clip(up, -1.0, 1.0)) * 180.0 / pi
+    return altitude, azimuth
+
+
+def calc_altitude(hour_angle, dec, lat):
+    # Altitude (deg) only, as in utils.convert_hour_angle_to_alt_az
+    return np.degrees(
+        np.arcsin(np.clip(np.sin(dec) * np.sin(lat) + np.cos(dec) * np.cos(lat) * np.cos(hour_angle), -1, 1))
+    )
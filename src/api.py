@@ -0,0 +1,81 @@
+"""In-process API, for embedding AstroPlan in other programs: the observer's settings, horizon and catalog go in as
+values, and the results come out as NumPy arrays. Nothing is printed or written (a catalog file is only read), and
+matplotlib is not imported. The command line (main.py) runs the same simulations in a pool, and writes their results
+
+    from src import api
+    from src.models import UserSettings
+
+    user = UserSettings(observer_latitude=45.5, observer_longitude=-73.6, simulation_days=30)
+    plan = api.plan(user, horizon_data=[[0.0, 15.0], [90.0, 25.0], [270.0, 10.0]], catalog_data="catalog.txt")
+    print(plan.dsos[["name", "score", "date"]][:10])
+"""
+
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+
+from src import catalog, culling, ephemeris, horizon, results, simulator, tonight
+from src.models import NightEphemeris, Plan, RunContext, TonightTarget, UserSettings
+
+# Horizon points of an open horizon: the effective horizon is then MinObservationAltitude all around
+open_horizon = np.zeros((1, 2))
+
+
+def plan(
+    user: UserSettings, horizon_data=None, catalog_data=None, night_ephemeris: NightEphemeris | None = None
+) -> Plan:
+    # Simulates the nights of user.night_dates (set by simulation_start and simulation_days) for the catalog DSOs
+    # that pass the filters of user.
+    #   horizon_data: horizon points, one (azimuth, altitude) row each (deg). None for an open horizon
+    #   catalog_data: Stellarium catalog file, or its rows (see catalog.catalog_dtype). None for user.catalog_file
+    #   night_ephemeris: darkness timeline of the nights, when already built by ephemeris.build (see server.py)
+    effective_horizon = horizon.make_effective_horizon(open_horizon if horizon_data is None else horizon_data, user)
+    rows = load_catalog_rows(user, catalog_data)
+    rows = rows[catalog.select(rows, user)]
+    rows = rows[~culling.find_never_visible(rows, effective_horizon, user)]
+    if night_ephemeris is None:
+        night_ephemeris = ephemeris.build(user)
+    context = RunContext(user, effective_horizon, night_ephemeris)
+
+    index_rows, time_series, physics_rows = [], [], []
+    block_size = simulator.calc_in_process_block_size(len(night_ephemeris.sample_times), user)
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start : start + block_size]
+        block = simulator.make_sim_block(block_rows, catalog.catalog_names(block_rows))
+        ((_, sim_results),) = simulator.simulate_block(block, [context])
+        for result, dso_type in zip(sim_results, block_rows["type"]):
+            physics_rows.append(results.physics_row(result))
+            if result.is_included:
+                index_rows.append(results.index_row(result, str(dso_type)))
+                time_series.append(result.time_series)
+
+    dsos = np.array(index_rows, dtype=results.store_index_dtype)
+    order = np.lexsort((dsos["id"], -dsos["score"]))  # As the DSO plots are ranked
+    return Plan(
+        dsos=dsos[order],
+        time_series=(
+            np.array(time_series)[order] if time_series else np.zeros((0, len(night_ephemeris.night_dates), 5))
+        ),
+        physics=np.array(physics_rows, dtype=results.physics_dtype),
+        night_dates=night_ephemeris.night_dates,
+    )
+
+
+def best_tonight(
+    user: UserSettings, nights: int = 1, start: date | None = None, horizon_data=None, catalog_data=None
+) -> list[TonightTarget]:
+    # Best DSOs of the next few nights from start (tonight by default), as tonight.find_targets finds them.
+    # horizon_data and catalog_data as for plan
+    effective_horizon = horizon.make_effective_horizon(open_horizon if horizon_data is None else horizon_data, user)
+    rows = load_catalog_rows(user, catalog_data)
+    return tonight.find_targets(user, nights, start, rows=rows, effective_horizon=effective_horizon)
+
+
+def load_catalog_rows(user: UserSettings, catalog_data) -> np.ndarray:
+    if isinstance(catalog_data, np.ndarray):
+        return catalog_data
+    catalog_file = catalog_data if catalog_data is not None else user.catalog_file
+    if not catalog_file:
+        raise ValueError("No catalog: pass catalog_data, or set catalog_file")
+    return catalog.read(Path(catalog_file)).rows
@@ -0,0 +1,106 @@
+"""Persistent cache of simulated DSO time series, shared by successive runs"""
+
+import hashlib
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src import constants
+from src.models import ResultCache, UserSettings
+
+
+def open_cache(user: UserSettings) -> ResultCache | None:
+    if user.cache_path is None:
+        return None
+    os.makedirs(user.cache_path, exist_ok=True)
+    return ResultCache(path=user.cache_path, run_key=calc_run_key(user))
+
+
+# Constants that affect a simulated time series: changing any other constant (such as simulation_chunk_nights, which
+# only batches the nights) keeps the cached results
+simulation_constants = (
+    "earth_tilt",
+    "hours_in_day",
+    "earth_rotation_rate",
+    "hours_in_year",
+    "earth_solar_orbital_rate",
+    "jan_1_to_equinox_hours",
+    "r_01",
+    "simulation_delta_t_hours",
+    "analytic_step_hours",
+    "darkness_sun_altitude",
+)
+
+
+def calc_run_key(user: UserSettings) -> str:
+    # Everything that affects a simulated time series, besides the object's RA/DEC
+    run_hash = hashlib.sha256()
+    for name in simulation_constants:
+        run_hash.update(name.encode())
+        run_hash.update(np.asarray(getattr(constants, name), dtype=float).tobytes())
+    run_hash.update(Path(user.horizon_file).read_bytes())
+    run_hash.update(
+        repr(
+            (
+                user.observer_latitude,
+                user.observer_longitude,
+                user.min_obs_altitude,
+                user.horizon_resolution,
+                user.simulation_engine,
+                str(user.night_dates[0]),
+                user.simulation_days,
+            )
+        ).encode()
+    )
+    return run_hash.hexdigest()
+
+
+def entry_path(result_cache: ResultCache, ra, dec) -> Path:
+    key = hashlib.sha256(f"{result_cache.run_key}:{float(ra).hex()}:{float(dec).hex()}".encode()).hexdigest()
+    return result_cache.path / key[:2] / f"{key}.npy"
+
+
+def load(result_cache: ResultCache, ra, dec) -> np.ndarray | None:
+    path = entry_path(result_cache, ra, dec)
+    try:
+        time_series = np.load(path)
+        os.utime(path)  # Entries are evicted least recently used first
+    except (OSError, ValueError):
+        # Not cached, or evicted (or replaced) by another process while being read
+        return None
+    return time_series
+
+
+def store(result_cache: ResultCache, ra, dec, time_series):
+    # Safe with concurrent writers: every writer saves to its own temporary file, then atomically renames it.
+    # Entries are content-addressed, so when two writers race, either one's (identical) entry can win
+    path = entry_path(result_cache, ra, dec)
+    os.makedirs(path.parent, exist_ok=True)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_path, "wb") as f:
+        np.save(f, time_series)
+    os.replace(temp_path, path)
+
+
+def evict(result_cache: ResultCache, max_size_mb: float) -> int:
+    # Deletes least recently used entries until the cache fits in max_size_mb. Returns the number of entries deleted
+    entries = []
+    for path in result_cache.path.glob("*/*.npy"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+
+    size = sum(entry_size for _, entry_size, _ in entries)
+    max_size = max_size_mb * 1024 * 1024
+    num_evicted = 0
+    for _, entry_size, path in entries:
+        if size <= max_size:
+            break
+        path.unlink(missing_ok=True)
+        size -= entry_size
+        num_evicted += 1
+    return num_evicted
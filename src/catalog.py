@@ -0,0 +1,174 @@
+"""Stellarium Catalog, converted once to a memory-mapped columnar array"""
+
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src import constants, instrumentation
+from src.models import StellariumCatalog, UserSettings
+
+catalog_dtype = np.dtype(
+    [
+        ("id", "i8"),
+        ("ra", "f8"),  # deg
+        ("dec", "f8"),  # deg
+        ("major_axis", "f8"),  # arc-min
+        ("minor_axis", "f8"),  # arc-min
+        ("type", "U16"),
+        *[(catalog_prefix, "U16") for catalog_prefix in constants.catalogs],  # Catalog designations
+        ("line_offset", "i8"),  # Position of the object's line in the text catalog, in bytes
+        ("line_length", "i8"),
+    ]
+)
+
+# The binary catalog is rebuilt whenever its layout (or the catalog columns it is built from) changes
+catalog_format = hashlib.sha256(repr((catalog_dtype.descr, constants.catalogs)).encode()).hexdigest()
+
+
+def load(user: UserSettings) -> StellariumCatalog:
+    source_file = Path(user.catalog_file)
+    binary_file = source_file.with_name(f"{source_file.name}.npy")
+    meta_file = source_file.with_name(f"{source_file.name}.json")
+
+    try:
+        meta = json.loads(meta_file.read_text())
+    except (OSError, ValueError):
+        meta = {}
+
+    stat = source_file.stat()
+    if meta.get("format") != catalog_format or not binary_file.exists():
+        meta = convert(source_file, binary_file, meta_file)
+    elif (meta["mtime"], meta["size"]) != (stat.st_mtime_ns, stat.st_size):
+        # Touched, but possibly not changed: only rebuild when the contents differ
+        if meta["sha256"] == file_hash(source_file):
+            meta.update(mtime=stat.st_mtime_ns, size=stat.st_size)
+            write_atomically(meta_file, json.dumps(meta).encode())
+        else:
+            meta = convert(source_file, binary_file, meta_file)
+
+    return StellariumCatalog(headers=meta["headers"], rows=np.load(binary_file, mmap_mode="r"))
+
+
+def read(source_file) -> StellariumCatalog:
+    # As load, but never writes: the binary catalog is only used when it is up to date, otherwise the text catalog is
+    # parsed in memory
+    source_file = Path(source_file)
+    binary_file = source_file.with_name(f"{source_file.name}.npy")
+    meta_file = source_file.with_name(f"{source_file.name}.json")
+
+    try:
+        meta = json.loads(meta_file.read_text())
+    except (OSError, ValueError):
+        meta = {}
+
+    stat = source_file.stat()
+    if (
+        meta.get("format") == catalog_format
+        and (meta["mtime"], meta["size"]) == (stat.st_mtime_ns, stat.st_size)
+        and binary_file.exists()
+    ):
+        return StellariumCatalog(headers=meta["headers"], rows=np.load(binary_file, mmap_mode="r"))
+    headers, rows = parse(source_file)
+    return StellariumCatalog(headers=headers, rows=rows)
+
+
+def convert(source_file: Path, binary_file: Path, meta_file: Path) -> dict:
+    stat = source_file.stat()
+    with instrumentation.stage("parse"):
+        headers, rows = parse(source_file)
+    instrumentation.count("objects parsed", len(rows))
+    binary_data = io.BytesIO()
+    np.save(binary_data, rows)
+    write_atomically(binary_file, binary_data.getvalue())
+
+    meta = {
+        "format": catalog_format,
+        "mtime": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_hash(source_file),
+        "headers": headers,
+    }
+    write_atomically(meta_file, json.dumps(meta).encode())
+    return meta
+
+
+def parse(source_file: Path):
+    headers = []
+    rows = []
+    reached_stellarium_data = False
+    line_offset = 0
+    with open(source_file, "rb") as f_stellarium:
+        for line in f_stellarium:
+            stellarium_row = line.decode()
+            if stellarium_row.startswith("#"):
+                if not reached_stellarium_data:
+                    headers.append(stellarium_row)
+            else:
+                reached_stellarium_data = True
+                stellarium_row_data = stellarium_row.split("\t")
+                rows.append(
+                    (
+                        int(stellarium_row_data[0]),
+                        float(stellarium_row_data[1]),
+                        float(stellarium_row_data[2]),
+                        float(stellarium_row_data[7]),
+                        float(stellarium_row_data[8]),
+                        stellarium_row_data[5].strip(),
+                        *[stellarium_row_data[column_index] for column_index in constants.catalogs.values()],
+                        line_offset,
+                        len(line),
+                    )
+                )
+            line_offset += len(line)
+    return headers, np.array(rows, dtype=catalog_dtype)
+
+
+def select(rows: np.ndarray, user: UserSettings) -> np.ndarray:
+    # Mask of the rows that pass the catalog range, size, type and declination prefilters
+    mask = rows["id"] >= user.min_catalog_id
+    if user.max_catalog_id is not None:
+        mask &= rows["id"] <= user.max_catalog_id
+    mask &= np.maximum(rows["major_axis"], rows["minor_axis"]) > user.min_dso_size
+    mask &= np.isin(rows["type"], list(constants.included_dso_types))
+    if user.observer_latitude > 0:
+        mask &= rows["dec"] > user.min_obs_peak_dec
+    else:
+        mask &= rows["dec"] < user.min_obs_peak_dec
+    # Only keep DSOs listed in one of the desired catalogs
+    mask &= np.any([is_designated(rows[catalog_prefix]) for catalog_prefix in constants.catalogs], axis=0)
+    return mask
+
+
+def is_designated(catalog_numbers: np.ndarray) -> np.ndarray:
+    return (catalog_numbers != "") & (catalog_numbers != "0")
+
+
+def catalog_names(rows: np.ndarray) -> list[str]:
+    # Name of each DSO in the first desired catalog it is listed in
+    names = np.full(len(rows), "", dtype=object)
+    for catalog_prefix in reversed(constants.catalogs):
+        catalog_numbers = rows[catalog_prefix]
+        is_listed = is_designated(catalog_numbers)
+        names[is_listed] = [f"{catalog_prefix}_{number}" for number in catalog_numbers[is_listed]]
+    return names.tolist()
+
+
+def read_line(f_stellarium, row) -> str:
+    # Original line of a row, read from the text catalog (opened in binary mode)
+    f_stellarium.seek(row["line_offset"])
+    return f_stellarium.read(row["line_length"]).decode()
+
+
+def file_hash(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def write_atomically(path: Path, data: bytes):
+    temp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temp_path.write_bytes(data)
+    os.replace(temp_path, path)
@@ -6,6 +6,8 @@ import numpy as np
 
 # App Settings
 default_ini_file = "astroplan.ini"
+simulation_engines = {"vectorized", "reference", "analytic"}
+plot_backend = "Agg"  # Plots are only ever written to files
 
 # Stellarium data
 stellarium_field_count = 45
@@ -38,7 +40,7 @@ earth_rotation_rate = 2.0 * pi / hours_in_day  # Earth's rate of rotation about
 hours_in_year = 365.25635 * hours_in_day  # Number of hours in a year
 earth_solar_orbital_rate = 2 * pi / hours_in_year  # Earth's orbital rate around the Sun
 days_in_year = 365  # Number of days in a year
-month_last_day = [31, 59, 90, 120, 151, 181, 212, 243, 273, 304, 334, 365, 396]
+jan_1_to_equinox_hours = 79.0 * hours_in_day  # Number of hours between Jan 1 and Spring Equinox
 
 r_01 = np.array(
     [[np.cos(earth_tilt), 0.0, -np.sin(earth_tilt)], [0.0, 1.0, 0.0], [np.sin(earth_tilt), 0.0, np.cos(earth_tilt)]]
@@ -47,3 +49,24 @@ r_01 = np.array(
 
 # Constants associated with simulation
 simulation_delta_t_hours = 7.0 / 60.0  # Simulation time step in hours
+analytic_step_hours = 1.0 / 60.0  # Sampling step of the analytic engine, where the horizon is above the flat floor
+simulation_chunk_nights = 366  # Longer windows are simulated this many nights at a time, to bound memory use
+darkness_sun_altitude = -12.0  # It's dark when Sun's altitude is below this value (deg)
+pool_tasks_per_worker = 4  # Objects are split into at least that many blocks per worker, to balance the load
+simulation_bytes_per_sample = 64  # Approximate peak memory used by the block simulation, per object and time sample
+culling_step_hours = 2.0 / 60.0  # Time step of the daily path of each DSO, when culling the never visible ones
+culling_block_size = 4096  # DSOs culled at a time
+culling_max_altitude = 80.0  # Beyond that altitude, the lowest of the horizon is used instead (deg)
+tonight_max_targets = 30  # Number of best targets listed by the "tonight" mode
+sweep_top_n = 10  # Number of best scoring DSOs listed for each combination of filter values of a sweep
+profile_file = "astroplan.prof"  # Merged profile of the pool jobs (--profile), for pstats or snakeviz
+progress_tty_seconds = 0.2  # Minimum time between two updates of the progress line, on a terminal
+progress_log_seconds = 10.0  # Same, when the output is not a terminal (CI logs): every update is a new line
+progress_end_wait_seconds = 2.0  # Longest wait for the progress events still on their way at the end of a phase
+server_host = "127.0.0.1"  # The planning server (--serve) only listens on this computer
+server_port = 8017  # Default port of the planning server
+server_cache_entries = 64  # Answers and sun timelines kept by the planning server, the least recently used going first
+# Unfiltered results of the catalog at a site and window (see server.SkyResults) kept by the planning server: each
+# holds the time series of up to the whole catalog
+server_sky_entries = 16
+server_top_n = 20  # Number of best DSOs answered by the planning server, unless the query sets "top"
@@ -0,0 +1,76 @@
+"""Culling: DSOs that can never be included, found from their daily path across the sky before any simulation"""
+
+import numpy as np
+
+from src import constants, utils
+from src.models import EffectiveHorizon, UserSettings
+
+
+def find_never_visible(rows, effective_horizon: EffectiveHorizon, user: UserSettings) -> np.ndarray:
+    # Mask of the DSOs that would fail the observation filters on every night, whatever the date: their altitude
+    # above the effective horizon never reaches MinObservationPeakAltitude, or they are above it for less than
+    # MinObservationHours a day. Conservative: the simulation would exclude every culled DSO, so results are unchanged
+    never_visible = np.zeros(len(rows), dtype=bool)
+    for start in range(0, len(rows), constants.culling_block_size):
+        block_rows = rows[start : start + constants.culling_block_size]
+        peak_altitude, hours_visible = calc_visibility_bounds(
+            np.radians(block_rows["ra"]), np.radians(block_rows["dec"]), effective_horizon, user
+        )
+        never_visible[start : start + len(block_rows)] = (peak_altitude < user.min_obs_peak_altitude) | (
+            hours_visible < user.min_obs_hours
+        )
+    return never_visible
+
+
+def calc_visibility_bounds(ra, dec, effective_horizon: EffectiveHorizon, user: UserSettings):
+    # Upper bounds of the peak altitude and of the hours visible in any night, from the path of each object over a
+    # sidereal day, in steps of culling_step_hours. The object may be visible during a step when the highest it can
+    # be during the step is above the lowest the horizon is over the azimuths the step spans
+    step = constants.culling_step_hours
+    t = np.arange(0.0, constants.hours_in_day, step)
+    altitude, azimuth = utils.convert_ra_dec_to_alt_az_matrix(t, user.observer_longitude_radians, ra, dec, user.r_23)
+
+    # Objects move across the sky at up to earth_rotation_rate, so no point of a step is higher than either end of
+    # the step by more than the arc length of a step
+    step_altitude = np.maximum(altitude, np.roll(altitude, -1, axis=-1))
+    max_step_altitude = step_altitude + np.degrees(constants.earth_rotation_rate * step)
+
+    # Table cells spanned by each step. Up to culling_max_altitude, the azimuth changes by a few degrees at most
+    # during a step, so it goes the short way round from one end to the other. Higher up, the lowest point of the
+    # whole horizon is used
+    num_cells = len(effective_horizon.altitudes)
+    cell = np.rint(azimuth * (1.0 / effective_horizon.resolution)).astype(int) % num_cells
+    next_cell = np.roll(cell, -1, axis=-1)
+    cell_delta = (next_cell - cell) % num_cells
+    is_forward = cell_delta <= num_cells // 2
+    min_step_horizon = calc_range_min(
+        calc_range_mins(effective_horizon.altitudes),
+        np.where(is_forward, cell, next_cell),
+        np.where(is_forward, cell_delta, num_cells - cell_delta),
+    )
+    min_step_horizon[max_step_altitude >= constants.culling_max_altitude] = effective_horizon.altitudes.min()
+
+    may_be_visible = max_step_altitude > min_step_horizon
+    peak_altitude = np.max(np.where(may_be_visible, max_step_altitude, -90.0), axis=-1)
+
+    # Samples are simulation_delta_t_hours apart, so each separate stretch of visibility holds up to one more sample
+    # than its length. One more covers nights slightly longer than a sidereal day (polar winter)
+    num_stretches = np.sum(may_be_visible & ~np.roll(may_be_visible, 1, axis=-1), axis=-1)
+    hours_visible = np.sum(may_be_visible, axis=-1) * step + (num_stretches + 1) * constants.simulation_delta_t_hours
+    return peak_altitude, hours_visible
+
+
+def calc_range_mins(altitudes):
+    # Sparse table: row j holds the lowest altitude over cells k..k + 2**j - 1 (wrapping around), for every cell k
+    range_mins = [altitudes]
+    while 2 ** len(range_mins) <= len(altitudes):
+        range_mins.append(np.minimum(range_mins[-1], np.roll(range_mins[-1], -(2 ** (len(range_mins) - 1)))))
+    return np.array(range_mins)
+
+
+def calc_range_min(range_mins, first_cell, num_cells):
+    # Lowest altitude over cells first_cell..first_cell + num_cells (wrapping around), from two overlapping rows
+    # of the sparse table
+    level = np.floor(np.log2(num_cells + 1)).astype(int)
+    last_cell = (first_cell + num_cells + 1 - 2**level) % range_mins.shape[-1]
+    return np.minimum(range_mins[level, first_cell], range_mins[level, last_cell])
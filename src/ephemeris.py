@@ -0,0 +1,66 @@
+"""Night Ephemeris: the darkness timeline of an observer, shared by all DSO simulations"""
+
+import numpy as np
+
+from src import constants, instrumentation, utils
+from src.models import NightEphemeris, UserSettings
+
+
+def build(user: UserSettings) -> NightEphemeris:
+    dt = constants.simulation_delta_t_hours
+    dusk, dawn = [], []
+    for _, first_day, last_day in split_years(user.night_dates):
+        # Every calendar year starts from its own Jan 1, as in simulate_reference, so that a date always gets the same
+        # nights. Only the days up to the end of the window are solved
+        with instrumentation.stage("sun solve"):
+            year_dusk, year_dawn = utils.calc_twilight(
+                -constants.jan_1_to_equinox_hours,
+                last_day + 1,
+                user.observer_latitude_radians,
+                user.observer_longitude_radians,
+            )
+        dusk.append(year_dusk[first_day:])
+        dawn.append(year_dawn[first_day:])
+    dusk, dawn = np.concatenate(dusk), np.concatenate(dawn)
+
+    # Sample times of every night, flattened: dusk + dt, dusk + 2 dt, ... up to dawn (as in the reference engine).
+    # Nights without darkness (polar summer) are empty
+    night_counts = np.maximum(np.ceil((dawn - dusk) / dt).astype(int) - 1, 0)
+    night_offsets = np.concatenate(([0], np.cumsum(night_counts)[:-1]))
+    sample_index = np.arange(night_counts.sum()) - np.repeat(night_offsets, night_counts) + 1
+    sample_times = np.repeat(dusk, night_counts) + sample_index * dt
+
+    return NightEphemeris(
+        dusk=dusk,
+        dawn=dawn,
+        sample_times=sample_times,
+        night_offsets=night_offsets,
+        night_counts=night_counts,
+        night_dates=user.night_dates,
+    )
+
+
+def split_years(night_dates):
+    # Jan 1, first and last day of the year (counted from Jan 1) of each calendar year in the window
+    years = night_dates.astype("datetime64[Y]")
+    for year in np.unique(years):
+        year_dates = night_dates[years == year]
+        jan_1 = year.astype("datetime64[D]")
+        yield jan_1, int((year_dates[0] - jan_1).astype(int)), int((year_dates[-1] - jan_1).astype(int))
+
+
+def split(night_ephemeris: NightEphemeris, max_nights: int):
+    # Consecutive chunks of at most max_nights nights, so that long windows are simulated in bounded memory.
+    # Chunks are views of the ephemeris
+    for first in range(0, len(night_ephemeris.night_counts), max_nights):
+        last = min(first + max_nights, len(night_ephemeris.night_counts))
+        first_sample = night_ephemeris.night_offsets[first]
+        last_sample = first_sample + night_ephemeris.night_counts[first:last].sum()
+        yield NightEphemeris(
+            dusk=night_ephemeris.dusk[first:last],
+            dawn=night_ephemeris.dawn[first:last],
+            sample_times=night_ephemeris.sample_times[first_sample:last_sample],
+            night_offsets=night_ephemeris.night_offsets[first:last] - first_sample,
+            night_counts=night_ephemeris.night_counts[first:last],
+            night_dates=night_ephemeris.night_dates[first:last],
+        )
@@ -1,17 +1,66 @@
 """Horizon"""
 
-import matplotlib.pyplot as plt
 import numpy as np
-from matplotlib.ticker import MultipleLocator
 
-from src.models import UserSettings
+from src import constants
+from src.models import EffectiveHorizon, UserSettings
 
 
-def load_data(user: UserSettings):
-    return np.loadtxt(user.horizon_file, dtype="float", comments="#", delimiter=None, skiprows=0)
+def load_data(user: UserSettings) -> EffectiveHorizon:
+    horizon_data = np.loadtxt(user.horizon_file, dtype="float", comments="#", delimiter=None, skiprows=0)
+    return make_effective_horizon(horizon_data, user)
+
+
+def make_effective_horizon(horizon_data, user: UserSettings) -> EffectiveHorizon:
+    # horizon_data: horizon points, one (azimuth, altitude) row each (deg), as in a horizon file
+    horizon_data = np.asarray(horizon_data, dtype=float).reshape(-1, 2)
+    # Interpolation needs increasing azimuths, but points traced from panoramas can step backwards
+    horizon_data = horizon_data[np.argsort(horizon_data[:, 0], kind="stable")]
+
+    # Tabulate the effective horizon (local horizon, but never below the minimum observation altitude) once,
+    # so that the simulations only need an indexed lookup per azimuth
+    num_points = int(round(360.0 / user.horizon_resolution))
+    resolution = 360.0 / num_points
+    altitudes = calc_effective_altitude(horizon_data, np.arange(num_points) * resolution, user)
+
+    # Largest difference between a table lookup and exact interpolation: exact interpolation is piecewise linear,
+    # so the worst case is either at an edge of a table cell, or at one of the horizon points
+    cell_edges = (np.arange(num_points) + 0.5) * resolution
+    edge_altitudes = calc_effective_altitude(horizon_data, cell_edges, user)
+    point_index = np.rint(horizon_data[:, 0] / resolution).astype(int) % num_points
+    max_error = max(
+        np.abs(edge_altitudes - altitudes).max(),
+        np.abs(edge_altitudes - np.roll(altitudes, -1)).max(),
+        np.abs(np.maximum(user.min_obs_altitude, horizon_data[:, 1]) - altitudes[point_index]).max(),
+    )
+
+    return EffectiveHorizon(data=horizon_data, altitudes=altitudes, resolution=resolution, max_error=max_error)
+
+
+def calc_effective_altitude(horizon_data, azimuth, user: UserSettings):
+    # Exact interpolation of the horizon points. The points are extended by one turn on each side, so that
+    # interpolation wraps around at 0/360 deg when the horizon file does not cover the full circle
+    horizon_azimuth = np.concatenate((horizon_data[-1:, 0] - 360.0, horizon_data[:, 0], horizon_data[:1, 0] + 360.0))
+    horizon_altitude = np.concatenate((horizon_data[-1:, 1], horizon_data[:, 1], horizon_data[:1, 1]))
+    horizon_altitude = np.interp(np.mod(azimuth, 360.0), horizon_azimuth, horizon_altitude)
+    return np.maximum(user.min_obs_altitude, horizon_altitude)
+
+
+def lookup(effective_horizon: EffectiveHorizon, azimuth):
+    # Effective horizon altitude at each azimuth (deg, any shape), from the nearest table entry
+    num_points = len(effective_horizon.altitudes)
+    index = np.rint(azimuth * (1.0 / effective_horizon.resolution)).astype(int) % num_points
+    return effective_horizon.altitudes[index]
 
 
 def plot_data(horizon_data, user: UserSettings):
+    # Only plots need matplotlib: it is not imported by the simulations (see api.py)
+    import matplotlib
+
+    matplotlib.use(constants.plot_backend)
+    import matplotlib.pyplot as plt
+    from matplotlib.ticker import MultipleLocator
+
     out_file = f"{user.results_path}/horizon.png"
 
     fig, axes = plt.subplots(1, 1, figsize=(8, 5))
@@ -0,0 +1,229 @@
+"""Instrumentation of a run: nested stage timings and counters, recorded in the parent process and in the pool workers,
+then summarized on the console and exported as a trace (Chrome trace format, for chrome://tracing or Perfetto).
+Optionally, pool jobs are profiled with cProfile and their statistics merged. Nothing is recorded unless enabled"""
+
+import contextlib
+import cProfile
+import json
+import os
+import pickle
+import pstats
+from pathlib import Path
+from time import perf_counter, time
+
+_enabled = False  # Record stages and counters (set by enable, and by Instrumented in the workers)
+_profile = False  # Profile pool jobs (parent only: the workers get it from Instrumented)
+_stack = []  # Stages being timed in this process, outermost first
+_records = None  # Records of this process since it was enabled (of the current job, in a worker): see new_records
+_profile_stats = None  # Merged profile statistics of the pool jobs (parent only)
+
+
+def new_records() -> dict:
+    return {
+        "stages": {},  # Total seconds and number of calls of each stage, by path ("outer/inner")
+        "worker_stages": {},  # Same as stages, for the stages of the pool jobs merged into the parent's records
+        "counters": {},
+        "events": [],  # Chrome trace events
+        "workers": {},  # Busy seconds and number of jobs of each pool worker, by pid
+    }
+
+
+def enable(profile: bool = False):
+    global _enabled, _profile, _records
+    _enabled, _profile, _records = True, profile, new_records()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    # Times the enclosed code as a stage, nested in the stages already being timed by this process
+    if not _enabled:
+        yield
+        return
+    _stack.append(name)
+    path = "/".join(_stack)
+    totals = _records["stages"].setdefault(path, [0.0, 0])  # Set up on entry, so that stages come before their own
+    start_time, start_clock = time(), perf_counter()
+    try:
+        yield
+    finally:
+        duration = perf_counter() - start_clock
+        _stack.pop()
+        totals[0] += duration
+        totals[1] += 1
+        _records["events"].append(
+            {
+                "name": name,
+                "cat": path,
+                "ph": "X",
+                "ts": start_time * 1e6,
+                "dur": duration * 1e6,
+                "pid": os.getpid(),
+                "tid": 0,
+            }
+        )
+
+
+def count(name: str, amount=1):
+    if _enabled:
+        _records["counters"][name] = _records["counters"].get(name, 0) + int(amount)
+
+
+@contextlib.contextmanager
+def counting_calls(module, name: str, counter: str):
+    # Counts the calls of module.name made by the enclosed code, in one go on exit. The function is only wrapped when
+    # enabled: otherwise the enclosed code calls it directly
+    if not _enabled:
+        yield
+        return
+    func = getattr(module, name)
+    calls = 0
+
+    def counted(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return func(*args, **kwargs)
+
+    setattr(module, name, counted)
+    try:
+        yield
+    finally:
+        setattr(module, name, func)
+        count(counter, calls)
+
+
+def count_pickled(name: str, data):
+    # Counts the bytes data takes once pickled (as sent to or from a pool worker). Only pickles when enabled
+    if _enabled:
+        count(name, len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)))
+
+
+class Instrumented:
+    # Picklable wrapper of a pool job: runs the job as a stage of the worker, and returns its result together with
+    # the worker's records (and profile statistics), to be merged into the parent's by merged(). The parent's
+    # settings travel with the wrapper, so that they reach the workers whatever the start method of the pool
+    def __init__(self, func, name: str):
+        self.func = func
+        self.name = name
+        self.enabled = _enabled
+        self.profile = _profile
+
+    def __call__(self, args):
+        if not self.enabled:
+            return self.func(args), None
+
+        # Each job starts afresh: a forked worker even starts with a copy of the parent's records and stages
+        global _enabled, _records
+        _enabled, _records = True, new_records()
+        _stack.clear()
+        profiler = cProfile.Profile() if self.profile else None
+        start_clock = perf_counter()
+        with stage(self.name):
+            if profiler is not None:
+                profiler.enable()
+            result = self.func(args)
+            if profiler is not None:
+                profiler.disable()
+            count_pickled("bytes pickled from workers", result)
+        _records["workers"][os.getpid()] = [perf_counter() - start_clock, 1]
+        if profiler is not None:
+            profiler.create_stats()
+            _records["profile"] = profiler.stats
+        return result, _records
+
+
+def merged(job_results):
+    # Results of Instrumented pool jobs, as they come in, with the records of each job merged into the parent's
+    for result, records in job_results:
+        if records is not None:
+            merge(records)
+        yield result
+
+
+def merge(records: dict):
+    # Worker stages are kept apart from the parent's: they run in parallel, and add up to more than the run time
+    global _profile_stats
+    for path, (seconds, calls) in records["stages"].items():
+        totals = _records["worker_stages"].setdefault(path, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += calls
+    for name, amount in records["counters"].items():
+        count(name, amount)
+    _records["events"].extend(records["events"])
+    for pid, (seconds, jobs) in records["workers"].items():
+        totals = _records["workers"].setdefault(pid, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += jobs
+    if "profile" in records:
+        job_stats = pstats.Stats(_RawStats(records["profile"]))
+        if _profile_stats is None:
+            _profile_stats = job_stats
+        else:
+            _profile_stats.add(job_stats)
+
+
+class _RawStats:
+    # The raw statistics of a profiler, as pstats.Stats reads them
+    def __init__(self, stats: dict):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def print_report():
+    print("Instrumentation:")
+    for title, stages in (("Stages", _records["stages"]), ("Pool jobs", _records["worker_stages"])):
+        if stages:
+            print(f"\t{title} (total s, calls):")
+        for path, (seconds, calls) in stages.items():
+            depth = path.count("/")
+            name = "  " * depth + path.rsplit("/", 1)[-1]
+            print(f"\t\t{name:<36} {seconds:9.3f} {calls:8d}")
+
+    if _records["counters"]:
+        print("\tCounters:")
+    for name, amount in sorted(_records["counters"].items()):
+        print(f"\t\t{name:<36} {amount:>18,}")
+
+    busy_times = [seconds for seconds, _ in _records["workers"].values()]
+    if busy_times:
+        mean_time = sum(busy_times) / len(busy_times)
+        print(
+            f"\tWorkers: {len(busy_times)}, busy {min(busy_times):.2f} s min, {mean_time:.2f} s mean, "
+            f"{max(busy_times):.2f} s max (imbalance {max(busy_times) / max(mean_time, 1e-9):.2f}x)"
+        )
+
+
+def save_trace(file):
+    # Chrome trace (JSON object format): the stage events of every process, with the totals, counters and worker
+    # times as metadata
+    counter_events = [
+        {"name": name, "ph": "C", "ts": time() * 1e6, "pid": os.getpid(), "tid": 0, "args": {name: amount}}
+        for name, amount in _records["counters"].items()
+    ]
+    trace = {
+        "traceEvents": _records["events"] + counter_events,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "stages": _records["stages"],
+            "worker_stages": _records["worker_stages"],
+            "counters": _records["counters"],
+            "workers": {str(pid): totals for pid, totals in _records["workers"].items()},
+        },
+    }
+    Path(file).write_text(json.dumps(trace))
+    print(f"\tTrace saved to {file}")
+
+
+def save_profile(file, top: int = 25):
+    # Merged profile of the pool jobs: saved for pstats or snakeviz, and its top functions printed
+    if _profile_stats is None:
+        print("\tNo pool jobs were profiled")
+        return
+    _profile_stats.dump_stats(file)
+    print(f"\tProfile of the pool jobs saved to {file}. Top functions by cumulative time:")
+    _profile_stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
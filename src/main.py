@@ -1,154 +1,545 @@
+import contextlib
 import csv
+import functools
+import itertools
 import math
 from multiprocessing import Pool
 from time import perf_counter
 
-from src import constants, horizon, plots, simulator, utils
-from src.models import DSOPlotArgs, SimJobArgs, SimResult, UserSettings
+import numpy as np
+
+from src import (
+    cache,
+    catalog,
+    constants,
+    culling,
+    ephemeris,
+    horizon,
+    instrumentation,
+    progress,
+    results,
+    shared,
+    simulator,
+    sweep,
+    tonight,
+    utils,
+)
+from src.models import (
+    DSOPlotArgs,
+    PoolContext,
+    RunContext,
+    SimBlockArgs,
+    SimGroup,
+    SimResult,
+    SiteSimulation,
+    UserSettings,
+)
 
 
 def main(user: UserSettings):
+    run_sites([user])
+
+
+def run_sites(sites: list[UserSettings]):
+    # Runs any number of observing sites together: the catalog is parsed once per catalog file, the darkness timeline
+    # is computed once per location, and the simulations and DSO plots of all the sites share a single pool
+    if len({user.results_path for user in sites}) < len(sites):
+        raise ValueError("Each site needs its own results folder")
+
     start_time = perf_counter()
-    print(f"\tLimiting Stellarium catalog: {user.catalog_id_range}")
+    effective_horizons = []
+    for user in sites:
+        print(f"\t{site_prefix(user, sites)}Limiting Stellarium catalog: {user.catalog_id_range}")
     print("\tRunning simulations:")
-    horizon_data = horizon.load_data(user=user)
+    for user in sites:
+        with instrumentation.stage("horizon"):
+            effective_horizon = horizon.load_data(user=user)
+        print(
+            f"\t\t{site_prefix(user, sites)}Horizon table: {effective_horizon.resolution} deg resolution, "
+            f"max error {effective_horizon.max_error:.3f} deg"
+        )
+        effective_horizons.append(effective_horizon)
 
-    stellarium_headers, local_catalog_results, dso_results, num_galaxies, num_nebulas = run_simulations(
-        horizon_data, user=user
-    )
-    utils.print_elapsed_time("\tSimulations completed", start_time)
+    with instrumentation.stage("prepare"):
+        site_simulations = prepare_simulations(sites, effective_horizons)
+    shared_arrays = shared.SharedArrays()
+    with instrumentation.stage("share"):
+        pool_context = share_contexts(site_simulations, shared_arrays)
+    pool_size = max(user.pool_size for user in sites)
+    make_plots = any(user.make_plots for user in sites)
+    if make_plots:
+        # matplotlib is only imported when plots are made: then before the pool starts, so that forked workers
+        # inherit it instead of each importing it again
+        with instrumentation.stage("import plots"):
+            from src import plots
+    with (
+        shared_arrays,
+        progress.ProgressMonitor() as monitor,
+        Pool(
+            processes=pool_size,
+            initializer=init_worker,
+            initargs=(pool_context, monitor.queue, monitor.with_names),
+        ) as pool,
+    ):
+        # Data files (DSO list, local catalog and result store) are written as simulation results come in
+        with instrumentation.stage("simulate"):
+            site_results = run_simulations(site_simulations, pool, pool_size, monitor)
+        utils.print_elapsed_time("\tSimulations completed", start_time)
+
+        print("\tGenerating outputs:")
+
+        # Generate individual DSO plots
+        if make_plots:
+            start_time = perf_counter()
+            print("\t\tGenerating DSO plots:")
+            with instrumentation.stage("dso plots"):
+                generate_dso_plots(site_results, sites, pool, monitor)
+            utils.print_elapsed_time("\t\t\tDSO Plots completed", start_time)
+
+    for user, effective_horizon, dso_results in zip(sites, effective_horizons, site_results):
+        if not user.make_plots:
+            print(f"\t\t- {site_prefix(user, sites)}Plots skipped")
+            continue
+
+        # Generate Horizon plot
+        start_time = perf_counter()
+        with instrumentation.stage("horizon plot"):
+            horizon.plot_data(effective_horizon.data, user=user)
+        utils.print_elapsed_time(f"\t\t- {site_prefix(user, sites)}Horizon plot", start_time)
+
+        # Generate global plots
+        start_time = perf_counter()
+        with instrumentation.stage("global plots"):
+            plots.generate_global_plots(results.make_columns(dso_results), user=user)
+        utils.print_elapsed_time(f"\t\t- {site_prefix(user, sites)}Global plots", start_time)
+
+    print("\tIdentified:")
+    for user, dso_results in zip(sites, site_results):
+        num_galaxies = sum(1 for r in dso_results if r.is_galaxy)
+        print(f"\t\t- {site_prefix(user, sites)}Galaxies: {num_galaxies}")
+        print(f"\t\t- {site_prefix(user, sites)}Nebulas: {len(dso_results) - num_galaxies}")
+
+
+def init_worker(pool_context: PoolContext, progress_queue, with_names: bool):
+    # Pool initializer: run-wide state, and where progress events go
+    shared.init_worker(pool_context)
+    progress.init_worker(progress_queue, with_names)
+
+
+def site_prefix(user: UserSettings, sites: list[UserSettings]) -> str:
+    # Console messages are only labelled with their site when there are several
+    return f"{user.site_name}: " if len(sites) > 1 else ""
+
+
+def prepare_simulations(sites: list[UserSettings], effective_horizons) -> list[SiteSimulation]:
+    stellarium_catalogs = {}
+    night_ephemerides = {}
+    site_simulations = []
+    for user, effective_horizon in zip(sites, effective_horizons):
+        # Catalog range, size, type and declination prefilters
+        if user.catalog_file not in stellarium_catalogs:
+            with instrumentation.stage("catalog"):
+                stellarium_catalogs[user.catalog_file] = catalog.load(user)
+        stellarium_catalog = stellarium_catalogs[user.catalog_file]
+        with instrumentation.stage("select"):
+            dso_index = np.flatnonzero(catalog.select(stellarium_catalog.rows, user))
+            dso_rows = stellarium_catalog.rows[dso_index]
+        instrumentation.count("objects filtered out", len(stellarium_catalog.rows) - len(dso_index))
+
+        # The darkness timeline only depends on the observer's location and dates: compute it once per location
+        location = (user.observer_latitude, user.observer_longitude, str(user.night_dates[0]), user.simulation_days)
+        if location not in night_ephemerides:
+            with instrumentation.stage("ephemeris"):
+                night_ephemerides[location] = ephemeris.build(user)
+        night_ephemeris = night_ephemerides[location]
+        result_cache = cache.open_cache(user)
+        run_context = RunContext(user, effective_horizon, night_ephemeris, result_cache)
+
+        # Objects that can never clear the horizon for long enough, or high enough, are not simulated at all
+        start_time = perf_counter()
+        with instrumentation.stage("culling"):
+            is_culled = culling.find_never_visible(dso_rows, effective_horizon, user)
+        culling_time = perf_counter() - start_time
+        candidate_index = np.flatnonzero(~is_culled)
+        instrumentation.count("objects culled", is_culled.sum())
+
+        # Objects already simulated by a previous run, with the same physics, are read back from the result cache
+        cached_results = []
+        is_cached = np.zeros(len(dso_rows), dtype=bool)
+        if result_cache is not None:
+            with instrumentation.stage("cache lookup"):
+                candidates = simulator.make_sim_block(
+                    dso_rows[candidate_index], catalog.catalog_names(dso_rows[candidate_index])
+                )
+                for k, sim_job in zip(candidate_index, simulator.block_jobs(candidates, run_context)):
+                    time_series = cache.load(result_cache, sim_job.object_ra_radians, sim_job.object_dec_radians)
+                    if time_series is not None:
+                        is_cached[k] = True
+                        cached_results.append(simulator.make_result(sim_job, time_series))
+            instrumentation.count("objects cached", is_cached.sum())
+
+        site_simulations.append(
+            SiteSimulation(
+                run_context=run_context,
+                catalog_headers=stellarium_catalog.headers,
+                catalog_rows=stellarium_catalog.rows,
+                dso_rows=dso_rows,
+                cached_results=cached_results,
+                sim_index=dso_index[~is_culled & ~is_cached],
+                num_culled=int(is_culled.sum()),
+                culling_time=culling_time,
+            )
+        )
+    return site_simulations
+
+
+def make_sim_groups(site_simulations: list[SiteSimulation]) -> list[SimGroup]:
+    # Sites at the same location (with the same dates, catalog and engine) are simulated together: the altitude and
+    # azimuth of each of their DSOs, which make up most of the simulation time, are only computed once. Sites with
+    # nothing left to simulate (every object cached or culled) make no group
+    group_sites = {}
+    for site, site_simulation in enumerate(site_simulations):
+        user = site_simulation.run_context.user
+        group_key = (
+            user.observer_latitude,
+            user.observer_longitude,
+            str(user.night_dates[0]),
+            user.simulation_days,
+            user.catalog_file,
+            user.simulation_engine,
+        )
+        group_sites.setdefault(group_key, []).append(site)
+
+    sim_groups = []
+    for sites in group_sites.values():
+        first_site = site_simulations[sites[0]]
+        sim_index = functools.reduce(np.union1d, [site_simulations[site].sim_index for site in sites])
+        if len(sim_index) == 0:
+            continue
+        rows = first_site.catalog_rows[sim_index]
+        site_masks = np.array([np.isin(sim_index, site_simulations[site].sim_index) for site in sites])
+        # Long windows are simulated a chunk of nights at a time: the largest chunk sets the memory use
+        chunks = ephemeris.split(first_site.run_context.night_ephemeris, constants.simulation_chunk_nights)
+        num_samples = max(len(chunk.sample_times) for chunk in chunks)
+        block_size = simulator.calc_block_size(num_samples, len(rows), first_site.run_context.user)
+        sim_groups.append(SimGroup(tuple(sites), rows, catalog.catalog_names(rows), site_masks, block_size))
+    return sim_groups
+
+
+def share_contexts(site_simulations: list[SiteSimulation], shared_arrays: shared.SharedArrays) -> PoolContext:
+    # The state of every site is published to each worker once, with its arrays in shared memory, so that blocks only
+    # carry their own objects. Sites at the same location share their darkness timeline
+    shared_ephemerides = {}
+    shared_contexts = []
+    for site_simulation in site_simulations:
+        night_ephemeris = site_simulation.run_context.night_ephemeris
+        if id(night_ephemeris) not in shared_ephemerides:
+            shared_ephemerides[id(night_ephemeris)] = shared_arrays.share(night_ephemeris)
+        run_context = site_simulation.run_context._replace(night_ephemeris=shared_ephemerides[id(night_ephemeris)])
+        shared_contexts.append(shared_arrays.share(run_context))
+    return PoolContext(tuple(shared_contexts))
+
+
+def run_simulations(
+    site_simulations: list[SiteSimulation], pool, pool_size: int, monitor: progress.ProgressMonitor
+) -> list[list[SimResult]]:
+    # Included DSOs of each site, without their time series: those are in the result store once it is written, and
+    # keeping them in memory until the plots would make the memory use grow with the size of the catalog
+    sites = [site_simulation.run_context.user for site_simulation in site_simulations]
+    site_results = [[] for _ in site_simulations]
+
+    # Objects are sent to the pool in blocks, each simulated as a whole by a single worker. Blocks of all sites go
+    # to the same pool; they are only built as the pool asks for them, and results are handled in whatever order
+    # they complete
+    sim_groups = make_sim_groups(site_simulations)
+    sim_blocks = (make_group_block(g, k) for g in sim_groups for k in range(0, len(g.rows), g.block_size))
+    sim_blocks = map(count_pickled_block, sim_blocks)
+    num_blocks = 0
+    for g in sim_groups:
+        num_group_blocks = math.ceil(len(g.rows) / g.block_size)
+        first_block = make_group_block(g, 0)
+        bytes_per_object = utils.pickled_size(first_block) / max(len(first_block.catalog_ids), 1)
+        group_names = ", ".join(sites[site].site_name for site in g.sites) + ": " if len(sites) > 1 else ""
+        print(
+            f"\t\t{group_names}{len(g.rows)} objects in {num_group_blocks} blocks of up to "
+            f"{g.block_size} (~{bytes_per_object:.0f} bytes sent to the workers per object)"
+        )
+        num_blocks += num_group_blocks
 
-    print("\tGenerating outputs:")
     start_time = perf_counter()
-    generate_file_outputs(
-        stellarium_headers=stellarium_headers,
-        local_catalog_results=local_catalog_results,
-        dso_results=dso_results,
-        user=user,
+    num_cached = sum(len(s.cached_results) for s in site_simulations)
+    monitor.begin("simulate", "\t\tSimulated", sum(len(s.sim_index) for s in site_simulations) + num_cached, "objects")
+    monitor.advance("simulate", num_cached, sum(r.is_included for s in site_simulations for r in s.cached_results))
+    with contextlib.ExitStack() as stack:
+        site_outputs = [open_outputs(stack, s) for s in site_simulations]
+
+        # Blocks are already batches of objects, so only group them when there are many per worker
+        chunk_size = max(1, num_blocks // (pool_size * constants.pool_tasks_per_worker))
+        block_results = instrumentation.merged(
+            pool.imap_unordered(
+                instrumentation.Instrumented(simulator.run_block, "simulate block"), sim_blocks, chunksize=chunk_size
+            )
+        )
+        cached_results = [(site, s.cached_results) for site, s in enumerate(site_simulations)]
+        for site, sim_results in itertools.chain(cached_results, itertools.chain.from_iterable(block_results)):
+            f_stellarium, f_local_catalog, csv_writer, store_writer, row_index = site_outputs[site]
+            for result in sim_results:
+                row = site_simulations[site].dso_rows[row_index[result.catalog_id]]
+                store_writer.append(result, str(row["type"]))
+                if result.is_included:
+                    instrumentation.count("objects included")
+                    site_results[site].append(result._replace(time_series=None))
+                    csv_writer.writerow(result.csv_row)
+                    f_local_catalog.write(catalog.read_line(f_stellarium, row))
+    monitor.end()
+
+    # Culled objects would have taken about as long as the others to simulate
+    time_per_object = (perf_counter() - start_time) / max(sum(len(g.rows) for g in sim_groups), 1)
+    for user, s in zip(sites, site_simulations):
+        print(
+            f"\t\t{site_prefix(user, sites)}Culled {s.num_culled} of {len(s.dso_rows)} objects that can never be "
+            f"included in {s.culling_time:.2f} s (~{s.num_culled * time_per_object:.2f} s of simulation saved)"
+        )
+        if s.run_context.result_cache is not None:
+            num_hits = len(s.cached_results)
+            num_evicted = cache.evict(s.run_context.result_cache, user.cache_max_size_mb)
+            print(
+                f"\t\t{site_prefix(user, sites)}Result cache: {num_hits} hits, {len(s.sim_index)} misses "
+                f"({num_hits / max(num_hits + len(s.sim_index), 1):.0%} hit rate), {num_evicted} entries evicted"
+            )
+
+    return site_results
+
+
+def count_pickled_block(block: SimBlockArgs) -> SimBlockArgs:
+    # Blocks are pickled by the pool as it sends them to the workers
+    instrumentation.count_pickled("bytes pickled to workers", block)
+    return block
+
+
+def open_outputs(stack: contextlib.ExitStack, site_simulation: SiteSimulation):
+    # Files a site's results are written to as they come in
+    user = site_simulation.run_context.user
+    f_stellarium = stack.enter_context(open(user.catalog_file, "rb"))
+    f_local_catalog = stack.enter_context(open(user.local_catalog_file, "w"))
+    f_dso_list = stack.enter_context(open(user.dso_list_file, "w"))
+    store_writer = stack.enter_context(results.ResultStoreWriter(user))
+
+    f_local_catalog.writelines(site_simulation.catalog_headers)
+    csv_writer = csv.writer(f_dso_list)
+    csv_writer.writerow(SimResult.csv_row_headers())
+    row_index = {catalog_id: k for k, catalog_id in enumerate(site_simulation.dso_rows["id"])}
+    return f_stellarium, f_local_catalog, csv_writer, store_writer, row_index
+
+
+def make_group_block(sim_group: SimGroup, start: int) -> SimBlockArgs:
+    end = start + sim_group.block_size
+    return simulator.make_sim_block(
+        sim_group.rows[start:end],
+        sim_group.catalog_names[start:end],
+        sim_group.sites,
+        sim_group.site_masks[:, start:end],
     )
-    utils.print_elapsed_time("\t\t- Data files", start_time)
 
-    # Generate individual DSO plots
-    start_time = perf_counter()
-    print("\t\tGenerating DSO plots:")
-    generate_dso_plots(dso_results, user=user)
-    utils.print_elapsed_time("\t\t\tDSO Plots completed", start_time)
 
-    # Generate Horizon plot
+def generate_dso_plots(
+    site_results: list[list[SimResult]], sites: list[UserSettings], pool, monitor: progress.ProgressMonitor
+):
+    # Only the selected DSOs are plotted, and only when their plot is not already in the site's results folder.
+    # Their time series are read from the memory-mapped result store of their site. Plots of all sites go to the same
+    # pool
+    from src import plots
+
+    new_jobs = []
+    manifests = []
+    for site, (user, dso_results) in enumerate(zip(sites, site_results)):
+        if not user.make_plots:
+            manifests.append(None)
+            continue
+        store = results.open_store(user)
+        store_index = {catalog_id: k for k, catalog_id in enumerate(store.index["id"].tolist())}
+        jobs = [
+            DSOPlotArgs(
+                catalog_name=dso_result.catalog_name,
+                max_score_date=dso_result.max_date,
+                time_series=store.time_series[store_index[dso_result.catalog_id]],
+                site=site,
+            )
+            for dso_result in select_dso_plots(dso_results, user)
+        ]
+        manifest = plots.load_plot_manifest(user)
+        plot_keys = {job.catalog_name: plots.dso_plot_key(job) for job in jobs}
+        site_new_jobs = [
+            job
+            for job in jobs
+            if manifest.get(job.catalog_name) != plot_keys[job.catalog_name]
+            or not plots.dso_plot_file(job.catalog_name, user).exists()
+        ]
+        print(
+            f"\t\t\t{site_prefix(user, sites)}{len(jobs)} DSOs selected, "
+            f"{len(jobs) - len(site_new_jobs)} plots unchanged"
+        )
+        new_jobs.extend(site_new_jobs)
+        if user.clear_results_before_running:
+            # Plots kept by the clearing of the results folder (see settings.prepare_results_folder), but no longer
+            # selected, go as the rest of the previous run did
+            for catalog_name in manifest.keys() - plot_keys.keys():
+                plots.dso_plot_file(catalog_name, user).unlink(missing_ok=True)
+            manifest = {}
+        manifests.append(manifest | plot_keys)
+
+    monitor.begin("plot", "\t\t\tPlotted", len(new_jobs), "DSOs")
+    list(instrumentation.merged(pool.map(instrumentation.Instrumented(plots.plot_dso, "dso plot"), new_jobs)))
+    monitor.end()
+    for user, manifest in zip(sites, manifests):
+        if manifest is not None:
+            plots.save_plot_manifest(manifest, user)
+
+
+def select_dso_plots(dso_results, user: UserSettings):
+    # All included DSOs, unless the user asked for the best N, and/or for some DSOs by name
+    if user.plot_top_n is None and not user.plot_objects:
+        return dso_results
+
+    ranked_results = sorted(dso_results, key=lambda r: (-r.max_score, r.catalog_id))
+    selected = {r.catalog_id: r for r in ranked_results[: user.plot_top_n or 0]}
+    results_by_name = {results.normalize_name(r.catalog_name): r for r in dso_results}
+    for name in user.plot_objects:
+        dso_result = results_by_name.get(results.normalize_name(name))
+        if dso_result is None:
+            print(f"\t\t\t{name} is not an included DSO, and is not plotted")
+        else:
+            selected[dso_result.catalog_id] = dso_result
+    return list(selected.values())
+
+
+def list_tonight(user: UserSettings, nights: int):
+    # Best targets of the next few nights, without simulating the whole window or writing any file
     start_time = perf_counter()
-    horizon.plot_data(horizon_data, user=user)
-    utils.print_elapsed_time("\t\t- Horizon plot", start_time)
+    targets = tonight.find_targets(user, nights)
+    utils.print_elapsed_time(f"\t{user.site_name}: {len(targets)} targets found", start_time)
+    for rank, target in enumerate(targets[: constants.tonight_max_targets], start=1):
+        print(
+            f"\t\t{rank:2d}. {target.catalog_name:<12} {'Galaxy' if target.is_galaxy else 'Nebula'}  "
+            f"{target.night_date}  {target.visible_from:%H:%M}-{target.visible_to:%H:%M %Z}  "
+            f"max alt {target.max_altitude:4.1f} deg  {target.hours_visible:4.1f} h  score {target.score:.2f}"
+        )
 
-    # Generate global plots
+
+def sweep_filters(user: UserSettings):
+    # Included DSOs for every combination of the sweep values of the filters, from the last run, without simulating
     start_time = perf_counter()
-    plots.generate_global_plots(user=user)
-    utils.print_elapsed_time("\t\t- Global plots", start_time)
+    store = results.open_store(user)
+    if store is None:
+        print("\t- No results: run a simulation first")
+        return
+    if store.meta["run_key"] != cache.calc_run_key(user):
+        print(
+            "\t- The last run used other physics (location, horizon, MinObservationAltitude, dates or engine): "
+            "run a simulation first"
+        )
+        return
 
-    print("\tIdentified:")
-    print(f"\t\t- Galaxies: {num_galaxies}")
-    print(f"\t\t- Nebulas: {num_nebulas}")
-
-
-def run_simulations(horizon_data, user: UserSettings):
-    stellarium_headers = []
-    local_catalog_results = []
-    dso_results = []
-
-    sim_jobs = []
-
-    reached_stellarium_data = False
-    with open(user.catalog_file) as f_stellarium:
-        for stellarium_row in f_stellarium:
-            if stellarium_row.startswith("#"):
-                if not reached_stellarium_data:
-                    stellarium_headers.append(stellarium_row)
-            else:
-                reached_stellarium_data = True
-                stellarium_row_data = stellarium_row.split("\t")
-                catalog_id = int(stellarium_row_data[0])
-
-                # Extract needed Stellarium data
-                object_ra_degrees = float(stellarium_row_data[1])
-                object_dec_degrees = float(stellarium_row_data[2])
-                object_ra_radians = math.radians(object_ra_degrees)
-                object_dec_radians = math.radians(object_dec_degrees)
-
-                object_size_major_axis_arcmin = float(stellarium_row_data[7])
-                object_size_minor_axis_arcmin = float(stellarium_row_data[8])
-                object_max_size = max(object_size_major_axis_arcmin, object_size_minor_axis_arcmin)
-                object_type = stellarium_row_data[5].strip()
-
-                if catalog_id < user.min_catalog_id:
-                    continue
-                elif user.max_catalog_id is not None and catalog_id > user.max_catalog_id:
-                    break
-
-                if (
-                    object_max_size > user.min_dso_size
-                    and object_type in constants.included_dso_types
-                    and (
-                        (user.observer_latitude > 0 and object_dec_degrees > user.min_obs_peak_dec)
-                        or (user.observer_latitude <= 0 and object_dec_degrees < user.min_obs_peak_dec)
-                    )
-                ):
-                    catalog_name, is_galaxy = utils.catalog_info(stellarium_row_data)
-                    if catalog_name is None or is_galaxy is None:
-                        # Either not in desired catalog, or not in DSO types of interest
-                        continue
-
-                    sim_jobs.append(
-                        SimJobArgs(
-                            catalog_id,
-                            catalog_name,
-                            is_galaxy,
-                            object_ra_radians,
-                            object_dec_radians,
-                            object_max_size,
-                            horizon_data,
-                            user,
-                        )
-                    )
-
-    with Pool(processes=user.pool_size) as pool:
-        all_results = pool.map(simulator.run_dso, sim_jobs)
-
-    for result in all_results:
-        if result.is_included:
-            dso_results.append(result)
-            local_catalog_results.append(stellarium_row)
-
-    num_galaxies = sum(1 for r in dso_results if r.is_galaxy)
-    num_nebulas = len(dso_results) - num_galaxies
-
-    return stellarium_headers, local_catalog_results, dso_results, num_galaxies, num_nebulas
-
-
-def generate_file_outputs(stellarium_headers, local_catalog_results, dso_results, user: UserSettings):
-    out_file = f"{user.local_catalog_file}"
-    with open(out_file, "w") as f_local_catalog:
-        for row in stellarium_headers:
-            f_local_catalog.write(row)
-        for row in local_catalog_results:
-            f_local_catalog.write(row)
-
-    # Generate DSO list file
-    with open(user.dso_list_file, "w") as f_dso_list:
-        csv_writer = csv.writer(f_dso_list)
-        csv_writer.writerow(SimResult.csv_row_headers())
-        for row in dso_results:
-            csv_writer.writerow(row.csv_row)
-
-
-def generate_dso_plots(dso_results, user: UserSettings):
-    jobs = [
-        DSOPlotArgs(
-            catalog_name=dso_result.catalog_name,
-            max_score_month=dso_result.max_month,
-            max_score_day=dso_result.max_day,
-            time_series=dso_result.time_series,
-            user=user,
+    sweep_rows = sweep.evaluate(store, user)
+    sweep.save(sweep_rows, user)
+    utils.print_elapsed_time(
+        f"\t{user.site_name}: {len(sweep_rows)} filter combinations, {len(store.physics)} DSOs", start_time
+    )
+    print(f"\t\t{'Hours':>6} {'Peak':>6} {'Size':>6} {'Included':>9} {'Galaxies':>9}  Best DSOs")
+    for row in sweep_rows:
+        # Looser than the filters of the run: DSOs those ruled out were not simulated, so there may be more
+        num_included = f"{row.num_included}{'' if row.is_exact else '+'}"
+        print(
+            f"\t\t{row.min_obs_hours:6.1f} {row.min_obs_peak_altitude:6.1f} {row.min_dso_size:6.1f} "
+            f"{num_included:>9} {row.num_galaxies:>9}  {', '.join(row.top_names[:3])}"
         )
-        for dso_result in dso_results
-    ]
-    with Pool(processes=user.pool_size) as pool:
-        pool.map(plots.plot_dso, jobs)
+    if not all(row.is_exact for row in sweep_rows):
+        print("\t\t+: at least, as looser than the filters of the run, whose excluded DSOs were never simulated")
+    print(f"\t\tSaved to {user.sweep_file}")
+
+
+def plot_global(user: UserSettings):
+    # Global plots, from the result store of the last run
+    from src import plots
+
+    start_time = perf_counter()
+    dso_results = results.load_results(user)
+    if dso_results is None:
+        print("\t- No results: run a simulation first")
+        return
+    plots.generate_global_plots(results.make_columns(dso_results), user=user)
+    utils.print_elapsed_time("\t- Global plots", start_time)
+
+
+def regenerate_outputs(user: UserSettings):
+    # DSO list file, DSO plots and global plots of the last run, from its result store, without simulating.
+    # As in a run, only the DSO plots that changed (or are missing) are made
+    start_time = perf_counter()
+    dso_results = results.load_results(user)
+    if dso_results is None:
+        print("\t- No results: run a simulation first")
+        return
+    results.write_dso_list(dso_results, user)
+    print(f"\t- DSO list: {len(dso_results)} DSOs")
+    if not user.make_plots:
+        utils.print_elapsed_time("\t- Outputs regenerated (plots skipped)", start_time)
+        return
+
+    from src import plots
+
+    manifest = plots.load_plot_manifest(user)
+    num_plots = 0
+    for dso_result in select_dso_plots(dso_results, user):
+        args = DSOPlotArgs(dso_result.catalog_name, dso_result.max_date, dso_result.time_series)
+        plot_key = plots.dso_plot_key(args)
+        out_file = plots.dso_plot_file(dso_result.catalog_name, user)
+        if manifest.get(dso_result.catalog_name) != plot_key or not out_file.exists():
+            plots.render_dso_plot(plots.dso_plot_template(args.time_series), args, out_file)
+            manifest[dso_result.catalog_name] = plot_key
+            num_plots += 1
+    plots.save_plot_manifest(manifest, user)
+    print(f"\t- DSO plots: {num_plots} made")
+
+    plots.generate_global_plots(results.make_columns(dso_results), user=user)
+    utils.print_elapsed_time("\t- Outputs regenerated", start_time)
+
+
+def plot_dsos(names, user: UserSettings):
+    # Plots of any DSOs, from the time series stored by the last run (or from the result cache), without simulating
+    from src import plots
+
+    time_series_by_name = {results.normalize_name(n): (n, ts) for n, ts in results.load_time_series(user).items()}
+    missing_names = [name for name in names if results.normalize_name(name) not in time_series_by_name]
+    time_series_by_name |= find_cached_time_series(missing_names, user)
+
+    manifest = plots.load_plot_manifest(user)
+    for name in names:
+        catalog_name, time_series = time_series_by_name.get(results.normalize_name(name), (name, None))
+        if time_series is None:
+            print(f"\t- {name}: no simulation results, run a simulation first")
+            continue
+        max_date, _ = simulator.calc_first_max_info(time_series)
+        args = DSOPlotArgs(catalog_name, max_date, time_series)
+        out_file = plots.dso_plot_file(catalog_name, user)
+        plots.render_dso_plot(plots.dso_plot_template(time_series), args, out_file)
+        manifest[catalog_name] = plots.dso_plot_key(args)
+        print(f"\t- {catalog_name}: {out_file}")
+    plots.save_plot_manifest(manifest, user)
+
+
+def find_cached_time_series(names, user: UserSettings) -> dict:
+    # Time series of DSOs that were simulated, but not included (or not stored), looked up in the result cache
+    result_cache = cache.open_cache(user)
+    wanted_names = {results.normalize_name(name) for name in names}
+    if result_cache is None or not wanted_names:
+        return {}
+
+    found = {}
+    rows = catalog.load(user).rows
+    for k, catalog_name in enumerate(catalog.catalog_names(rows)):
+        normalized_name = results.normalize_name(catalog_name)
+        if catalog_name and normalized_name in wanted_names:
+            time_series = cache.load(result_cache, np.radians(rows["ra"][k]), np.radians(rows["dec"][k]))
+            if time_series is not None:
+                found[normalized_name] = (catalog_name, time_series)
+    return found
@@ -1,31 +1,56 @@
 """Various data structures"""
 
 from dataclasses import dataclass
+from datetime import date, datetime
 from functools import cached_property
 from math import pi
 from pathlib import Path
-from typing import NamedTuple
+from typing import TYPE_CHECKING, NamedTuple
 
 import numpy as np
 
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.backends.backend_agg import BufferRegion, FigureCanvasAgg
+    from matplotlib.lines import Line2D
+    from matplotlib.text import Text
+
 
 @dataclass
 class UserSettings:
-    root_path: Path
-    ini_file: Path
+    # Read from an ini file by settings.read_settings, or made directly (see api.py): only the observer's location is
+    # required, and the filters default to those of the example ini file
     observer_latitude: float
     observer_longitude: float
-    horizon_file: Path
-    min_obs_hours: float
-    min_obs_peak_altitude: float
-    min_obs_altitude: float
-    min_dso_size: float
-    catalog_file: str
-    min_catalog_id: int
-    max_catalog_id: int | None
-    results_path: Path
-    clear_results_before_running: bool
-    pool_size: int
+    min_obs_hours: float = 5.0
+    min_obs_peak_altitude: float = 45.0
+    min_obs_altitude: float = 20.0
+    min_dso_size: float = 20.0
+    root_path: Path | None = None
+    ini_file: Path | None = None
+    horizon_file: Path | None = None
+    catalog_file: str = ""
+    min_catalog_id: int = 1
+    max_catalog_id: int | None = None
+    results_path: Path | None = None
+    clear_results_before_running: bool = False
+    pool_size: int = 1
+    horizon_resolution: float = 0.01
+    cache_path: Path | None = None
+    cache_max_size_mb: float = 1024.0
+    simulation_engine: str = "vectorized"
+    block_size: int | None = None
+    memory_budget_mb: float = 1024.0
+    make_plots: bool = True  # DSO, horizon and global plots (the data files are always written)
+    plot_top_n: int | None = None  # Only plot the N best scoring DSOs (and plot_objects)
+    plot_objects: tuple[str, ...] = ()  # Only plot these DSOs (and the plot_top_n best)
+    site_name: str = ""  # Observing site (the ini file name, or the name given in a sites table)
+    simulation_start: date | None = None  # First simulated night (Jan 1 of the current year when not set)
+    simulation_days: int = 365  # Number of simulated nights
+    # Filter values tried by a sweep (the filters above when not set)
+    sweep_min_obs_hours: tuple[float, ...] = ()
+    sweep_min_obs_peak_altitudes: tuple[float, ...] = ()
+    sweep_min_dso_sizes: tuple[float, ...] = ()
 
     @cached_property
     def observer_latitude_radians(self) -> float:
@@ -49,6 +74,12 @@ class UserSettings:
         else:
             return f"{self.min_catalog_id}-end"
 
+    @cached_property
+    def night_dates(self) -> np.ndarray:
+        # Date of each simulated night (of its evening), as datetime64[D]
+        start = np.datetime64(self.simulation_start or date(date.today().year, 1, 1), "D")
+        return np.arange(start, start + self.simulation_days)
+
     @cached_property
     def r_23(self) -> np.ndarray:
         return np.array(
@@ -67,6 +98,44 @@ class UserSettings:
     def dso_list_file(self) -> str:
         return f"{self.results_path}/DSO_list_{self.min_catalog_id}-{self.max_catalog_id}.csv"
 
+    @cached_property
+    def results_store_path(self) -> Path:
+        return Path(f"{self.results_path}/results_{self.min_catalog_id}-{self.max_catalog_id}")
+
+    @cached_property
+    def sweep_file(self) -> str:
+        return f"{self.results_path}/sweep_{self.min_catalog_id}-{self.max_catalog_id}.csv"
+
+    @cached_property
+    def plot_manifest_file(self) -> str:
+        return f"{self.results_path}/dso_plots.json"
+
+
+class StellariumCatalog(NamedTuple):
+    headers: list[str]  # Header lines of the text catalog
+    rows: np.ndarray  # Structured array, one row per DSO (see catalog.catalog_dtype)
+
+
+class EffectiveHorizon(NamedTuple):
+    data: np.ndarray  # Horizon points (azimuth, altitude) as read from the horizon file
+    altitudes: np.ndarray  # max(min_obs_altitude, horizon altitude), tabulated every `resolution` deg of azimuth
+    resolution: float
+    max_error: float  # Maximum error of a table lookup against exact interpolation of the horizon points (deg)
+
+
+class ResultCache(NamedTuple):
+    path: Path
+    run_key: str  # Hash of everything, besides the object's coordinates, that affects a simulated time series
+
+
+class NightEphemeris(NamedTuple):
+    dusk: np.ndarray  # Start of darkness, per night (hours from the Spring Equinox)
+    dawn: np.ndarray  # End of darkness, per night
+    sample_times: np.ndarray  # Dark-time simulation instants of all nights, flattened
+    night_offsets: np.ndarray  # Index of each night's first sample in sample_times
+    night_counts: np.ndarray  # Number of samples in each night
+    night_dates: np.ndarray  # Date of each night (of its evening), as datetime64[D]
+
 
 class SimJobArgs(NamedTuple):
     catalog_id: int
@@ -75,8 +144,56 @@ class SimJobArgs(NamedTuple):
     object_ra_radians: float
     object_dec_radians: float
     object_size: float
-    horizon_data: np.ndarray
+    horizon: EffectiveHorizon
+    night_ephemeris: NightEphemeris
+    user: UserSettings
+
+
+class RunContext(NamedTuple):
+    # Read-only state of a site's run
     user: UserSettings
+    horizon: EffectiveHorizon | None = None
+    night_ephemeris: NightEphemeris | None = None
+    result_cache: ResultCache | None = None
+
+
+class PoolContext(NamedTuple):
+    # Read-only state of all the sites of a run, published once to each pool worker (see shared.init_worker)
+    sites: tuple[RunContext, ...]
+
+
+class SimBlockArgs(NamedTuple):
+    catalog_ids: np.ndarray
+    catalog_names: list[str]
+    is_galaxy: np.ndarray
+    object_ra_radians: np.ndarray
+    object_dec_radians: np.ndarray
+    object_size: np.ndarray
+    # Sites (indexes in PoolContext.sites, all at the same location) the block is simulated for, and which of its
+    # objects each of them needs: shape (len(sites), number of objects)
+    sites: tuple[int, ...]
+    site_masks: np.ndarray
+
+
+class SiteSimulation(NamedTuple):
+    # A site's share of a run, as prepared by the main process
+    run_context: RunContext
+    catalog_headers: list[str]  # Header lines of the text catalog
+    catalog_rows: np.ndarray  # All the rows of the catalog
+    dso_rows: np.ndarray  # Catalog rows of the DSOs that pass the prefilters
+    cached_results: list["SimResult"]  # Read back from the result cache
+    sim_index: np.ndarray  # Sorted indexes, in catalog_rows, of the DSOs to simulate
+    num_culled: int = 0  # DSOs that pass the prefilters, but can never be included (not simulated)
+    culling_time: float = 0.0  # Seconds
+
+
+class SimGroup(NamedTuple):
+    # Sites at the same location (using the same catalog and engine) are simulated together
+    sites: tuple[int, ...]
+    rows: np.ndarray  # Catalog rows of the DSOs any of the sites needs simulated
+    catalog_names: list[str]
+    site_masks: np.ndarray  # Which rows each site needs simulated: shape (len(sites), len(rows))
+    block_size: int
 
 
 class SimResult(NamedTuple):
@@ -88,8 +205,11 @@ class SimResult(NamedTuple):
     dec_degrees: float | None = None
     size: float | None = None
     max_score: float | None = None
-    max_month: int | None = None
-    max_day: int | None = None
+    max_date: np.datetime64 | None = None
+    peak_altitude: float | None = None  # Highest altitude of any night (deg), whether included or not
+    peak_hours: float | None = None  # Most hours visible in a night, whether included or not
+    # One row per night (included DSOs only): date (days since 1970-01-01), min altitude, max altitude, hours visible,
+    # score
     time_series: np.ndarray | None = None
 
     @property
@@ -102,18 +222,79 @@ class SimResult(NamedTuple):
             int(self.is_galaxy),
             round(self.size, 2),
             round(self.max_score, 2),
-            self.max_month,
-            self.max_day,
+            str(self.max_date),
         )
 
     @classmethod
     def csv_row_headers(cls):
-        return "No.", "Name", "RA (deg)", "DEC (deg)", "Type", "Size", "Score", "Month", "Day"
+        return "No.", "Name", "RA (deg)", "DEC (deg)", "Type", "Size", "Score", "Date"
+
+
+class ResultStore(NamedTuple):
+    # Included DSOs of a run, as stored in the results folder (see results.open_store): memory-mapped, read-only
+    index: np.ndarray  # Structured array, one row per DSO (see results.store_index_dtype)
+    time_series: np.ndarray  # float32, shape (DSOs, nights, 5): as SimResult.time_series
+    physics: np.ndarray  # Unfiltered physics of every simulated DSO, included or not (see results.physics_dtype)
+    meta: dict  # Layout of the store, and the settings of the run that wrote it
+
+
+class Plan(NamedTuple):
+    # Results of api.plan, as plain arrays
+    dsos: np.ndarray  # Structured array, one row per included DSO, best score first (see results.store_index_dtype)
+    time_series: np.ndarray  # Shape (DSOs, nights, 5), in the order of dsos: as SimResult.time_series
+    # Unfiltered physics of every simulated (not culled) DSO, included or not (see results.physics_dtype)
+    physics: np.ndarray
+    night_dates: np.ndarray  # Date of each night (of its evening), as datetime64[D]
+
+
+class ResultColumns(NamedTuple):
+    # Included DSOs (as in the DSO list file), one array per column
+    catalog_ids: np.ndarray
+    is_galaxy: np.ndarray
+    ra_degrees: np.ndarray
+    dec_degrees: np.ndarray
+    size: np.ndarray
+    max_score: np.ndarray
+    max_date: np.ndarray  # datetime64[D]
+
+
+class TonightTarget(NamedTuple):
+    # A DSO worth imaging in the next few nights, on its best night
+    catalog_id: int
+    catalog_name: str
+    is_galaxy: bool
+    night_date: np.datetime64  # Evening of the best night
+    visible_from: datetime  # First and last visible instants of that night, in the local time zone
+    visible_to: datetime
+    max_altitude: float
+    hours_visible: float
+    score: float
+
+
+class SweepRow(NamedTuple):
+    # Outcome of one combination of filter values, from the unfiltered physics of a run (see sweep.py)
+    min_obs_hours: float
+    min_obs_peak_altitude: float
+    min_dso_size: float
+    num_included: int
+    num_galaxies: int
+    is_exact: bool  # False when looser than the filters of the run: the DSOs they ruled out were never simulated
+    top_names: tuple[str, ...]  # Best scoring included DSOs, best first
 
 
 class DSOPlotArgs(NamedTuple):
     catalog_name: str
-    max_score_month: int
-    max_score_day: int
+    max_score_date: np.datetime64
     time_series: np.ndarray
-    user: UserSettings
+    site: int = 0  # Index of the site in PoolContext.sites
+
+
+class DSOPlotTemplate(NamedTuple):
+    # DSO plot figure, built once per worker: only the lines, the legend and the title change from one DSO to the next
+    canvas: "FigureCanvasAgg"
+    background: "BufferRegion"  # Rendering of everything that does not change
+    axes: tuple["Axes", ...]  # In drawing order
+    hours_line: "Line2D"
+    max_altitude_line: "Line2D"
+    min_altitude_line: "Line2D"
+    title: "Text"
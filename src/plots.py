@@ -1,50 +1,43 @@
 """Function to generate various Plots"""
 
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.dates import AutoDateLocator, ConciseDateFormatter
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
+from matplotlib.image import imsave
 from matplotlib.ticker import MultipleLocator
 
-from src.models import DSOPlotArgs, UserSettings
-
-
-def make_dso_timeseries(user: UserSettings):
-    with open(user.dso_list_file, "r") as f:
-        # skip header row
-        next(f)
-
-        num_galaxies = 0
-        num_nebulas = 0
-        for line in f:
-            stellarium_row_data = line.split(",")
-            arr = np.array(stellarium_row_data).reshape(1, 9)
-            if arr[0, 4] == "1":
-                if num_galaxies == 0:
-                    galaxy = arr
-                else:
-                    galaxy = np.vstack((galaxy, arr))
-                num_galaxies += 1
-            else:
-                if num_nebulas == 0:
-                    nebula = arr
-                else:
-                    nebula = np.vstack((nebula, arr))
-                num_nebulas += 1
-        ts_galaxies = np.zeros(shape=(num_galaxies, 5))
-        for i in range(num_galaxies):
-            ts_galaxies[i, 0] = float(galaxy[i, 7]) + float(galaxy[i, 8]) / 32.0  # Month/day
-            ts_galaxies[i, 1] = float(galaxy[i, 6])  # Score
-            ts_galaxies[i, 2] = float(galaxy[i, 2])  # RA
-            ts_galaxies[i, 3] = float(galaxy[i, 3])  # DEC
-            ts_galaxies[i, 4] = float(galaxy[i, 5])  # size
-        ts_nebulas = np.zeros(shape=(num_nebulas, 5))
-        for i in range(num_nebulas):
-            ts_nebulas[i, 0] = float(nebula[i, 7]) + float(nebula[i, 8]) / 32.0  # Month/day
-            ts_nebulas[i, 1] = float(nebula[i, 6])  # Score
-            ts_nebulas[i, 2] = float(nebula[i, 2])  # RA
-            ts_nebulas[i, 3] = float(nebula[i, 3])  # DEC
-            ts_nebulas[i, 4] = float(nebula[i, 5])  # size
-
-        return num_galaxies, num_nebulas, ts_galaxies, ts_nebulas
+from src import catalog, constants, progress, shared
+from src.models import DSOPlotArgs, DSOPlotTemplate, ResultColumns, UserSettings
+
+matplotlib.use(constants.plot_backend)
+
+_dso_plot_templates = {}  # Built by the first DSO plot of each worker, for each simulation window
+_plots_code_hash = hashlib.sha256(Path(__file__).read_bytes()).hexdigest()  # A new look means new plots
+
+
+def make_dso_timeseries(result_columns: ResultColumns):
+    dso_timeseries = np.column_stack(
+        (
+            result_columns.max_date.astype(np.int64),  # Date, as days since 1970-01-01
+            result_columns.max_score,
+            result_columns.ra_degrees,
+            result_columns.dec_degrees,
+            result_columns.size,
+        )
+    ).reshape(-1, 5)
+    ts_galaxies = dso_timeseries[result_columns.is_galaxy]
+    ts_nebulas = dso_timeseries[~result_columns.is_galaxy]
+
+    return len(ts_galaxies), len(ts_nebulas), ts_galaxies, ts_nebulas
 
 
 def plot_visible_dsos(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, user: UserSettings):
@@ -69,16 +62,14 @@ def plot_visible_dsos(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, user:
         linestyle="",
         label="Nebula (" + str(num_nebulas) + ")",
     )
-    plt.xlim([1, 12.9])
-    plt.xticks(np.arange(1, 13, 1))
+    set_date_axis(axes, user.night_dates[0].astype(np.int64), len(user.night_dates))
     plt.ylim([0.0, 1.25])
     plt.yticks(np.arange(0, 1.50, 0.25))
-    axes.xaxis.set_minor_locator(MultipleLocator(0.25))
     axes.yaxis.set_minor_locator(MultipleLocator(0.05))
     plt.grid(visible=None, which="major", axis="both", linestyle=":", linewidth=1)
     plt.legend(loc="best", shadow=True, ncol=1, frameon=True)
     plt.title("Visible Targets", fontsize=16)
-    plt.xlabel("Month", fontsize=12)
+    plt.xlabel("Date", fontsize=12)
     plt.ylabel("Imaging Score", fontsize=12)
     plt.savefig(out_file, format="png")
     plt.close()
@@ -193,50 +184,118 @@ def plot_score_vs_size_map(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, u
     plt.close()
 
 
-def generate_global_plots(user: UserSettings):
-    num_galaxies, num_nebulas, ts_galaxies, ts_nebulas = make_dso_timeseries(user)
+def generate_global_plots(result_columns: ResultColumns, user: UserSettings):
+    num_galaxies, num_nebulas, ts_galaxies, ts_nebulas = make_dso_timeseries(result_columns)
     plot_visible_dsos(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, user)
     plot_visible_dec_ra_map(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, user)
     plot_visible_score_dec_map(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, user)
     plot_score_vs_size_map(num_galaxies, num_nebulas, ts_galaxies, ts_nebulas, user)
 
 
+def set_date_axis(axes, first_night, num_nights):
+    # Calendar dates of a simulation window along the x axis. Dates are matplotlib date numbers: days since 1970-01-01
+    axes.set_xlim([first_night, first_night + num_nights])
+    locator = AutoDateLocator()
+    axes.xaxis.set_major_locator(locator)
+    axes.xaxis.set_major_formatter(ConciseDateFormatter(locator))
+
+
 def plot_dso(args: DSOPlotArgs):
-    catalog_name = args.catalog_name
-    max_score_month = args.max_score_month
-    max_score_day = args.max_score_day
-    time_series = args.time_series
-    user = args.user
-    out_file = f"{user.results_path}/{catalog_name}.png"
-    print(f"\t\t\t- {catalog_name}")
+    user = shared.worker_context().sites[args.site].user
+    render_dso_plot(dso_plot_template(args.time_series), args, dso_plot_file(args.catalog_name, user))
+    progress.advance("plot", 1, names=(args.catalog_name,))
+
+
+def dso_plot_template(time_series) -> DSOPlotTemplate:
+    # Template for the simulation window of this time series (its first night and number of nights)
+    window = (int(time_series[0, 0]), len(time_series))
+    if window not in _dso_plot_templates:
+        _dso_plot_templates[window] = make_dso_plot_template(*window)
+    return _dso_plot_templates[window]
 
-    plt.figure(figsize=(8, 8), facecolor=(1.0, 0.8, 0.2))
-    ax2 = plt.subplot2grid((3, 1), (1, 0), rowspan=2)
+
+def make_dso_plot_template(first_night, num_nights) -> DSOPlotTemplate:
+    # Everything but the data: figure, axes, ticks, grids, labels and (empty) lines. The figure is not managed by
+    # pyplot, so that it is never closed by the other plots
+    figure = Figure(figsize=(8, 8), facecolor=(1.0, 0.8, 0.2))
+    canvas = FigureCanvasAgg(figure)
+    grid = GridSpec(3, 1, figure=figure)
+    ax2 = figure.add_subplot(grid[1:3, 0])
     ax2.set_autoscale_on(False)
-    plt.xlabel("Month", fontsize=12)
-    plt.ylim([0, 14])
-    plt.yticks(np.arange(0, 16, 2))
+    ax2.set_xlabel("Date", fontsize=12)
+    ax2.set_ylim([0, 14])
+    ax2.set_yticks(np.arange(0, 16, 2))
     ax2.yaxis.set_minor_locator(MultipleLocator(0.5))
-    plt.ylabel("Hours Visible", fontsize=12)
-    plt.grid(visible=True, which="major", axis="both", linestyle=":", linewidth=1)
-    ax1 = plt.subplot2grid((3, 1), (0, 0), sharex=ax2)
+    ax2.set_ylabel("Hours Visible", fontsize=12)
+    ax2.grid(visible=True, which="major", axis="both", linestyle=":", linewidth=1)
+    ax1 = figure.add_subplot(grid[0:1, 0], sharex=ax2)
     ax1.set_autoscale_on(False)
-    plt.ylim([0, 90])
-    plt.yticks(np.arange(0, 100, 10))
-    plt.ylabel("Altitude (deg)", fontsize=12)
-    plt.xlim([1, 12.9])
-    plt.xticks(np.arange(1, 13, 1))
-    ax2.plot(time_series[:, 0], time_series[:, 3], "b", linewidth=2, label="Hours")
-    ax1.xaxis.set_minor_locator(MultipleLocator(0.25))
+    ax1.set_ylim([0, 90])
+    ax1.set_yticks(np.arange(0, 100, 10))
+    ax1.set_ylabel("Altitude (deg)", fontsize=12)
+    set_date_axis(ax1, first_night, num_nights)
+    (hours_line,) = ax2.plot([], [], "b", linewidth=2, label="Hours")
     ax1.yaxis.set_minor_locator(MultipleLocator(5))
-    plt.grid(visible=True, which="major", axis="both", linestyle=":", linewidth=1)
-    plt.plot(time_series[:, 0], time_series[:, 2], "r", linewidth=1, label="Max Alt")
-    plt.plot(time_series[:, 0], time_series[:, 1], "g", linewidth=1, label="Min Alt")
-    plt.legend(loc="best", shadow=True, ncol=1, frameon=True)
+    ax1.grid(visible=True, which="major", axis="both", linestyle=":", linewidth=1)
+    (max_altitude_line,) = ax1.plot([], [], "r", linewidth=1, label="Max Alt")
+    (min_altitude_line,) = ax1.plot([], [], "g", linewidth=1, label="Min Alt")
+    # The "best" legend location is worked out when the figure is drawn, so it still follows each DSO's data
+    ax1.legend(loc="best", shadow=True, ncol=1, frameon=True)
+    title = ax1.set_title("", fontsize=16)
+
+    # Render the figure once without what changes from one DSO to the next (and what is drawn on top of it: spines),
+    # and keep that as the background of every DSO plot
+    for artist in (hours_line, max_altitude_line, min_altitude_line, ax1.get_legend(), title):
+        artist.set_animated(True)
+    for spine in (*ax1.spines.values(), *ax2.spines.values()):
+        spine.set_animated(True)
+    canvas.draw()
+    background = canvas.copy_from_bbox(figure.bbox)
+
+    return DSOPlotTemplate(canvas, background, (ax2, ax1), hours_line, max_altitude_line, min_altitude_line, title)
+
+
+def render_dso_plot(template: DSOPlotTemplate, args: DSOPlotArgs, out_file):
+    time_series = args.time_series
+    template.hours_line.set_data(time_series[:, 0], time_series[:, 3])
+    template.max_altitude_line.set_data(time_series[:, 0], time_series[:, 2])
+    template.min_altitude_line.set_data(time_series[:, 0], time_series[:, 1])
 
     max_score = round(max(time_series[:, 4]), 2)
-    plot_title = f"{catalog_name}: Score = {max_score} on {int(max_score_month)}/{int(max_score_day)}"
-    plt.title(plot_title, fontsize=16)
+    template.title.set_text(f"{args.catalog_name}: Score = {max_score} on {args.max_score_date}")
 
-    plt.savefig(out_file, format="png")
-    plt.close()
+    # Same drawing order as a full draw of the figure: axes by axes, and by z-order within each axes
+    canvas = template.canvas
+    canvas.restore_region(template.background)
+    for axes in template.axes:
+        for artist in sorted((a for a in axes.get_children() if a.get_animated()), key=lambda a: a.get_zorder()):
+            axes.draw_artist(artist)
+    imsave(out_file, canvas.buffer_rgba(), format="png", origin="upper", dpi=canvas.figure.dpi)
+
+
+def dso_plot_file(catalog_name: str, user: UserSettings) -> Path:
+    return Path(user.results_path) / f"{catalog_name}.png"
+
+
+def dso_plot_key(args: DSOPlotArgs) -> str:
+    # Content address of a DSO plot: two plots with the same key are identical
+    plot_hash = hashlib.sha256(_plots_code_hash.encode())
+    plot_hash.update(repr((args.catalog_name, str(args.max_score_date))).encode())
+    # As stored in the result store, so that a plot regenerated from the store has the same key
+    plot_hash.update(np.ascontiguousarray(args.time_series, dtype=np.float32).tobytes())
+    return plot_hash.hexdigest()
+
+
+def load_plot_manifest(user: UserSettings) -> dict[str, str]:
+    # Key of each DSO plot in the results folder, by catalog name
+    try:
+        with open(user.plot_manifest_file, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_plot_manifest(manifest: dict[str, str], user: UserSettings):
+    # Only lists plots that are still there
+    manifest = {name: key for name, key in manifest.items() if os.path.exists(dso_plot_file(name, user))}
+    catalog.write_atomically(Path(user.plot_manifest_file), json.dumps(manifest, indent=1, sort_keys=True).encode())
@@ -0,0 +1,123 @@
+"""Progress of the pool jobs: workers send compact events to the parent through a queue, and the parent renders a
+single, throttled progress line (optionally also logging the name of every object to a file)"""
+
+import multiprocessing
+import sys
+import threading
+from time import perf_counter, sleep
+
+from src import constants
+
+_quiet = False  # No progress line (set by configure)
+_log_file = None  # Verbose log of the objects done, by name (set by configure)
+_queue = None  # Queue the events of this (worker) process go to (see init_worker)
+_with_names = False  # Whether the events of this (worker) process carry the names of their objects
+
+
+def configure(quiet: bool = False, log_file=None):
+    global _quiet, _log_file
+    _quiet, _log_file = quiet, log_file
+
+
+def init_worker(event_queue, with_names: bool):
+    # Pool initializer (see main.init_worker)
+    global _queue, _with_names
+    _queue, _with_names = event_queue, with_names
+
+
+def advance(kind: str, count: int, num_included: int = 0, names=()):
+    # Reports count more objects of a kind ("simulate", "plot") done by this worker, of which num_included were
+    # included. Outside of a pool, nothing is reported
+    if _queue is not None and count:
+        _queue.put((kind, count, num_included, list(names) if _with_names else None))
+
+
+class ProgressMonitor:
+    # Parent side of the events: a background thread drains them, and renders the progress of the current phase
+    # (see begin and end). Lives as long as the pool
+    def __init__(self):
+        self.queue = multiprocessing.Queue()
+        self.with_names = _log_file is not None
+        self._log = None
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._lock = threading.Lock()
+        self._is_tty = sys.stdout.isatty()
+        self._phase = None
+
+    def __enter__(self):
+        if _log_file is not None:
+            self._log = open(_log_file, "w")
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.queue.put(None)
+        self._thread.join()
+        self.queue.close()
+        if self._log is not None:
+            self._log.close()
+
+    def begin(self, kind: str, label: str, total: int, unit: str):
+        # Progress line of the next phase: "<label> <done> of <total> <unit>..."
+        start_time = perf_counter()
+        with self._lock:
+            self._phase = {
+                "kind": kind,
+                "label": label,
+                "total": total,
+                "unit": unit,
+                "done": 0,
+                "included": 0,
+                "start_time": start_time,
+                "render_time": start_time,
+            }
+
+    def end(self):
+        # Events may still be on their way, after the results of their jobs: wait for them for a short while
+        wait_start = perf_counter()
+        while perf_counter() - wait_start < constants.progress_end_wait_seconds:
+            with self._lock:
+                if self._phase["done"] >= self._phase["total"]:
+                    break
+            sleep(0.01)
+        with self._lock:
+            self._render(is_final=True)
+            self._phase = None
+
+    def advance(self, kind: str, count: int, num_included: int = 0, names=None):
+        with self._lock:
+            if self._log is not None and names:
+                self._log.writelines(f"{kind}: {name}\n" for name in names)
+            if self._phase is None or self._phase["kind"] != kind:
+                return
+            self._phase["done"] += count
+            self._phase["included"] += num_included
+            throttle = constants.progress_tty_seconds if self._is_tty else constants.progress_log_seconds
+            if perf_counter() - self._phase["render_time"] >= throttle:
+                self._render(is_final=False)
+
+    def _drain(self):
+        for event in iter(self.queue.get, None):
+            self.advance(*event)
+
+    def _render(self, is_final: bool):
+        phase = self._phase
+        phase["render_time"] = perf_counter()
+        if _quiet:
+            return
+        elapsed_time = max(phase["render_time"] - phase["start_time"], 1e-9)
+        rate = phase["done"] / elapsed_time
+        line = f"{phase['label']} {phase['done']} of {phase['total']} {phase['unit']}"
+        if phase["kind"] == "simulate":
+            line += f" ({phase['included']} included)"
+        if is_final:
+            line += f" in {elapsed_time:.2f} s ({rate:.1f} {phase['unit']}/s)"
+        else:
+            eta = (phase["total"] - phase["done"]) / rate if rate > 0 else float("inf")
+            line += f", {rate:.1f} {phase['unit']}/s, ETA {eta:.0f} s"
+        if self._is_tty:
+            # Rewritten in place: pads over the end of a longer previous line
+            sys.stdout.write(f"\r{line:<100}" + ("\n" if is_final else ""))
+            sys.stdout.flush()
+        else:
+            print(line, flush=True)
@@ -0,0 +1,212 @@
+"""Results of the included DSOs: in memory as columns, and as stored in the results folder for later plots"""
+
+import csv
+import hashlib
+import io
+import json
+
+import numpy as np
+
+from src import cache, catalog
+from src.models import ResultColumns, ResultStore, SimResult, UserSettings
+
+# Layout of the index of a result store: one row per included DSO. The format changes with the layout
+store_index_dtype = np.dtype(
+    [
+        ("id", "i8"),
+        ("name", "U24"),
+        ("ra", "f8"),  # deg
+        ("dec", "f8"),  # deg
+        ("type", "U16"),  # Stellarium type
+        ("galaxy", "?"),
+        ("size", "f8"),  # arc-min
+        ("score", "f8"),  # Best score
+        ("date", "datetime64[D]"),  # First night of the best score
+    ]
+)
+# Layout of the unfiltered physics of a result store: one row per simulated DSO, whether included or not
+physics_dtype = np.dtype(
+    [
+        ("id", "i8"),
+        ("name", "U24"),
+        ("galaxy", "?"),
+        ("size", "f8"),  # arc-min
+        ("peak_altitude", "f8"),  # Highest altitude of any night (deg)
+        ("peak_hours", "f8"),  # Most hours visible in a night
+        ("score", "f8"),  # Best score
+        ("date", "datetime64[D]"),  # First night of the best score
+    ]
+)
+store_format = hashlib.sha256(repr((store_index_dtype.descr, physics_dtype.descr)).encode()).hexdigest()
+
+
+class ResultStoreWriter:
+    # Appends the included DSOs of a run to its result store, as they come in: their index rows to index.bin, and
+    # their time series (as float32) to time_series.f32. The unfiltered physics of all the simulated DSOs go to
+    # physics.npy. The store is only complete, and can only be opened, once the writer is closed without error:
+    # meta.json, which describes the layout of the files and the settings of the run, is written last
+    def __init__(self, user: UserSettings):
+        self.user = user
+        self.path = user.results_store_path
+        self.num_nights = len(user.night_dates)
+        self.count = 0
+        self._physics = []
+        self._f_index = None
+        self._f_time_series = None
+
+    def __enter__(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        (self.path / "meta.json").unlink(missing_ok=True)
+        self._f_index = open(self.path / "index.bin", "wb")
+        self._f_time_series = open(self.path / "time_series.f32", "wb")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._f_index.close()
+        self._f_time_series.close()
+        if exc_type is not None:
+            return
+        physics_data = io.BytesIO()
+        np.save(physics_data, np.array(self._physics, dtype=physics_dtype))
+        catalog.write_atomically(self.path / "physics.npy", physics_data.getvalue())
+
+        user = self.user
+        meta = {
+            "format": store_format,
+            "count": self.count,
+            "nights": self.num_nights,
+            "index": {"file": "index.bin", "dtype": [[name, dtype] for name, dtype in store_index_dtype.descr]},
+            "time_series": {
+                "file": "time_series.f32",
+                "dtype": "<f4",
+                "shape": [self.count, self.num_nights, 5],
+                "columns": ["date", "min_altitude", "max_altitude", "hours_visible", "score"],
+            },
+            "physics": {"file": "physics.npy", "count": len(self._physics)},
+            # The physics only hold for the same run key (see cache.calc_run_key). The filters set what was simulated
+            "run_key": cache.calc_run_key(user),
+            "filters": {
+                "min_obs_hours": user.min_obs_hours,
+                "min_obs_peak_altitude": user.min_obs_peak_altitude,
+                "min_dso_size": user.min_dso_size,
+            },
+        }
+        catalog.write_atomically(self.path / "meta.json", json.dumps(meta, indent=1).encode())
+
+    def append(self, result: SimResult, dso_type: str):
+        # Any simulated DSO: only included ones are indexed, with their time series
+        self._physics.append(physics_row(result))
+        if not result.is_included:
+            return
+        self._f_index.write(np.array([index_row(result, dso_type)], dtype=store_index_dtype).tobytes())
+        self._f_time_series.write(np.ascontiguousarray(result.time_series, dtype="<f4").tobytes())
+        self.count += 1
+
+
+def index_row(result: SimResult, dso_type: str) -> tuple:
+    # Row of an included DSO (see store_index_dtype)
+    return (
+        result.catalog_id,
+        result.catalog_name,
+        result.ra_degrees,
+        result.dec_degrees,
+        dso_type,
+        result.is_galaxy,
+        result.size,
+        result.max_score,
+        result.max_date,
+    )
+
+
+def physics_row(result: SimResult) -> tuple:
+    # Row of any simulated DSO (see physics_dtype)
+    return (
+        result.catalog_id,
+        result.catalog_name,
+        result.is_galaxy,
+        result.size,
+        result.peak_altitude,
+        result.peak_hours,
+        result.max_score,
+        result.max_date,
+    )
+
+
+def open_store(user: UserSettings) -> ResultStore | None:
+    # Result store of the last run, memory-mapped: nothing is read until used. None when there is no complete store
+    try:
+        meta = json.loads((user.results_store_path / "meta.json").read_text())
+    except (OSError, ValueError):
+        return None
+    if meta.get("format") != store_format:
+        return None
+
+    count, num_nights = meta["count"], meta["nights"]
+    physics = np.load(user.results_store_path / "physics.npy")
+    if count == 0:  # Empty files cannot be mapped
+        return ResultStore(
+            np.zeros(0, dtype=store_index_dtype), np.zeros((0, num_nights, 5), dtype="<f4"), physics, meta
+        )
+    return ResultStore(
+        index=np.memmap(user.results_store_path / "index.bin", dtype=store_index_dtype, mode="r", shape=(count,)),
+        time_series=np.memmap(
+            user.results_store_path / "time_series.f32", dtype="<f4", mode="r", shape=(count, num_nights, 5)
+        ),
+        physics=physics,
+        meta=meta,
+    )
+
+
+def load_results(user: UserSettings) -> list[SimResult] | None:
+    # Included DSOs of the last run, from its result store (time series are memory-mapped). None when there is none
+    store = open_store(user)
+    if store is None:
+        return None
+    return [
+        SimResult(
+            is_included=True,
+            catalog_id=int(row["id"]),
+            catalog_name=str(row["name"]),
+            is_galaxy=bool(row["galaxy"]),
+            ra_degrees=float(row["ra"]),
+            dec_degrees=float(row["dec"]),
+            size=float(row["size"]),
+            max_score=float(row["score"]),
+            max_date=row["date"],
+            time_series=time_series,
+        )
+        for row, time_series in zip(store.index, store.time_series)
+    ]
+
+
+def load_time_series(user: UserSettings) -> dict[str, np.ndarray]:
+    # Time series of the included DSOs of the last run, by catalog name (empty if there was no run)
+    store = open_store(user)
+    if store is None:
+        return {}
+    return dict(zip(store.index["name"].tolist(), store.time_series))
+
+
+def write_dso_list(dso_results: list[SimResult], user: UserSettings):
+    # DSO list file, as a run writes it
+    with open(user.dso_list_file, "w") as f_dso_list:
+        csv_writer = csv.writer(f_dso_list)
+        csv_writer.writerow(SimResult.csv_row_headers())
+        csv_writer.writerows(result.csv_row for result in dso_results)
+
+
+def make_columns(dso_results: list[SimResult]) -> ResultColumns:
+    return ResultColumns(
+        catalog_ids=np.array([r.catalog_id for r in dso_results], dtype=np.int64),
+        is_galaxy=np.array([r.is_galaxy for r in dso_results], dtype=bool),
+        ra_degrees=np.array([r.ra_degrees for r in dso_results], dtype=float),
+        dec_degrees=np.array([r.dec_degrees for r in dso_results], dtype=float),
+        size=np.array([r.size for r in dso_results], dtype=float),
+        max_score=np.array([r.max_score for r in dso_results], dtype=float),
+        max_date=np.array([r.max_date for r in dso_results], dtype="datetime64[D]"),
+    )
+
+
+def normalize_name(name: str) -> str:
+    # Lets users write "M 31", "m31" or "M_31"
+    return name.strip().upper().replace(" ", "").replace("_", "")
@@ -0,0 +1,490 @@
+"""Planning server: answers "best this month" and "tonight" queries for any observer, as JSON over HTTP on localhost.
+The catalog is loaded once, and a pool of workers lives as long as the server: each query only pays for its
+simulations. Plans and sun timelines are kept in bounded LRU caches, and concurrent queries for the same plan share a
+single computation. The results of each site and window are kept unfiltered, so that a query with other filters only
+simulates the objects no earlier query did
+
+    GET  /health
+    GET  /month?lat=33.4&lon=-111.8[&start=2025-03-01&days=31&top=20&min_obs_hours=5...]
+    GET  /tonight?lat=33.4&lon=-111.8[&nights=1&start=2025-03-01&top=20...]
+    POST /month or /tonight, with the same parameters as a JSON object, and optionally "horizon": [[az, alt], ...]
+"""
+
+import asyncio
+import calendar
+import dataclasses
+import hashlib
+import json
+import multiprocessing
+import signal
+import urllib.parse
+from collections import OrderedDict
+from datetime import date
+from time import perf_counter
+
+import numpy as np
+
+from src import api, catalog, constants, culling, ephemeris, horizon, results, simulator
+from src.models import NightEphemeris, Plan, RunContext, UserSettings
+
+_rows = None  # Catalog rows of this worker (see init_worker)
+
+# Query parameters that override the settings of the ini file, and their types
+setting_parameters = {
+    "min_obs_hours": float,
+    "min_obs_peak_altitude": float,
+    "min_obs_altitude": float,
+    "min_dso_size": float,
+    "simulation_engine": str,
+}
+# Settings that, with the location, horizon and dates, make a plan
+plan_settings = (
+    "observer_latitude",
+    "observer_longitude",
+    "min_obs_altitude",
+    "min_obs_hours",
+    "min_obs_peak_altitude",
+    "min_dso_size",
+    "simulation_engine",
+    "horizon_resolution",
+    "min_catalog_id",
+    "max_catalog_id",
+)
+# Settings that, with the horizon and dates, make the unfiltered results of a site (as in cache.calc_run_key)
+sky_settings = (
+    "observer_latitude",
+    "observer_longitude",
+    "min_obs_altitude",
+    "horizon_resolution",
+    "simulation_engine",
+)
+
+
+http_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error"}
+
+
+class QueryError(ValueError):
+    # Invalid query: answered with a 400
+    pass
+
+
+class NotFoundError(LookupError):
+    # Unknown path or method: answered with a 404
+    pass
+
+
+class LRUCache:
+    # At most max_entries values, the least recently used going first
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+def init_worker(catalog_file: str):
+    # Pool initializer: each worker maps the binary catalog the server made at startup. Ctrl-C only stops the server,
+    # which then terminates its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    global _rows
+    _rows = catalog.read(catalog_file).rows
+
+
+def cull_rows(args) -> np.ndarray:
+    # Pool job: mask of the catalog rows of a slice that can never pass the observation filters (see culling.py)
+    user, horizon_data, start, stop = args
+    return culling.find_never_visible(_rows[start:stop], make_effective_horizon(user, horizon_data), user)
+
+
+def simulate_rows(args):
+    # Pool job: unfiltered results of some catalog rows, included or not (see SkyResults)
+    user, horizon_data, night_ephemeris, row_index = args
+    context = RunContext(user, make_effective_horizon(user, horizon_data), night_ephemeris)
+    dsos, physics, time_series = [], [], []
+    block_size = simulator.calc_in_process_block_size(len(night_ephemeris.sample_times), user)
+    for start in range(0, len(row_index), block_size):
+        rows = _rows[row_index[start : start + block_size]]
+        block = simulator.make_sim_block(rows, catalog.catalog_names(rows))
+        block_time_series = simulator.calc_block_time_series(block, context)
+        for job, job_time_series, dso_type in zip(
+            simulator.block_jobs(block, context), block_time_series, rows["type"]
+        ):
+            result = simulator.make_result(job, job_time_series)
+            dsos.append(results.index_row(result, str(dso_type)))
+            physics.append(results.physics_row(result))
+        time_series.append(block_time_series)
+    return (
+        row_index,
+        np.array(dsos, dtype=results.store_index_dtype),
+        np.array(physics, dtype=results.physics_dtype),
+        np.concatenate(time_series),
+    )
+
+
+def find_tonight(args):
+    # Pool job: best targets of the next few nights, for the whole catalog
+    user, nights, start, horizon_data = args
+    return api.best_tonight(user, nights, start, horizon_data, _rows)
+
+
+def make_effective_horizon(user: UserSettings, horizon_data):
+    return horizon.make_effective_horizon(api.open_horizon if horizon_data is None else horizon_data, user)
+
+
+class SkyResults:
+    # Unfiltered results of the catalog objects at a site (location, effective horizon and engine) over a window, as
+    # simulated so far. Each query only simulates the objects it needs that are not in yet, and applies its
+    # observation filters on top of the others
+    def __init__(self, night_ephemeris: NightEphemeris, num_rows: int):
+        self.night_ephemeris = night_ephemeris
+        self.slots = np.full(num_rows, -1)  # Position of each catalog row in the arrays below, -1 until simulated
+        self.dsos = np.zeros(0, dtype=results.store_index_dtype)
+        self.physics = np.zeros(0, dtype=results.physics_dtype)
+        self.time_series = np.zeros((0, len(night_ephemeris.night_dates), 5))
+        self.never_visible = {}  # Mask of the culled catalog rows, by (min_obs_peak_altitude, min_obs_hours)
+
+    def add(self, row_index, dsos, physics, time_series):
+        # Results of a simulate_rows job. The objects a concurrent query simulated meanwhile are kept once
+        is_new = self.slots[row_index] < 0
+        self.slots[row_index[is_new]] = len(self.dsos) + np.arange(is_new.sum())
+        self.dsos = np.concatenate((self.dsos, dsos[is_new]))
+        self.physics = np.concatenate((self.physics, physics[is_new]))
+        self.time_series = np.concatenate((self.time_series, time_series[is_new]))
+
+    def plan(self, row_index, user: UserSettings) -> Plan:
+        # Plan of the (simulated) catalog rows of a query, with its observation filters, as api.plan makes it
+        slots = self.slots[row_index]
+        physics = self.physics[slots]
+        is_included = (physics["peak_altitude"] >= user.min_obs_peak_altitude) & (
+            physics["peak_hours"] >= user.min_obs_hours
+        )
+        dsos = self.dsos[slots[is_included]]
+        order = np.lexsort((dsos["id"], -dsos["score"]))
+        return Plan(
+            dsos=dsos[order],
+            time_series=self.time_series[slots[is_included]][order],
+            physics=physics,
+            night_dates=self.night_ephemeris.night_dates,
+        )
+
+
+class PlanningServer:
+    def __init__(self, user: UserSettings, pool, rows: np.ndarray):
+        self.user = user  # Settings of the ini file: the queries override the location, filters and dates
+        self.pool = pool
+        self.rows = rows  # Catalog rows, as the workers have them (see init_worker)
+        # Unfiltered results, by site and window (see SkyResults): the /month queries filter them
+        self.skies = LRUCache(constants.server_sky_entries)
+        self.targets = LRUCache(constants.server_cache_entries)  # Answers of /tonight, by query
+        self.sun_timelines = LRUCache(constants.server_cache_entries)
+        self.in_flight = {}  # Computations running, by query: the same queries wait for them
+        self.num_coalesced = 0
+        self.num_simulated = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                method, target, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+            except (ValueError, asyncio.IncompleteReadError):
+                return
+
+            status, response = await self.respond(method, target, body)
+            try:
+                content = json.dumps(response).encode()
+            except (TypeError, ValueError) as e:
+                status, content = 500, json.dumps({"error": f"{type(e).__name__}: {e}"}).encode()
+            writer.write(
+                f"HTTP/1.1 {status} {http_reasons[status]}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode() + content
+            )
+            await writer.drain()
+        except ConnectionError:  # The client went away
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method: str, target: str, body: bytes) -> tuple[int, dict]:
+        # Status and JSON response of a query. Only the errors raised for the query itself are answered with a 400
+        # (QueryError) or a 404 (NotFoundError): any other error, of a pool job or of the server, is a 500, and the
+        # server keeps going
+        url = urllib.parse.urlsplit(target)
+        try:
+            return 200, await self.route(method, url.path, read_params(method, url.query, body))
+        except QueryError as e:
+            return 400, {"error": str(e)}
+        except NotFoundError as e:
+            return 404, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def route(self, method: str, path: str, params: dict) -> dict:
+        if method not in ("GET", "POST"):
+            raise NotFoundError(f"Unsupported method: {method}")
+        if path == "/health":
+            return {
+                "status": "ok",
+                "catalog_objects": len(self.rows),
+                "pool_size": self.user.pool_size,
+                "skies": self.skies.stats(),
+                "targets": self.targets.stats(),
+                "sun_timelines": self.sun_timelines.stats(),
+                "in_flight": len(self.in_flight),
+                "coalesced": self.num_coalesced,
+                "simulated": self.num_simulated,
+            }
+        if path == "/month":
+            return await self.best_this_month(params)
+        if path == "/tonight":
+            return await self.best_tonight(params)
+        raise NotFoundError(f"Unknown path: {path}")
+
+    async def best_this_month(self, params: dict) -> dict:
+        # Best DSOs of a month (the current one by default), or of any days from start
+        start = read_param(params, "start", date.fromisoformat, date.today().replace(day=1))
+        days = read_param(params, "days", int, calendar.monthrange(start.year, start.month)[1])
+        user = self.make_user(params, simulation_start=start, simulation_days=days)
+        horizon_data, horizon_hash = read_horizon(params)
+        top = read_param(params, "top", int, constants.server_top_n)
+
+        start_time = perf_counter()
+        key = ("month", horizon_hash, start, days) + tuple(getattr(user, name) for name in plan_settings)
+        plan = await self.coalesced(key, lambda: self.compute_plan(user, horizon_data, horizon_hash))
+        return {
+            "site": site_json(user, horizon_hash),
+            "nights": [str(plan.night_dates[0]), str(plan.night_dates[-1])],
+            "simulated": len(plan.physics),
+            "included": len(plan.dsos),
+            "dsos": [
+                {
+                    "id": int(row["id"]),
+                    "name": str(row["name"]),
+                    "type": str(row["type"]),
+                    "galaxy": bool(row["galaxy"]),
+                    "ra": float(row["ra"]),
+                    "dec": float(row["dec"]),
+                    "size": float(row["size"]),
+                    "score": round(float(row["score"]), 4),
+                    "date": str(row["date"]),
+                }
+                for row in plan.dsos[:top]
+            ],
+            "seconds": round(perf_counter() - start_time, 3),
+        }
+
+    async def best_tonight(self, params: dict) -> dict:
+        start = read_param(params, "start", date.fromisoformat, date.today())
+        nights = read_param(params, "nights", int, 1)
+        if nights < 1:
+            raise QueryError(f"nights must be at least 1: {nights}")
+        user = self.make_user(params)
+        horizon_data, horizon_hash = read_horizon(params)
+        top = read_param(params, "top", int, constants.server_top_n)
+
+        start_time = perf_counter()
+        key = ("tonight", horizon_hash, start, nights) + tuple(getattr(user, name) for name in plan_settings)
+        targets = await self.coalesced(
+            key, lambda: self.run_in_pool(find_tonight, (user, nights, start, horizon_data)), self.targets
+        )
+        return {
+            "site": site_json(user, horizon_hash),
+            "found": len(targets),
+            "targets": [
+                {
+                    "id": target.catalog_id,
+                    "name": target.catalog_name,
+                    "galaxy": target.is_galaxy,
+                    "night": str(target.night_date),
+                    "visible_from": target.visible_from.isoformat(),
+                    "visible_to": target.visible_to.isoformat(),
+                    "max_altitude": round(target.max_altitude, 2),
+                    "hours_visible": round(target.hours_visible, 2),
+                    "score": round(target.score, 4),
+                }
+                for target in targets[:top]
+            ],
+            "seconds": round(perf_counter() - start_time, 3),
+        }
+
+    def make_user(self, params: dict, **changes) -> UserSettings:
+        changes |= {
+            "observer_latitude": read_param(params, "lat", float),
+            "observer_longitude": read_param(params, "lon", float),
+        }
+        changes |= {name: read_param(params, name, kind) for name, kind in setting_parameters.items() if name in params}
+        if changes.get("simulation_engine", self.user.simulation_engine) not in constants.simulation_engines:
+            raise QueryError(f"Unknown simulation engine: {changes['simulation_engine']}")
+        if changes.get("simulation_days", 1) < 1:
+            raise QueryError(f"days must be at least 1: {changes['simulation_days']}")
+        return dataclasses.replace(self.user, **changes)
+
+    async def coalesced(self, key, compute, answers: LRUCache | None = None):
+        # Result of compute(), which only runs once for all the queries waiting for it. With answers, the result is
+        # kept there by key, and the next queries get it from there
+        value = answers.get(key) if answers is not None else None
+        if value is not None:
+            return value
+        if key in self.in_flight:
+            self.num_coalesced += 1
+        else:
+            task = asyncio.ensure_future(compute())
+            self.in_flight[key] = task
+            task.add_done_callback(lambda done: self.finish(key, done, answers))
+        return await asyncio.shield(self.in_flight[key])
+
+    def finish(self, key, task: asyncio.Future, answers: LRUCache | None):
+        del self.in_flight[key]
+        if answers is not None and not task.cancelled() and task.exception() is None:
+            answers.put(key, task.result())
+
+    async def compute_plan(self, user: UserSettings, horizon_data, horizon_hash: str) -> Plan:
+        # Plan of a query, from the unfiltered results of its site and window. As in main.py, the catalog rows are
+        # selected and culled with the filters of the query, and only those not simulated yet are simulated: the
+        # culling (once per filters) and the simulations are split among the workers
+        sky_key = (horizon_hash, str(user.night_dates[0]), user.simulation_days) + tuple(
+            getattr(user, name) for name in sky_settings
+        )
+        sky = self.skies.get(sky_key)
+        if sky is None:
+            sky = SkyResults(await self.night_ephemeris(user), len(self.rows))
+            self.skies.put(sky_key, sky)
+
+        num_jobs = self.user.pool_size * constants.pool_tasks_per_worker
+        filters = (user.min_obs_peak_altitude, user.min_obs_hours)
+        if filters not in sky.never_visible:
+            bounds = np.linspace(0, len(self.rows), num_jobs + 1).astype(int)
+            never_visible = await asyncio.gather(
+                *(
+                    self.run_in_pool(cull_rows, (user, horizon_data, start, stop))
+                    for start, stop in zip(bounds[:-1], bounds[1:])
+                )
+            )
+            sky.never_visible[filters] = np.concatenate(never_visible)
+
+        row_index = np.flatnonzero(catalog.select(self.rows, user) & ~sky.never_visible[filters])
+        missing = row_index[sky.slots[row_index] < 0]
+        if len(missing) > 0:
+            job_results = await asyncio.gather(
+                *(
+                    self.run_in_pool(simulate_rows, (user, horizon_data, sky.night_ephemeris, job_index))
+                    for job_index in np.array_split(missing, min(num_jobs, len(missing)))
+                )
+            )
+            for job_result in job_results:
+                sky.add(*job_result)
+            self.num_simulated += len(missing)
+        return sky.plan(row_index, user)
+
+    async def night_ephemeris(self, user: UserSettings) -> NightEphemeris:
+        # Sun timeline of the location and window of a query, which all its pool jobs use
+        location = (user.observer_latitude, user.observer_longitude, str(user.night_dates[0]), user.simulation_days)
+        night_ephemeris = self.sun_timelines.get(location)
+        if night_ephemeris is None:
+            night_ephemeris = await self.run_in_pool(ephemeris.build, user)
+            self.sun_timelines.put(location, night_ephemeris)
+        return night_ephemeris
+
+    def run_in_pool(self, func, args) -> asyncio.Future:
+        # A pool job, as a future of the event loop
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(result):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(result))
+
+        def set_exception(error):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_exception(error))
+
+        self.pool.apply_async(func, (args,), callback=set_result, error_callback=set_exception)
+        return future
+
+
+def read_params(method: str, query: str, body: bytes) -> dict:
+    # Parameters of a query: those of the URL, and those of the JSON object of a POST
+    params = dict(urllib.parse.parse_qsl(query))
+    if method == "POST" and body:
+        try:
+            body_params = json.loads(body)
+        except ValueError as e:
+            raise QueryError(f"Invalid JSON body: {e}") from None
+        if not isinstance(body_params, dict):
+            raise QueryError("The JSON body must be an object")
+        params |= body_params
+    return params
+
+
+def read_param(params: dict, name: str, kind, default=None):
+    # Query parameter converted by kind, or default when not given (required when there is no default)
+    if name not in params:
+        if default is None:
+            raise QueryError(f"Missing parameter: {name}")
+        return default
+    try:
+        return kind(params[name])
+    except (TypeError, ValueError):
+        raise QueryError(f"Invalid {name}: {params[name]!r}") from None
+
+
+def read_horizon(params: dict):
+    # Horizon points of a query, and their hash (of an open horizon when there are none)
+    horizon_data = params.get("horizon")
+    if horizon_data is None:
+        return None, "open"
+    try:
+        horizon_data = np.asarray(horizon_data, dtype=float).reshape(-1, 2)
+    except (TypeError, ValueError):
+        raise QueryError("Invalid horizon: expected [[azimuth, altitude], ...]") from None
+    if len(horizon_data) == 0:
+        raise QueryError("Invalid horizon: no points")
+    return horizon_data, hashlib.sha256(horizon_data.tobytes()).hexdigest()[:16]
+
+
+def site_json(user: UserSettings, horizon_hash: str) -> dict:
+    return {
+        "lat": user.observer_latitude,
+        "lon": user.observer_longitude,
+        "horizon": horizon_hash,
+        "filters": {name: getattr(user, name) for name in setting_parameters},
+    }
+
+
+def serve(user: UserSettings, port: int = constants.server_port):
+    # Runs until interrupted. The catalog binary is made (or checked) once, then mapped by every worker
+    start_time = perf_counter()
+    rows = catalog.load(user).rows
+    with multiprocessing.Pool(user.pool_size, initializer=init_worker, initargs=(user.catalog_file,)) as pool:
+        server = PlanningServer(user, pool, rows)
+        print(
+            f"\tServing {len(rows)} catalog objects with {user.pool_size} workers on "
+            f"http://{constants.server_host}:{port} (ready in {perf_counter() - start_time:.2f} s). Ctrl-C to stop"
+        )
+        try:
+            asyncio.run(run_server(server, port))
+        except KeyboardInterrupt:
+            print("\tStopped")
+
+
+async def run_server(server: PlanningServer, port: int):
+    async with await asyncio.start_server(server.handle, constants.server_host, port) as http_server:
+        await http_server.serve_forever()
@@ -1,13 +1,19 @@
 """Reads User Settings"""
 
 import configparser
+import csv
+import dataclasses
+import json
+from datetime import date
+from pathlib import Path
 
-from src.constants import default_ini_file
+from src.constants import default_ini_file, simulation_engines
 from src.models import UserSettings
 from src.utils import create_dir, run_root
 
 
-def read_settings(file: str = default_ini_file) -> UserSettings:
+def read_settings(file: str = default_ini_file, prepare_results: bool = True) -> UserSettings:
+    # prepare_results: create (or clear) the results folder, as a simulation run does
     root_path = run_root()
     ini_file = root_path.joinpath(file)
     config = configparser.ConfigParser()
@@ -24,12 +30,35 @@ def read_settings(file: str = default_ini_file) -> UserSettings:
     except ValueError:
         max_catalog_id = None
 
+    try:
+        block_size = int(parallelism.get("BlockSize", ""))
+    except ValueError:
+        block_size = None
+
+    cache_folder = config.get("Cache", "Folder", fallback="").strip()
+
+    try:
+        plot_top_n = int(config.get("Plots", "TopN", fallback=""))
+    except ValueError:
+        plot_top_n = None
+    start_date = config.get("Simulation", "StartDate", fallback="").strip()
+    simulation_start = date.fromisoformat(start_date) if start_date else date(date.today().year, 1, 1)
+
+    def read_sweep_values(option: str, default: float) -> tuple[float, ...]:
+        values = config.get("Sweep", option, fallback="").split(",")
+        return tuple(float(value) for value in values if value.strip()) or (default,)
+
+    plot_objects = tuple(
+        name.strip() for name in config.get("Plots", "Objects", fallback="").split(",") if name.strip()
+    )
+
     settings = UserSettings(
         root_path=root_path,
         ini_file=ini_file,
         observer_latitude=float(observer["Latitude"]),
         observer_longitude=float(observer["Longitude"]),
         horizon_file=root_path.joinpath(observer["HorizonFile"]),
+        horizon_resolution=float(observer.get("HorizonResolution", "0.01")),
         min_obs_hours=float(filters["MinObservationHours"]),
         min_obs_peak_altitude=float(filters["MinObservationPeakAltitude"]),
         min_obs_altitude=float(filters["MinObservationAltitude"]),
@@ -40,8 +69,71 @@ def read_settings(file: str = default_ini_file) -> UserSettings:
         results_path=root_path.joinpath(output["Results"]),
         clear_results_before_running=output.getboolean("ClearResultsBeforeRunning"),
         pool_size=int(parallelism["MaxParallelJobs"]),
+        simulation_engine=config.get("Simulation", "Engine", fallback="vectorized").strip(),
+        block_size=block_size,
+        memory_budget_mb=float(parallelism.get("MemoryBudgetMB", "1024")),
+        cache_path=root_path.joinpath(cache_folder) if cache_folder else None,
+        cache_max_size_mb=config.getfloat("Cache", "MaxSizeMB", fallback=1024.0),
+        make_plots=config.getboolean("Plots", "Enabled", fallback=True),
+        plot_top_n=plot_top_n,
+        plot_objects=plot_objects,
+        site_name=ini_file.stem,
+        simulation_start=simulation_start,
+        simulation_days=config.getint("Simulation", "Days", fallback=365),
+        sweep_min_obs_hours=read_sweep_values("MinObservationHours", float(filters["MinObservationHours"])),
+        sweep_min_obs_peak_altitudes=read_sweep_values(
+            "MinObservationPeakAltitude", float(filters["MinObservationPeakAltitude"])
+        ),
+        sweep_min_dso_sizes=read_sweep_values("MinDSOSize", float(filters["MinDSOSize"])),
     )
 
-    create_dir(settings.results_path, settings.clear_results_before_running)
+    if settings.simulation_engine not in simulation_engines:
+        raise ValueError(f"Unknown simulation engine: {settings.simulation_engine}")
+    if settings.simulation_days < 1:
+        raise ValueError(f"Days must be at least 1: {settings.simulation_days}")
+
+    if prepare_results:
+        prepare_results_folder(settings)
 
     return settings
+
+
+def read_sites(sites_file: str, file: str = default_ini_file, prepare_results: bool = True) -> list[UserSettings]:
+    # One set of settings per row of a sites table (CSV file with columns Name, Latitude, Longitude, and optionally
+    # HorizonFile and Results). Everything else comes from the ini file. By default, each site's results go to a
+    # folder named after the site, in the ini file's results folder
+    base_settings = read_settings(file, prepare_results=False)
+    root_path = base_settings.root_path
+    sites = []
+    with open(root_path.joinpath(sites_file), newline="") as f:
+        for row in csv.DictReader(f, skipinitialspace=True):
+            name = row["Name"].strip()
+            horizon_file = (row.get("HorizonFile") or "").strip()
+            results_folder = (row.get("Results") or "").strip()
+            settings = dataclasses.replace(
+                base_settings,
+                site_name=name,
+                observer_latitude=float(row["Latitude"]),
+                observer_longitude=float(row["Longitude"]),
+                horizon_file=root_path.joinpath(horizon_file) if horizon_file else base_settings.horizon_file,
+                results_path=(
+                    root_path.joinpath(results_folder) if results_folder else base_settings.results_path.joinpath(name)
+                ),
+            )
+            if prepare_results:
+                prepare_results_folder(settings)
+            sites.append(settings)
+    return sites
+
+
+def prepare_results_folder(settings: UserSettings):
+    # Creates (or clears) the results folder of a run. The DSO plots, and their manifest, survive clearing: plots that
+    # are still up to date are not made again (see main.generate_dso_plots, which removes those no longer selected)
+    keep = ()
+    if settings.make_plots:
+        try:
+            manifest = json.loads(Path(settings.plot_manifest_file).read_text())
+        except (OSError, ValueError):
+            manifest = {}
+        keep = {Path(settings.plot_manifest_file).name} | {f"{name}.png" for name in manifest}
+    create_dir(settings.results_path, settings.clear_results_before_running, keep=keep)
@@ -0,0 +1,94 @@
+"""Read-only state shared with pool workers: arrays in shared memory, and run-wide state published once per worker"""
+
+import os
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
+
+
+class SharedArray(NamedTuple):
+    # Small, picklable handle to an array living in a shared memory block
+    name: str
+    shape: tuple
+    dtype: str
+
+
+_owned_blocks = {}  # Shared memory blocks created by this process, by name
+_attached_blocks = {}  # Shared memory blocks attached by this (worker) process, by name
+_worker_context = None  # Run-wide state published to this (worker) process by init_worker
+
+
+class SharedArrays:
+    # Owns the shared memory blocks of a run, and releases them when the context exits
+    def __init__(self):
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for block in self._blocks:
+            _owned_blocks.pop(block.name, None)
+            block.close()
+            block.unlink()
+        self._blocks.clear()
+
+    def share_array(self, array: np.ndarray) -> SharedArray:
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self._blocks.append(block)
+        _owned_blocks[block.name] = (os.getpid(), block)
+        return SharedArray(block.name, array.shape, array.dtype.str)
+
+    def share(self, data):
+        # Copy of a NamedTuple (or tuple) with every array (including those of nested NamedTuples and tuples)
+        # replaced by a SharedArray handle. Arrays that are already shared are left as they are
+        if isinstance(data, np.ndarray):
+            return self.share_array(data)
+        if isinstance(data, SharedArray):
+            return data
+        if is_named_tuple(data):
+            return data._replace(**{field: self.share(value) for field, value in data._asdict().items()})
+        if isinstance(data, tuple):
+            return tuple(self.share(value) for value in data)
+        return data
+
+
+def attach_array(handle: SharedArray) -> np.ndarray:
+    owner_pid, block = _owned_blocks.get(handle.name, (None, None))
+    if owner_pid != os.getpid():
+        block = _attached_blocks.get(handle.name)
+        if block is None:
+            # Pool workers share their parent's resource tracker, so the block is still unlinked only once
+            block = shared_memory.SharedMemory(name=handle.name)
+            _attached_blocks[handle.name] = block
+    array = np.ndarray(handle.shape, dtype=np.dtype(handle.dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+def attach(data):
+    # Inverse of SharedArrays.share: copy of a NamedTuple (or tuple) with every SharedArray handle replaced by its array
+    if isinstance(data, SharedArray):
+        return attach_array(data)
+    if is_named_tuple(data):
+        return data._replace(**{field: attach(value) for field, value in data._asdict().items()})
+    if isinstance(data, tuple):
+        return tuple(attach(value) for value in data)
+    return data
+
+
+def is_named_tuple(value) -> bool:
+    return isinstance(value, tuple) and hasattr(value, "_asdict")
+
+
+def init_worker(context: NamedTuple):
+    # Pool initializer: publishes the run-wide state (horizon, ephemeris, settings...) once to each worker, so that
+    # jobs only carry their own objects
+    global _worker_context
+    _worker_context = attach(context)
+
+
+def worker_context():
+    return _worker_context
@@ -1,133 +1,383 @@
-import math
-
-import numpy as np
-
-from src import constants, utils
-from src.models import SimJobArgs, SimResult
-
-
-def run_dso(args: SimJobArgs) -> SimResult:
-    catalog_id = args.catalog_id
-    catalog_name = args.catalog_name
-    is_galaxy = args.is_galaxy
-    object_ra_radians = args.object_ra_radians
-    object_dec_radians = args.object_dec_radians
-    object_size = args.object_size
-    horizon_data = args.horizon_data
-    user = args.user
-    print(f"\t\t- ({catalog_id}) {catalog_name}")
-
-    # Initialize internal data
-    observer_longitude_radians = user.observer_longitude_radians
-    min_obs_hours = (user.min_obs_hours,)
-    min_obs_peak_altitude = (user.min_obs_peak_altitude,)
-    min_obs_altitude = (user.min_obs_altitude,)
-    r_23 = user.r_23
-    month = 0
-    time_series = np.zeros(shape=(constants.days_in_year, 5))
-    t0 = 79.0 * constants.hours_in_day  # Number of hours between Jan 1 and Spring Equinox
-    t = 0.0 - t0  # January 1
-
-    # Start simulation
-    sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
-    if sun_altitude > -12.0:  # It's daylight, so move clock forward to first dark
-        t, sun_altitude, n1 = utils.calc_sunset(
-            t, constants.simulation_delta_t_hours, sun_altitude, observer_longitude_radians, r_23, constants.r_01
-        )
-    else:
-        while sun_altitude < -12.0:  # It's dark, so move clock back to first dark
-            t -= constants.simulation_delta_t_hours / 4.0
-            sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
-        t += constants.simulation_delta_t_hours / 4.0
-        sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
-    day = 0
-    min_altitude = 100.0  # Initialize single-night observation variables
-    max_altitude = 0.0
-    score = 0.0
-    time_visible = 0.0
-
-    # Begin year-long simulation
-    while day < constants.days_in_year:  # Analysis starts at first dark on first day of the year
-        if sun_altitude < -12.0:
-            dalt, daz = utils.convert_ra_dec_to_alt_az(
-                t, observer_longitude_radians, object_ra_radians, object_dec_radians, r_23
-            )
-            horizon_altitude = np.interp(daz, horizon_data[:, 0], horizon_data[:, 1])
-            if dalt > max(min_obs_altitude, horizon_altitude):
-                time_visible += constants.simulation_delta_t_hours
-                max_altitude = max(max_altitude, dalt)
-                min_altitude = min(min_altitude, dalt)
-                score = max(score, time_visible / 10.25 * max_altitude / 90.0)
-            t += constants.simulation_delta_t_hours
-            sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
-        else:
-            # End of the night clean up
-            if month == 0:
-                damo = float(month + 1) + (float(day) / float(constants.month_last_day[month]))
-            else:
-                damo = float(month + 1) + float(day - constants.month_last_day[month - 1]) / float(
-                    constants.month_last_day[month] - constants.month_last_day[month - 1]
-                )
-            if min_altitude > 95.0:
-                min_altitude = 0.0
-            time_series[day, 0:5] = np.array([damo, min_altitude, max_altitude, time_visible, score])
-            if day > 1:
-                # Perform moving average to smooth out curves
-                time_series[day - 1, 1] = np.mean(time_series[day - 2 : day + 1, 1])
-                time_series[day - 1, 2] = np.mean(time_series[day - 2 : day + 1, 2])
-                time_series[day - 1, 3] = np.mean(time_series[day - 2 : day + 1, 3])
-                time_series[day - 1, 4] = np.mean(time_series[day - 2 : day + 1, 4])
-            min_altitude = 100.0  # Initialize single-night observation variables
-            max_altitude = 0.0
-            score = 0.0
-            time_visible = 0.0
-            day += 1
-            if day == constants.month_last_day[month]:
-                month += 1
-
-            # fast-forward through daylight to sunset
-            t, sun_altitude, n1 = utils.calc_sunset(
-                t, constants.simulation_delta_t_hours, sun_altitude, observer_longitude_radians, r_23, constants.r_01
-            )
-
-    if max(time_series[:, 2]) < min_obs_peak_altitude or max(time_series[:, 3]) < min_obs_hours:
-        return SimResult(is_included=False)  # Cannot see DSO (not high enough and/or not visible for long enough
-
-    # Find first day when imaging score is maximum
-    max_month, max_day, max_score = calc_first_max_info(time_series)
-
-    return SimResult(
-        is_included=True,
-        catalog_id=catalog_id,
-        catalog_name=catalog_name,
-        is_galaxy=is_galaxy,
-        ra_degrees=math.degrees(object_ra_radians),
-        dec_degrees=math.degrees(object_dec_radians),
-        size=object_size,
-        max_score=max_score,
-        max_month=max_month,
-        max_day=max_day,
-        time_series=time_series,
-    )
-
-
-def calc_first_max_info(time_series):
-    max_score = 0.97 * max(time_series[:, 4])  # Use 0.97 to avoid small numerical fluctuation error
-    kk = 0
-    if time_series[0, 4] < max_score:
-        while time_series[kk, 4] < max_score:
-            kk += 1
-            kk = min(max(0, kk), 364)
-    else:
-        kk = constants.days_in_year - 1
-        while time_series[kk, 4] >= max_score:
-            kk -= 1
-            kk = max(0, kk)
-        kk += 1
-        kk = min(max(0, kk), 364)
-    kk = min(max(0, kk), 364)
-    max_month = int(time_series[kk, 0])
-    max_day = max(int((time_series[kk, 0] - float(max_month)) * 31.0), 1)
-
-    max_score = max(time_series[:, 4])
-    return max_month, max_day, max_score
+import itertools
+import math
+
+import numpy as np
+
+from src import (
+    analytic,
+    cache,
+    constants,
+    ephemeris,
+    horizon,
+    instrumentation,
+    progress,
+    shared,
+    utils,
+)
+from src.models import (
+    EffectiveHorizon,
+    NightEphemeris,
+    RunContext,
+    SimBlockArgs,
+    SimJobArgs,
+    SimResult,
+    UserSettings,
+)
+
+
+def run_dso(args: SimJobArgs) -> SimResult:
+    return make_result(args, engines[args.user.simulation_engine](args))
+
+
+def simulate_reference(args: SimJobArgs) -> np.ndarray:
+    # Original time-stepping simulation, one tick at a time. Kept as the reference the other engines are checked against
+    object_ra_radians = args.object_ra_radians
+    object_dec_radians = args.object_dec_radians
+    horizon_data = args.horizon.data
+    user = args.user
+
+    # Initialize internal data
+    observer_longitude_radians = user.observer_longitude_radians
+    min_obs_altitude = (user.min_obs_altitude,)
+    r_23 = user.r_23
+    night_dates = user.night_dates
+    time_series = np.zeros(shape=(len(night_dates), 5))
+    time_series[:, 0] = night_dates.astype(np.int64)
+    night = 0
+
+    # Every calendar year of the window is simulated from its Jan 1, up to its last night in the window
+    for _, first_day, last_day in ephemeris.split_years(night_dates):
+        t = 0.0 - constants.jan_1_to_equinox_hours  # January 1
+
+        # Start simulation
+        sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
+        if sun_altitude > -12.0:  # It's daylight, so move clock forward to first dark
+            t, sun_altitude, n1 = utils.calc_sunset(
+                t, constants.simulation_delta_t_hours, sun_altitude, observer_longitude_radians, r_23, constants.r_01
+            )
+        else:
+            while sun_altitude < -12.0:  # It's dark, so move clock back to first dark
+                t -= constants.simulation_delta_t_hours / 4.0
+                sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
+            t += constants.simulation_delta_t_hours / 4.0
+            sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
+        day = 0
+        min_altitude = 100.0  # Initialize single-night observation variables
+        max_altitude = 0.0
+        score = 0.0
+        time_visible = 0.0
+
+        while day <= last_day:  # Analysis starts at first dark on first day of the year
+            if sun_altitude < -12.0:
+                if day >= first_day:  # Nights before the window only move the clock forward
+                    dalt, daz = utils.convert_ra_dec_to_alt_az(
+                        t, observer_longitude_radians, object_ra_radians, object_dec_radians, r_23
+                    )
+                    horizon_altitude = np.interp(daz, horizon_data[:, 0], horizon_data[:, 1])
+                    if dalt > max(min_obs_altitude, horizon_altitude):
+                        time_visible += constants.simulation_delta_t_hours
+                        max_altitude = max(max_altitude, dalt)
+                        min_altitude = min(min_altitude, dalt)
+                        score = max(score, time_visible / 10.25 * max_altitude / 90.0)
+                t += constants.simulation_delta_t_hours
+                sun_altitude = utils.calc_sun_altitude(t, observer_longitude_radians, r_23, constants.r_01)
+            else:
+                # End of the night clean up
+                if day >= first_day:
+                    if min_altitude > 95.0:
+                        min_altitude = 0.0
+                    time_series[night, 1:5] = np.array([min_altitude, max_altitude, time_visible, score])
+                    if night > 1:
+                        # Perform moving average to smooth out curves
+                        time_series[night - 1, 1] = np.mean(time_series[night - 2 : night + 1, 1])
+                        time_series[night - 1, 2] = np.mean(time_series[night - 2 : night + 1, 2])
+                        time_series[night - 1, 3] = np.mean(time_series[night - 2 : night + 1, 3])
+                        time_series[night - 1, 4] = np.mean(time_series[night - 2 : night + 1, 4])
+                    night += 1
+                min_altitude = 100.0  # Initialize single-night observation variables
+                max_altitude = 0.0
+                score = 0.0
+                time_visible = 0.0
+                day += 1
+
+                # fast-forward through daylight to sunset
+                t, sun_altitude, n1 = utils.calc_sunset(
+                    t,
+                    constants.simulation_delta_t_hours,
+                    sun_altitude,
+                    observer_longitude_radians,
+                    r_23,
+                    constants.r_01,
+                )
+
+    return time_series
+
+
+def simulate_vectorized(args: SimJobArgs) -> np.ndarray:
+    # Evaluates the object at every dark-time sample of the window at once (a chunk of nights at a time), and reduces
+    # the samples night by night.
+    # Matches simulate_reference to within one time step of visible hours per night (see README)
+    time_series = calc_time_series(
+        np.array([args.object_ra_radians]),
+        np.array([args.object_dec_radians]),
+        args.horizon,
+        args.night_ephemeris,
+        args.user,
+    )
+    return time_series[0]
+
+
+def simulate_analytic(args: SimJobArgs) -> np.ndarray:
+    # Visibility of each night in closed form, from the arcs of hour angle where the object is above the effective
+    # horizon (see analytic.py). Matches simulate_vectorized to within one time step of visible hours per night
+    # (see README)
+    time_series = calc_analytic_time_series(
+        np.array([args.object_ra_radians]),
+        np.array([args.object_dec_radians]),
+        args.horizon,
+        args.night_ephemeris,
+        args.user,
+    )
+    return time_series[0]
+
+
+engines = {
+    "reference": simulate_reference,
+    "vectorized": simulate_vectorized,
+    "analytic": simulate_analytic,
+}
+
+
+def run_block(args: SimBlockArgs) -> list[tuple[int, list[SimResult]]]:
+    # Pool job (one per block): the state of every site was published to this worker by shared.init_worker
+    pool_context = shared.worker_context()
+    return simulate_block(args, [pool_context.sites[site] for site in args.sites])
+
+
+def simulate_block(args: SimBlockArgs, contexts: list[RunContext]) -> list[tuple[int, list[SimResult]]]:
+    # Simulates a block of catalog objects in one go, for one or more sites at the same location (see SimBlockArgs).
+    # Returns the results of each site
+    user = contexts[0].user
+    if user.simulation_engine == "vectorized":
+        site_time_series = calc_sites_time_series(args, contexts)
+
+    site_results = []
+    for k, (site, context, site_mask) in enumerate(zip(args.sites, contexts, args.site_masks)):
+        jobs = list(itertools.compress(block_jobs(args, context), site_mask))
+        instrumentation.count("objects simulated", len(jobs))
+        if user.simulation_engine == "vectorized":
+            time_series = site_time_series[k]
+        elif user.simulation_engine == "analytic":
+            time_series = calc_analytic_time_series(
+                args.object_ra_radians[site_mask],
+                args.object_dec_radians[site_mask],
+                context.horizon,
+                context.night_ephemeris,
+                context.user,
+            )
+        else:
+            # The reference engine evaluates the sun once per tick: its evaluations are counted from here, so that
+            # its loop is left as it was
+            with instrumentation.counting_calls(utils, "calc_sun_altitude", "sun evaluations"):
+                time_series = [engines[user.simulation_engine](job) for job in jobs]
+
+        if context.result_cache is not None:
+            with instrumentation.stage("cache store"):
+                for job, job_time_series in zip(jobs, time_series):
+                    cache.store(context.result_cache, job.object_ra_radians, job.object_dec_radians, job_time_series)
+
+        with instrumentation.stage("results"):
+            sim_results = [make_result(job, job_time_series) for job, job_time_series in zip(jobs, time_series)]
+        site_results.append((site, sim_results))
+        progress.advance(
+            "simulate",
+            len(jobs),
+            sum(r.is_included for r in sim_results),
+            (f"({j.catalog_id}) {j.catalog_name}" for j in jobs),
+        )
+    return site_results
+
+
+def make_sim_block(rows, catalog_names, sites=(0,), site_masks=None) -> SimBlockArgs:
+    return SimBlockArgs(
+        catalog_ids=rows["id"],
+        catalog_names=catalog_names,
+        is_galaxy=np.isin(rows["type"], list(constants.included_dso_types_galaxies)),
+        object_ra_radians=np.radians(rows["ra"]),
+        object_dec_radians=np.radians(rows["dec"]),
+        object_size=np.maximum(rows["major_axis"], rows["minor_axis"]),
+        sites=sites,
+        site_masks=site_masks if site_masks is not None else np.ones((len(sites), len(rows)), dtype=bool),
+    )
+
+
+def block_jobs(args: SimBlockArgs, context: RunContext):
+    for k, catalog_name in enumerate(args.catalog_names):
+        yield SimJobArgs(
+            int(args.catalog_ids[k]),
+            catalog_name,
+            bool(args.is_galaxy[k]),
+            float(args.object_ra_radians[k]),
+            float(args.object_dec_radians[k]),
+            float(args.object_size[k]),
+            context.horizon,
+            context.night_ephemeris,
+            context.user,
+        )
+
+
+def calc_block_time_series(args: SimBlockArgs, context: RunContext) -> np.ndarray:
+    # Time series of every object of a block at a single site, with the engine of its user, whatever the filters:
+    # shape (objects, nights, 5). See server.py
+    user = context.user
+    if user.simulation_engine == "vectorized":
+        return calc_time_series(
+            args.object_ra_radians, args.object_dec_radians, context.horizon, context.night_ephemeris, user
+        )
+    if user.simulation_engine == "analytic":
+        return calc_analytic_time_series(
+            args.object_ra_radians, args.object_dec_radians, context.horizon, context.night_ephemeris, user
+        )
+    with instrumentation.counting_calls(utils, "calc_sun_altitude", "sun evaluations"):
+        return np.array([engines[user.simulation_engine](job) for job in block_jobs(args, context)])
+
+
+def calc_sites_time_series(args: SimBlockArgs, contexts: list[RunContext]) -> list[np.ndarray]:
+    # Time series of the block's objects at each of its sites. The altitude and azimuth only depend on the location:
+    # they are computed once for all the sites, a chunk of nights at a time
+    user = contexts[0].user
+    site_night_values = [[] for _ in contexts]
+    for chunk in ephemeris.split(contexts[0].night_ephemeris, constants.simulation_chunk_nights):
+        with instrumentation.stage("alt-az"):
+            altitude, azimuth = utils.convert_ra_dec_to_alt_az_matrix(
+                chunk.sample_times,
+                user.observer_longitude_radians,
+                args.object_ra_radians,
+                args.object_dec_radians,
+                user.r_23,
+            )
+        for night_values, context, site_mask in zip(site_night_values, contexts, args.site_masks):
+            with instrumentation.stage("horizon lookup"):
+                is_visible = altitude[site_mask] > horizon.lookup(context.horizon, azimuth[site_mask])
+            with instrumentation.stage("night values"):
+                night_values.append(calc_night_values(is_visible, altitude[site_mask], chunk))
+    return [
+        make_time_series(np.concatenate(night_values, axis=-2), contexts[0].night_ephemeris)
+        for night_values in site_night_values
+    ]
+
+
+def calc_time_series(ra, dec, effective_horizon: EffectiveHorizon, night_ephemeris: NightEphemeris, user: UserSettings):
+    # Time series of a block of objects: shape (len(ra), nights, 5), simulated a chunk of nights at a time
+    night_values = []
+    for chunk in ephemeris.split(night_ephemeris, constants.simulation_chunk_nights):
+        altitude, azimuth = utils.convert_ra_dec_to_alt_az_matrix(
+            chunk.sample_times, user.observer_longitude_radians, ra, dec, user.r_23
+        )
+        is_visible = altitude > horizon.lookup(effective_horizon, azimuth)
+        night_values.append(calc_night_values(is_visible, altitude, chunk))
+    return make_time_series(np.concatenate(night_values, axis=-2), night_ephemeris)
+
+
+def calc_analytic_time_series(
+    ra, dec, effective_horizon: EffectiveHorizon, night_ephemeris: NightEphemeris, user: UserSettings
+):
+    # Same as calc_time_series, with the analytic engine
+    with instrumentation.stage("analytic nights"):
+        night_values = [
+            analytic.calc_night_values(ra, dec, effective_horizon, chunk, user)
+            for chunk in ephemeris.split(night_ephemeris, constants.simulation_chunk_nights)
+        ]
+    return make_time_series(np.concatenate(night_values, axis=-2), night_ephemeris)
+
+
+def calc_block_size(num_samples, num_objects, user: UserSettings) -> int:
+    # Objects per block: as set by the user, or as many as fit in each worker's share of the memory budget,
+    # while still giving every worker a few blocks, so that the load is balanced and results stream back steadily
+    if user.block_size is not None:
+        return user.block_size
+    worker_budget = user.memory_budget_mb * 1024 * 1024 / user.pool_size
+    block_size = int(worker_budget / (constants.simulation_bytes_per_sample * max(num_samples, 1)))
+    return max(1, min(block_size, math.ceil(num_objects / (user.pool_size * constants.pool_tasks_per_worker))))
+
+
+def calc_in_process_block_size(num_samples, user: UserSettings) -> int:
+    # Objects per block of a simulation without a pool (see tonight.py and api.py): as many as fit in the memory budget
+    return max(
+        1, int(user.memory_budget_mb * 1024 * 1024 / (constants.simulation_bytes_per_sample * max(num_samples, 1)))
+    )
+
+
+def reduce_nights(ufunc, values, night_offsets, night_counts, empty):
+    # Segmented reduction of values along their last axis, one segment per night
+    padded = np.concatenate((values, np.full(values.shape[:-1] + (1,), empty)), axis=-1)
+    reduced = ufunc.reduceat(padded, np.minimum(night_offsets, values.shape[-1]), axis=-1)
+    reduced[..., night_counts == 0] = empty
+    return reduced
+
+
+def calc_night_values(is_visible, altitude, night_ephemeris: NightEphemeris):
+    # Per-night min/max altitude, hours visible and score, for one object or a stack of objects (leading axes)
+    night_offsets, night_counts = night_ephemeris.night_offsets, night_ephemeris.night_counts
+    hours_visible = reduce_nights(np.add, is_visible.astype(float), night_offsets, night_counts, 0.0)
+    hours_visible *= constants.simulation_delta_t_hours
+    max_altitude = reduce_nights(np.maximum, np.where(is_visible, altitude, 0.0), night_offsets, night_counts, 0.0)
+    min_altitude = reduce_nights(np.minimum, np.where(is_visible, altitude, 100.0), night_offsets, night_counts, 100.0)
+    min_altitude[min_altitude > 95.0] = 0.0
+    score = hours_visible / 10.25 * max_altitude / 90.0  # Score only grows during a night
+    return np.stack((min_altitude, max_altitude, hours_visible, score), axis=-1)
+
+
+def make_time_series(night_values, night_ephemeris: NightEphemeris):
+    # Time series of the whole window: the date of each night (days since 1970-01-01), then its smoothed values
+    time_series = np.empty(night_values.shape[:-1] + (5,))
+    time_series[..., 0] = night_ephemeris.night_dates.astype(np.int64)
+    time_series[..., 1:5] = night_values
+    with instrumentation.stage("smoothing"):
+        smooth_time_series(time_series)
+    return time_series
+
+
+def smooth_time_series(time_series):
+    # Same moving average as simulate_reference: each day is averaged with the (already smoothed) previous day
+    # and the next day, so it has to run day by day
+    for day in range(2, time_series.shape[-2]):
+        time_series[..., day - 1, 1:5] = np.mean(time_series[..., day - 2 : day + 1, 1:5], axis=-2)
+
+
+def make_result(args: SimJobArgs, time_series) -> SimResult:
+    # Every simulated DSO gets its unfiltered physics (peak altitude, longest night, best score), so that other filter
+    # values can be tried without simulating again (see sweep.py). Only included DSOs keep their time series
+    user = args.user
+    peak_altitude, peak_hours = float(max(time_series[:, 2])), float(max(time_series[:, 3]))
+    # Cannot see DSO (not high enough and/or not visible for long enough)
+    is_included = peak_altitude >= user.min_obs_peak_altitude and peak_hours >= user.min_obs_hours
+
+    # Find first day when imaging score is maximum
+    max_date, max_score = calc_first_max_info(time_series)
+
+    return SimResult(
+        is_included=is_included,
+        catalog_id=args.catalog_id,
+        catalog_name=args.catalog_name,
+        is_galaxy=args.is_galaxy,
+        ra_degrees=math.degrees(args.object_ra_radians),
+        dec_degrees=math.degrees(args.object_dec_radians),
+        size=args.object_size,
+        max_score=max_score,
+        max_date=max_date,
+        peak_altitude=peak_altitude,
+        peak_hours=peak_hours,
+        time_series=time_series if is_included else None,
+    )
+
+
+def calc_first_max_info(time_series):
+    # Date of the first night of the best imaging period, and the best score
+    max_score = max(time_series[:, 4])
+    is_best = time_series[:, 4] >= 0.97 * max_score  # Use 0.97 to avoid small numerical fluctuation error
+    kk = int(np.argmax(is_best))
+    if kk == 0 and len(time_series) in (365, 366) and is_best[-1] and not is_best.all():
+        # Over a whole year, a best period that runs over the end of the window starts in its last nights
+        kk = len(is_best) - int(np.argmin(is_best[::-1]))
+    return np.datetime64(int(time_series[kk, 0]), "D"), max_score
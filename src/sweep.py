@@ -0,0 +1,71 @@
+"""Filter sweeps: the included DSOs, and their ranking, for every combination of filter values, evaluated at once from
+the unfiltered physics of the last run (see results.ResultStoreWriter), without simulating again"""
+
+import csv
+import itertools
+
+import numpy as np
+
+from src import constants
+from src.models import ResultStore, SweepRow, UserSettings
+
+
+def evaluate(store: ResultStore, user: UserSettings) -> list[SweepRow]:
+    # One row per combination of the sweep values of MinObservationHours, MinObservationPeakAltitude and MinDSOSize.
+    # Same tests as simulator.make_result and catalog.select
+    physics = store.physics
+    ranking = np.lexsort((physics["id"], -physics["score"]))  # Best score first
+    physics = physics[ranking]
+    min_hours = np.array(user.sweep_min_obs_hours)
+    min_peak_altitudes = np.array(user.sweep_min_obs_peak_altitudes)
+    min_sizes = np.array(user.sweep_min_dso_sizes)
+
+    # Masks of the included DSOs, shape (hours, peak altitudes, sizes, DSOs), one hours value at a time
+    passes_peak_size = (physics["peak_altitude"] >= min_peak_altitudes[:, None, None]) & (
+        physics["size"] > min_sizes[None, :, None]
+    )
+    run_filters = store.meta["filters"]
+    sweep_rows = []
+    for hours in min_hours:
+        is_included = passes_peak_size & (physics["peak_hours"] >= hours)
+        num_included = is_included.sum(axis=-1)
+        num_galaxies = (is_included & physics["galaxy"]).sum(axis=-1)
+        for (k, peak_altitude), (m, size) in itertools.product(enumerate(min_peak_altitudes), enumerate(min_sizes)):
+            top_index = np.flatnonzero(is_included[k, m])[: constants.sweep_top_n]
+            sweep_rows.append(
+                SweepRow(
+                    min_obs_hours=float(hours),
+                    min_obs_peak_altitude=float(peak_altitude),
+                    min_dso_size=float(size),
+                    num_included=int(num_included[k, m]),
+                    num_galaxies=int(num_galaxies[k, m]),
+                    is_exact=bool(
+                        hours >= run_filters["min_obs_hours"]
+                        and peak_altitude >= run_filters["min_obs_peak_altitude"]
+                        and size >= run_filters["min_dso_size"]
+                    ),
+                    top_names=tuple(physics["name"][top_index].tolist()),
+                )
+            )
+    return sweep_rows
+
+
+def save(sweep_rows: list[SweepRow], user: UserSettings):
+    with open(user.sweep_file, "w", newline="") as f_sweep:
+        csv_writer = csv.writer(f_sweep)
+        csv_writer.writerow(
+            ("Min Hours", "Min Peak Altitude", "Min Size", "Included", "Galaxies", "Nebulas", "Exact", "Best DSOs")
+        )
+        for row in sweep_rows:
+            csv_writer.writerow(
+                (
+                    row.min_obs_hours,
+                    row.min_obs_peak_altitude,
+                    row.min_dso_size,
+                    row.num_included,
+                    row.num_galaxies,
+                    row.num_included - row.num_galaxies,
+                    int(row.is_exact),
+                    " ".join(row.top_names),
+                )
+            )
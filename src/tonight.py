@@ -0,0 +1,97 @@
+"""Tonight: the best DSOs of the next few nights, for the whole prefiltered catalog, in a fraction of a second.
+Runs in-process: no pool, no plots, no result files"""
+
+import dataclasses
+from datetime import date, datetime, timezone
+
+import numpy as np
+
+from src import catalog, constants, ephemeris, horizon, simulator, utils
+from src.models import EffectiveHorizon, NightEphemeris, TonightTarget, UserSettings
+
+
+def find_targets(
+    user: UserSettings,
+    nights: int = 1,
+    start: date | None = None,
+    rows: np.ndarray | None = None,
+    effective_horizon: EffectiveHorizon | None = None,
+) -> list[TonightTarget]:
+    # Targets that pass the observation filters on at least one of the nights from start (tonight by default),
+    # best score first. The catalog rows and the horizon are those of the settings' files, unless given
+    user = dataclasses.replace(user, simulation_start=start or date.today(), simulation_days=nights)
+    if rows is None:
+        rows = catalog.load(user).rows
+    rows = rows[catalog.select(rows, user)]
+    if effective_horizon is None:
+        effective_horizon = horizon.load_data(user)
+    night_ephemeris = ephemeris.build(user)
+    if len(night_ephemeris.sample_times) == 0:  # Never dark enough (summer nights at high latitudes)
+        return []
+
+    block_size = simulator.calc_in_process_block_size(len(night_ephemeris.sample_times), user)
+    targets = []
+    for start_row in range(0, len(rows), block_size):
+        targets += find_block_targets(
+            rows[start_row : start_row + block_size], effective_horizon, night_ephemeris, user
+        )
+    return sorted(targets, key=lambda target: target.score, reverse=True)
+
+
+def find_block_targets(rows, effective_horizon: EffectiveHorizon, night_ephemeris: NightEphemeris, user: UserSettings):
+    altitude, azimuth = utils.convert_ra_dec_to_alt_az_matrix(
+        night_ephemeris.sample_times,
+        user.observer_longitude_radians,
+        np.radians(rows["ra"]),
+        np.radians(rows["dec"]),
+        user.r_23,
+    )
+    is_visible = altitude > horizon.lookup(effective_horizon, azimuth)
+    # Unsmoothed: each night on its own
+    night_values = simulator.calc_night_values(is_visible, altitude, night_ephemeris)
+    best_night = np.argmax(night_values[..., 3], axis=-1)
+    min_altitude, max_altitude, hours_visible, score = np.moveaxis(
+        night_values[np.arange(len(rows)), best_night], -1, 0
+    )
+    is_included = (max_altitude >= user.min_obs_peak_altitude) & (hours_visible >= user.min_obs_hours)
+
+    # First and last visible samples of each included object on its best night
+    included = np.flatnonzero(is_included)
+    if len(included) == 0:
+        return []
+    sample_night = np.repeat(np.arange(len(night_ephemeris.night_counts)), night_ephemeris.night_counts)
+    is_visible_best = is_visible[included] & (sample_night == best_night[included, np.newaxis])
+    first_sample = np.argmax(is_visible_best, axis=-1)
+    last_sample = is_visible_best.shape[-1] - 1 - np.argmax(is_visible_best[:, ::-1], axis=-1)
+    night_dates = night_ephemeris.night_dates[best_night[included]]
+    visible_from = clock_times(night_ephemeris.sample_times[first_sample], night_dates, user)
+    visible_to = clock_times(night_ephemeris.sample_times[last_sample], night_dates, user)
+
+    names = catalog.catalog_names(rows[included])
+    is_galaxy = np.isin(rows["type"][included], list(constants.included_dso_types_galaxies))
+    return [
+        TonightTarget(
+            catalog_id=int(rows["id"][k]),
+            catalog_name=names[i],
+            is_galaxy=bool(is_galaxy[i]),
+            night_date=night_dates[i],
+            visible_from=visible_from[i],
+            visible_to=visible_to[i],
+            max_altitude=float(max_altitude[k]),
+            hours_visible=float(hours_visible[k]),
+            score=float(score[k]),
+        )
+        for i, k in enumerate(included)
+    ]
+
+
+def clock_times(t, night_dates, user: UserSettings) -> list[datetime]:
+    # Local clock times of instants of the nights of night_dates: local solar time from the Sun's hour angle,
+    # then UTC from the observer's longitude, then the time zone of this computer
+    utc_hours = utils.calc_solar_hours_since_noon(t, user.observer_longitude_radians) - user.observer_longitude / 15.0
+    utc_times = (
+        night_dates.astype("datetime64[s]")
+        + np.timedelta64(12, "h")
+        + np.round(utc_hours * 3600.0).astype("timedelta64[s]")
+    )
+    return [utc_time.replace(tzinfo=timezone.utc).astimezone() for utc_time in utc_times.tolist()]
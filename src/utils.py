@@ -2,18 +2,26 @@
 
 import os
 import pathlib
+import pickle
 import shutil
 from math import pi
 from time import perf_counter
 
 import numpy as np
 
-from src import constants
+from src import constants, instrumentation
 
 
-def create_dir(path: pathlib.Path, delete_if_exists=True):
+def create_dir(path: pathlib.Path, delete_if_exists=True, keep=()):
+    # keep: names of files of the folder that are not deleted with the rest of it
     if os.path.exists(path) and delete_if_exists:
-        shutil.rmtree(path)
+        for entry in os.scandir(path):
+            if entry.name in keep:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.unlink(entry.path)
     os.makedirs(path, exist_ok=True)
 
 
@@ -76,25 +84,91 @@ def calc_sun_altitude(t, lon, r_23, r_01):
     return altitude
 
 
-def catalog_info(stellarium_row_data):
-    # determines object catalog info from accepted catalogs only
-    catalog_name = None
-    for catalog_prefix, column_index in constants.catalogs.items():
-        catalog_number = stellarium_row_data[column_index]
-        if catalog_number and catalog_number != "0":
-            catalog_name = f"{catalog_prefix}_{catalog_number}"
-            break
-
-    object_type = stellarium_row_data[5]
-    if object_type in constants.included_dso_types_galaxies:
-        is_galaxy = True
-    elif object_type in constants.included_dso_types_nebulas:
-        is_galaxy = False
-    else:
-        # Unrecognized type
-        is_galaxy = None
-
-    return catalog_name, is_galaxy
+def calc_observer_rotations(t, lon, r_23):
+    # r_23 @ r_12 for an array of times t, stacked: shape (len(t), 3, 3)
+    r_12 = np.zeros((len(t), 3, 3))
+    r_12[:, 0, 0] = r_12[:, 1, 1] = np.cos(constants.earth_rotation_rate * t + lon)
+    r_12[:, 0, 1] = np.sin(constants.earth_rotation_rate * t + lon)
+    r_12[:, 1, 0] = -r_12[:, 0, 1]
+    r_12[:, 2, 2] = 1.0
+    return r_23 @ r_12
+
+
+def convert_ra_dec_to_alt_az_matrix(t, lon, ra, dec, r_23):
+    # Same as convert_ra_dec_to_alt_az, for arrays of objects (ra, dec) and times t: alt and az have shape
+    # (len(ra), len(t))
+    r_ts = np.stack([-np.sin(ra) * np.cos(dec), np.cos(ra) * np.cos(dec), np.sin(dec)], axis=-1)
+    rotations = calc_observer_rotations(t, lon, r_23)
+    # Single product of all object vectors with all rotations: r_tp[k, i, :] = rotations[i] @ r_ts[k]
+    r_tp = (r_ts @ rotations.transpose(2, 0, 1).reshape(3, -1)).reshape(len(ra), len(t), 3)
+    west, up, north = r_tp[..., 0], r_tp[..., 1], r_tp[..., 2]
+    az = np.mod(-np.arctan2(west, north) * 180.0 / pi, 360.0)
+    alt = np.arctan2(up, np.hypot(north, west)) * 180.0 / pi
+    return alt, az
+
+
+def convert_hour_angle_to_alt_az(hour_angle, dec, lat):
+    # Same as convert_ra_dec_to_alt_az, from the object's hour angle (earth_rotation_rate * t + lon - ra, radians)
+    # and declination: alt and az in degrees, with the shape of hour_angle * dec
+    north = np.sin(dec) * np.cos(lat) - np.cos(dec) * np.sin(lat) * np.cos(hour_angle)
+    west = np.cos(dec) * np.sin(hour_angle)
+    up = np.sin(dec) * np.sin(lat) + np.cos(dec) * np.cos(lat) * np.cos(hour_angle)
+    az = np.mod(-np.arctan2(west, north) * 180.0 / pi, 360.0)
+    alt = np.arcsin(np.clip(up, -1.0, 1.0)) * 180.0 / pi
+    return alt, az
+
+
+def calc_sun_ra_dec(t):
+    # Sun's right ascension and declination (radians) in the Earth's rotating-axis frame.
+    # The right ascension is unwrapped (it keeps growing by 2 pi each year) so the Sun's hour angle is continuous
+    instrumentation.count("sun evaluations", np.size(t))
+    orbit_angle = constants.earth_solar_orbital_rate * t
+    sin_dec = -np.sin(constants.earth_tilt) * np.sin(orbit_angle)
+    ra_offset = np.arctan2(np.cos(constants.earth_tilt) * np.sin(orbit_angle), np.cos(orbit_angle)) - orbit_angle
+    ra = orbit_angle + np.mod(ra_offset + pi, 2.0 * pi) - pi
+    return ra, np.arcsin(sin_dec)
+
+
+def calc_solar_hours_since_noon(t, lon):
+    # Local apparent solar time of t, as hours since the previous noon: the Sun's hour angle (0 at noon, pi at midnight,
+    # as in calc_twilight)
+    ra, _ = calc_sun_ra_dec(t)
+    return np.mod(constants.earth_rotation_rate * t + lon - ra, 2.0 * pi) * 12.0 / pi
+
+
+def calc_twilight(t_start, num_nights, lat, lon, sun_altitude=constants.darkness_sun_altitude):
+    # Dusk and dawn times of the first num_nights nights that are not over by t_start, solved in closed form.
+    # With a circular orbit and a fixed tilt, the Sun is at sun_altitude when its hour angle is +/- h0, where
+    # cos(h0) = (sin(alt) - sin(lat) sin(dec)) / (cos(lat) cos(dec)). The Sun's RA and DEC barely move during a day,
+    # so a few fixed-point iterations on t = (hour angle + RA(t) - lon) / earth_rotation_rate converge to round-off.
+    # Nights without darkness (polar summer) have dusk == dawn at local midnight, nights without daylight
+    # (polar winter) last from noon to noon.
+    def half_night(dec):
+        cos_h0 = (np.sin(np.radians(sun_altitude)) - np.sin(lat) * np.sin(dec)) / (np.cos(lat) * np.cos(dec))
+        return np.arccos(np.clip(cos_h0, -1.0, 1.0))
+
+    def solve(hour_angle, t):
+        for _ in range(4):
+            ra, dec = calc_sun_ra_dec(t)
+            t = (hour_angle(dec) + ra - lon) / constants.earth_rotation_rate
+        return t
+
+    ra_start, _ = calc_sun_ra_dec(t_start)
+    first_day = np.floor((constants.earth_rotation_rate * t_start + lon - ra_start) / (2.0 * pi)) - 1
+    day = first_day + np.arange(num_nights + 3)
+    midnight = solve(
+        lambda dec: 2.0 * pi * day + pi, (2.0 * pi * day + pi + ra_start - lon) / constants.earth_rotation_rate
+    )
+    dusk = solve(lambda dec: 2.0 * pi * day + half_night(dec), midnight)
+    dawn = np.maximum(solve(lambda dec: 2.0 * pi * (day + 1) - half_night(dec), midnight), dusk)
+
+    first_night = np.searchsorted(dawn, t_start, side="right")
+    return dusk[first_night : first_night + num_nights], dawn[first_night : first_night + num_nights]
+
+
+def pickled_size(data) -> int:
+    # Number of bytes sent to a pool worker for this data
+    return len(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
 
 
 def print_elapsed_time(name, start_time):
@@ -0,0 +1,51 @@
+"""Analytic engine: closed-form arcs above a flat horizon, and sampling only where the horizon is higher"""
+
+import math
+
+import numpy as np
+import pytest
+
+from src import analytic, constants, horizon, utils
+from src.models import UserSettings
+
+
+def make_decs():
+    return np.radians(np.linspace(-89.0, 89.0, 357))
+
+
+def test_flat_horizon_takes_the_closed_form_path(monkeypatch):
+    user = UserSettings(observer_latitude=33.4, observer_longitude=-111.8, min_obs_altitude=20.0)
+    effective_horizon = horizon.make_effective_horizon([[0.0, 10.0], [180.0, 15.0]], user)
+
+    def no_sampling(*args):
+        raise AssertionError("a flat horizon is not sampled")
+
+    monkeypatch.setattr(analytic, "calc_alt_az", no_sampling)
+    dec = make_decs()
+    arc_starts, arc_ends = analytic.calc_visible_arcs(dec, effective_horizon, user)
+    half_arc = analytic.calc_half_arc(user.min_obs_altitude, dec, user.observer_latitude_radians)
+    assert arc_starts.shape == (len(dec), 1)
+    np.testing.assert_array_equal(arc_starts[:, 0], -half_arc)
+    np.testing.assert_array_equal(arc_ends[:, 0], half_arc)
+
+
+@pytest.mark.parametrize("latitude", [33.4, -40.0, 65.0])
+def test_raised_horizon_matches_sampling_the_whole_arc(latitude):
+    user = UserSettings(observer_latitude=latitude, observer_longitude=0.0, min_obs_altitude=20.0)
+    horizon_data = [[0.0, 5.0], [60.0, 35.0], [100.0, 5.0], [200.0, 10.0], [250.0, 28.0], [300.0, 10.0]]
+    effective_horizon = horizon.make_effective_horizon(horizon_data, user)
+    dec = make_decs()
+    arc_starts, arc_ends = analytic.calc_visible_arcs(dec, effective_horizon, user)
+
+    # Every sample of the whole arc, on the engine's grid
+    lat = user.observer_latitude_radians
+    half_arc = analytic.calc_half_arc(user.min_obs_altitude, dec, lat)
+    num_steps = math.ceil(2.0 * math.pi / (constants.earth_rotation_rate * constants.analytic_step_hours))
+    step = 2.0 * half_arc / num_steps
+    hour_angle = -half_arc[:, None] + (np.arange(num_steps) + 0.5) * step[:, None]
+    altitude, azimuth = utils.convert_hour_angle_to_alt_az(hour_angle, dec[:, None], lat)
+    is_visible = (altitude > horizon.lookup(effective_horizon, azimuth)) & (half_arc[:, None] > 0.0)
+
+    # To rounding, for arcs of a few 1e-8 rad, which only just reach MinObservationAltitude
+    np.testing.assert_allclose(np.sum(arc_ends - arc_starts, axis=1), np.sum(is_visible, axis=1) * step, atol=1e-6)
+    assert np.any(np.sum(is_visible, axis=1) < num_steps * (half_arc > 0.0))  # The horizon hides part of some arcs
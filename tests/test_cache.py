@@ -0,0 +1,25 @@
+"""Result cache: the run key only changes with the physics of the simulation"""
+
+from src import cache, constants
+from src.models import UserSettings
+
+
+def make_user(tmp_path):
+    (tmp_path / "horizon.txt").write_text("0 10\n180 25\n")
+    return UserSettings(observer_latitude=33.4, observer_longitude=-111.8, horizon_file=tmp_path / "horizon.txt")
+
+
+def test_run_key_ignores_non_physics_constants(tmp_path, monkeypatch):
+    user = make_user(tmp_path)
+    run_key = cache.calc_run_key(user)
+    monkeypatch.setattr(constants, "simulation_chunk_nights", constants.simulation_chunk_nights // 2)
+    monkeypatch.setattr(constants, "days_in_year", constants.days_in_year + 1)
+    monkeypatch.setattr(constants, "server_port", constants.server_port + 1)
+    assert cache.calc_run_key(user) == run_key
+
+
+def test_run_key_changes_with_physics_constants(tmp_path, monkeypatch):
+    user = make_user(tmp_path)
+    run_key = cache.calc_run_key(user)
+    monkeypatch.setattr(constants, "simulation_delta_t_hours", constants.simulation_delta_t_hours / 2.0)
+    assert cache.calc_run_key(user) != run_key
@@ -0,0 +1,37 @@
+"""Culling: never drops a DSO that the full simulation would include"""
+
+import dataclasses
+from datetime import date
+
+import numpy as np
+import pytest
+
+from benchmarks import generators
+from src import catalog, culling, ephemeris, horizon, simulator
+from src.models import UserSettings
+
+
+@pytest.mark.parametrize("latitude", [33.4, -25.0, 55.0])
+def test_culled_dsos_are_never_included(tmp_path, latitude):
+    generators.write_catalog(tmp_path / "catalog.txt", 600)
+    generators.write_horizon(tmp_path / "horizon.txt", 1.0)
+    user = UserSettings(
+        observer_latitude=latitude,
+        observer_longitude=-111.8,
+        horizon_file=tmp_path / "horizon.txt",
+        simulation_start=date(2025, 1, 1),
+    )
+    rows = catalog.read(tmp_path / "catalog.txt").rows
+    effective_horizon = horizon.load_data(user)
+    time_series = simulator.calc_time_series(
+        np.radians(rows["ra"]), np.radians(rows["dec"]), effective_horizon, ephemeris.build(user), user
+    )
+    peak_altitude, peak_hours = time_series[..., 2].max(axis=1), time_series[..., 3].max(axis=1)
+
+    # The filters only decide what is included, not how each DSO is simulated
+    for min_obs_hours, min_obs_peak_altitude in ((5.0, 45.0), (2.0, 30.0), (7.0, 60.0)):
+        filters = dataclasses.replace(user, min_obs_hours=min_obs_hours, min_obs_peak_altitude=min_obs_peak_altitude)
+        is_included = (peak_altitude >= min_obs_peak_altitude) & (peak_hours >= min_obs_hours)  # As make_result
+        is_culled = culling.find_never_visible(rows, effective_horizon, filters)
+        assert is_culled.any() and is_included.any()
+        assert not np.any(is_culled & is_included)
@@ -0,0 +1,40 @@
+"""Vectorized engine against the reference engine (tick by tick), within the tolerances documented in the README"""
+
+from datetime import date
+
+import numpy as np
+
+from benchmarks import generators
+from src import catalog, constants, ephemeris, horizon, simulator
+from src.models import RunContext, UserSettings
+
+
+def test_vectorized_matches_reference(tmp_path):
+    generators.write_catalog(tmp_path / "catalog.txt", 40)
+    generators.write_horizon(tmp_path / "horizon.txt", 1.0)
+    user = UserSettings(
+        observer_latitude=33.4,
+        observer_longitude=-111.8,
+        horizon_file=tmp_path / "horizon.txt",
+        simulation_start=date(2025, 1, 1),
+        simulation_days=60,
+    )
+    rows = catalog.read(tmp_path / "catalog.txt").rows
+    effective_horizon = horizon.load_data(user)
+    night_ephemeris = ephemeris.build(user)
+    block = simulator.make_sim_block(rows, catalog.catalog_names(rows))
+    context = RunContext(user, effective_horizon, night_ephemeris)
+
+    reference = np.array([simulator.simulate_reference(job) for job in simulator.block_jobs(block, context)])
+    vectorized = simulator.calc_time_series(
+        block.object_ra_radians, block.object_dec_radians, effective_horizon, night_ephemeris, user
+    )
+    assert np.any(reference[..., 3] > 0.0)  # Some objects are visible
+    np.testing.assert_array_equal(vectorized[..., 0], reference[..., 0])
+    np.testing.assert_allclose(
+        vectorized[..., 3], reference[..., 3], rtol=0.0, atol=constants.simulation_delta_t_hours + 1e-9
+    )
+    np.testing.assert_allclose(vectorized[..., 4], reference[..., 4], rtol=0.0, atol=0.01)
+    # Min/max altitude: within 1 deg, but on the rare nights where only one engine sees the object, for a single sample
+    altitude_differences = np.abs(vectorized[..., 1:3] - reference[..., 1:3]).max(axis=-1)
+    assert np.mean(altitude_differences > 1.0) < 0.001
@@ -0,0 +1,143 @@
+"""Planning server, on localhost: a real pool and HTTP server, queried by a small asyncio client"""
+
+import asyncio
+import json
+import multiprocessing
+from datetime import date
+
+import pytest
+
+from benchmarks import generators
+from src import api, catalog, constants, server
+from src.models import UserSettings
+
+
+async def query(port: int, path: str, body: dict | None = None) -> tuple[int, dict]:
+    reader, writer = await asyncio.open_connection(constants.server_host, port)
+    content = json.dumps(body).encode() if body is not None else b""
+    method = "POST" if body is not None else "GET"
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(content)}\r\n\r\n".encode() + content
+    )
+    await writer.drain()
+    status_line = await reader.readline()
+    response = await reader.read()
+    writer.close()
+    _, _, body = response.partition(b"\r\n\r\n")
+    return int(status_line.split()[1]), json.loads(body)
+
+
+@pytest.fixture(scope="module")
+def planning_server(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("server")
+    generators.write_catalog(tmp_path / "catalog.txt", 300)
+    user = UserSettings(
+        observer_latitude=33.4, observer_longitude=-111.8, catalog_file=str(tmp_path / "catalog.txt"), pool_size=2
+    )
+    rows = catalog.load(user).rows
+    with multiprocessing.Pool(user.pool_size, initializer=server.init_worker, initargs=(user.catalog_file,)) as pool:
+        yield server.PlanningServer(user, pool, rows)
+
+
+def run_queries(planning_server, queries):
+    # Starts the server on a free port, and runs the queries (async functions of the port) against it
+    async def run():
+        http_server = await asyncio.start_server(planning_server.handle, constants.server_host, 0)
+        port = http_server.sockets[0].getsockname()[1]
+        async with http_server:
+            return await queries(port)
+
+    return asyncio.run(run())
+
+
+def test_health(planning_server):
+    status, response = run_queries(planning_server, lambda port: query(port, "/health"))
+    assert status == 200
+    assert response["status"] == "ok" and response["catalog_objects"] == 300
+
+
+def test_month_coalesces_identical_queries(planning_server):
+    body = {"lat": 33.4, "lon": -111.8, "start": "2025-03-01", "days": 31, "horizon": [[0, 10], [180, 25]]}
+    coalesced = planning_server.num_coalesced
+
+    async def queries(port):
+        return await asyncio.gather(*(query(port, "/month", body) for _ in range(4)))
+
+    answers = run_queries(planning_server, queries)
+    assert [status for status, _ in answers] == [200] * 4
+    assert all(response["dsos"] == answers[0][1]["dsos"] for _, response in answers)
+    assert answers[0][1]["nights"] == ["2025-03-01", "2025-03-31"]
+    assert planning_server.num_coalesced - coalesced == 3
+
+    # Then answered from the results of the site, without simulating again
+    hits, simulated = planning_server.skies.hits, planning_server.num_simulated
+    status, response = run_queries(planning_server, lambda port: query(port, "/month", body))
+    assert status == 200 and response["dsos"] == answers[0][1]["dsos"]
+    assert planning_server.skies.hits == hits + 1 and planning_server.num_simulated == simulated
+
+
+def test_month_filters_the_results_of_the_site(planning_server):
+    # Queries of a site with other filters are answered from its results: looser filters only simulate the objects
+    # they add, and stricter ones nothing. Every answer is the plan api.plan makes with the same settings
+    body = {"lat": -30.2, "lon": -70.7, "start": "2025-05-01", "days": 10, "horizon": [[0, 15], [90, 30]], "top": 300}
+    horizon_data = server.read_horizon(body)[0]
+    strict, loose, between = (
+        {"min_obs_hours": 6, "min_obs_peak_altitude": 50},
+        {"min_obs_hours": 1},
+        {"min_obs_hours": 4},
+    )
+    newly_simulated, simulated = [], []
+    for filters in (strict, loose, between):
+        num_simulated = planning_server.num_simulated
+        status, response = run_queries(planning_server, lambda port: query(port, "/month", body | filters))
+        assert status == 200 and response["included"] > 0
+        newly_simulated.append(planning_server.num_simulated - num_simulated)
+        simulated.append(response["simulated"])
+
+        user = planning_server.make_user(body | filters, simulation_start=date(2025, 5, 1), simulation_days=10)
+        plan = api.plan(user, horizon_data, planning_server.rows)
+        assert response["simulated"] == len(plan.physics)
+        assert sorted(dso["id"] for dso in response["dsos"]) == sorted(plan.dsos["id"].tolist())
+    assert newly_simulated == [simulated[0], simulated[1] - simulated[0], 0] and simulated[1] > simulated[0]
+
+
+def test_tonight(planning_server):
+    status, response = run_queries(
+        planning_server, lambda port: query(port, "/tonight?lat=33.4&lon=-111.8&start=2025-12-01&nights=2")
+    )
+    assert status == 200
+    assert response["found"] > 0
+    # Summer solstice at high latitude: never dark
+    status, response = run_queries(planning_server, lambda port: query(port, "/tonight?lat=56&lon=-3&start=2025-06-20"))
+    assert status == 200 and response["found"] == 0
+
+
+def test_errors(planning_server):
+    async def queries(port):
+        return await asyncio.gather(
+            query(port, "/month?lon=3"), query(port, "/nowhere"), query(port, "/month?lat=1&lon=2&simulation_engine=x")
+        )
+
+    assert [status for status, _ in run_queries(planning_server, queries)] == [400, 404, 400]
+
+
+@pytest.mark.parametrize("error", [ValueError, IndexError])
+def test_failed_planning_job_is_a_server_error(planning_server, monkeypatch, error):
+    # A ValueError or IndexError of the planning is a bug of the server, not of the query: it must not be a 400/404
+    async def fail(*args):
+        if error is ValueError:
+            return await planning_server.run_in_pool(int, "not a number")  # Raised by a pool job
+        raise error("no such row")
+
+    monkeypatch.setattr(planning_server, "compute_plan", fail)
+    status, response = run_queries(planning_server, lambda port: query(port, "/month?lat=1&lon=2&start=2025-06-01"))
+    assert status == 500 and response["error"].startswith(error.__name__)
+
+
+def test_unexpected_error_is_answered(planning_server, monkeypatch):
+    async def fail(params):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(planning_server, "best_tonight", fail)
+    status, response = run_queries(planning_server, lambda port: query(port, "/tonight?lat=1&lon=2"))
+    assert status == 500 and "boom" in response["error"]
@@ -0,0 +1,27 @@
+"""Tonight: nights without darkness, as around the summer solstice at high latitudes"""
+
+from datetime import date
+
+from benchmarks import generators
+from src import api, catalog
+from src.models import UserSettings
+
+
+def make_rows(tmp_path):
+    generators.write_catalog(tmp_path / "catalog.txt", 300)
+    return catalog.read(tmp_path / "catalog.txt").rows
+
+
+def test_no_dark_samples_at_high_latitude_solstice(tmp_path):
+    rows = make_rows(tmp_path)
+    user = UserSettings(observer_latitude=56.0, observer_longitude=-3.0)
+    for start, nights in ((date(2025, 6, 10), 1), (date(2025, 6, 21), 1), (date(2025, 6, 18), 7)):
+        assert api.best_tonight(user, nights, start, catalog_data=rows) == []
+
+
+def test_dark_nights_find_targets(tmp_path):
+    rows = make_rows(tmp_path)
+    user = UserSettings(observer_latitude=56.0, observer_longitude=-3.0)
+    targets = api.best_tonight(user, 3, date(2025, 12, 1), catalog_data=rows)
+    assert targets
+    assert all(target.visible_from < target.visible_to for target in targets)
@@ -0,0 +1,32 @@
+"""Closed-form twilight: dusk and dawn against the iterative search of the reference engine"""
+
+import numpy as np
+import pytest
+
+from src import constants, utils
+from src.models import UserSettings
+
+# Largest difference with the iterative search, as found when the solver was written (hours)
+max_difference_hours = 0.4 / 60.0
+
+
+@pytest.mark.parametrize("latitude", [33.4, -33.4, 0.0, 45.0])
+def test_twilight_matches_iterative_search(latitude):
+    user = UserSettings(observer_latitude=latitude, observer_longitude=-111.8)
+    lon, r_23 = user.observer_longitude_radians, user.r_23
+    t_start = -constants.jan_1_to_equinox_hours  # January 1, as in simulate_reference
+    dusk, dawn = utils.calc_twilight(t_start, 365, user.observer_latitude_radians, lon)
+
+    # Dusk: as simulate_reference moves its clock forward to each dusk, from daylight
+    for night in range(0, 365, 7):
+        t = dusk[night] - 2.0
+        sun_altitude = utils.calc_sun_altitude(t, lon, r_23, constants.r_01)
+        t, _, _ = utils.calc_sunset(t, constants.simulation_delta_t_hours, sun_altitude, lon, r_23, constants.r_01)
+        assert abs(t - constants.simulation_delta_t_hours - dusk[night]) < max_difference_hours
+
+    # Dawn: the iterative search only finds dusks, so check that the Sun crosses the darkness altitude within as much
+    # of the solved dawn
+    before = [utils.calc_sun_altitude(t - max_difference_hours, lon, r_23, constants.r_01) for t in dawn]
+    after = [utils.calc_sun_altitude(t + max_difference_hours, lon, r_23, constants.r_01) for t in dawn]
+    assert np.all(np.array(before) < constants.darkness_sun_altitude)
+    assert np.all(np.array(after) > constants.darkness_sun_altitude)